@@ -0,0 +1,339 @@
+import os
+import sys
+import json
+import time
+import wave
+import array
+import random
+import asyncio
+import argparse
+import collections
+import statistics
+import subprocess
+import websockets
+
+
+# ==========================
+# BENCHMARK END-TO-END
+# ==========================
+#
+# Lanza N clientes sintéticos que hablan el protocolo de ws_audio_client.py
+# (PCM S16_LE en chunks de 20 ms a ritmo real) contra los servidores con
+# backend fake y mide, por frase:
+#
+#   eos_to_stt                fin de habla -> mensaje "stt"
+#   stt_to_translate          "stt" -> "translate"
+#   translate_to_first_audio  "translate" -> primer byte de audio
+#   total                     fin de habla -> primer byte de audio
+#
+# Los resultados se escriben en JSON para comparar entre commits.
+#
+# Sin cachés de traducción ni de audio: el fake STT repite pocas frases y
+# con caché se mediría el acierto, no la ruta translate/TTS.
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SERVERS = {
+    "translator": ("translator", "ws_translator_server.py"),
+    "pcm": ("pcm", "ws_translator_server_stream_tts.py"),
+}
+
+STAGES = ["eos_to_stt", "stt_to_translate", "translate_to_first_audio", "total"]
+
+
+def parse_args():
+    p = argparse.ArgumentParser("WS Translator latency benchmark")
+    p.add_argument("--server", choices=["translator", "pcm", "both"], default="both")
+    p.add_argument("--url", help="Servidor ya levantado (no se lanza ninguno)")
+    p.add_argument("--port", type=int, default=9501)
+
+    p.add_argument("--clients", type=int, default=10)
+    p.add_argument("--utterances", type=int, default=5, help="Frases por cliente")
+    p.add_argument("--wav", help="WAV 16 bit mono a usar como frase (si no, tono sintético)")
+    p.add_argument("--speech-ms", type=int, default=1500)
+    p.add_argument("--gap-ms", type=int, default=3000, help="Silencio tras cada frase")
+
+    p.add_argument("--rate", type=int, default=16000)
+    p.add_argument("--chunk-ms", type=int, default=20)
+    p.add_argument("--seed", type=int, default=1234)
+    p.add_argument("--timeout", type=float, default=10.0, help="Espera extra al final por respuestas")
+
+    p.add_argument("--server-arg", action="append", default=[],
+                   help="Argumento extra para el servidor lanzado (repetible)")
+
+    p.add_argument("--out", default="bench_results.json")
+    p.add_argument("--compare", help="JSON previo contra el que comparar")
+    return p.parse_args()
+
+
+# ==========================
+# AUDIO
+# ==========================
+
+def load_speech(args) -> bytes:
+    if args.wav:
+        with wave.open(args.wav, "rb") as w:
+            if w.getsampwidth() != 2 or w.getnchannels() != 1 or w.getframerate() != args.rate:
+                raise SystemExit(f"{args.wav}: se espera WAV S16_LE mono {args.rate} Hz")
+            return w.readframes(w.getnframes())
+
+    n = int(args.rate * args.speech_ms / 1000)
+    period = [0, 6000, 0, -6000]
+    return array.array("h", (period[i % 4] for i in range(n))).tobytes()
+
+
+def chunked(data: bytes, size: int):
+    for i in range(0, len(data), size):
+        yield data[i:i + size]
+
+
+# ==========================
+# CLIENTE SINTÉTICO
+# ==========================
+
+class ClientStats:
+    def __init__(self):
+        self.samples = {s: [] for s in STAGES}
+        self.sent = 0
+        self.lost = 0
+        self.errors = 0
+
+
+async def run_client(url, args, speech: bytes, stats: ClientStats, start_delay: float):
+    await asyncio.sleep(start_delay)
+
+    chunk_bytes = int(args.rate * args.chunk_ms / 1000) * 2
+    silence = bytes(int(args.rate * args.gap_ms / 1000) * 2)
+    script = (list(chunked(speech, chunk_bytes)), list(chunked(silence, chunk_bytes)))
+
+    pending_eos = []
+    # frases en curso, en orden: con pipeline la N+1 puede reconocerse antes de
+    # que llegue el audio de la N (translate/audio siempre llegan en orden)
+    inflight = collections.deque()
+    done = asyncio.Event()
+
+    async with websockets.connect(url, max_size=None, ping_interval=20, ping_timeout=20) as ws:
+        await ws.recv()  # ready
+
+        async def uplink():
+            loop = asyncio.get_running_loop()
+            t_next = loop.time()
+            for _ in range(args.utterances):
+                for part, is_speech in ((script[0], True), (script[1], False)):
+                    for chunk in part:
+                        await ws.send(chunk)
+                        t_next += args.chunk_ms / 1000
+                        await asyncio.sleep(max(0.0, t_next - loop.time()))
+                    if is_speech:
+                        pending_eos.append(time.perf_counter())
+                        stats.sent += 1
+            await asyncio.sleep(args.timeout)
+            done.set()
+
+        def finish_audio(t):
+            stats.samples["eos_to_stt"].append(t["stt"] - t["eos"])
+            stats.samples["stt_to_translate"].append(t["translate"] - t["stt"])
+            stats.samples["translate_to_first_audio"].append(t["audio"] - t["translate"])
+            stats.samples["total"].append(t["audio"] - t["eos"])
+
+        async def downlink():
+            async for msg in ws:
+                now = time.perf_counter()
+                if isinstance(msg, bytes):
+                    if inflight and "translate" in inflight[0]:
+                        t = inflight.popleft()
+                        t["audio"] = now
+                        finish_audio(t)
+                    continue
+
+                evt = json.loads(msg)
+                kind = evt.get("type")
+                if kind == "stt":
+                    # frase = último fin de habla anterior; las previas se perdieron
+                    eos = [t for t in pending_eos if t <= now]
+                    if not eos:
+                        continue
+                    stats.lost += len(eos) - 1
+                    del pending_eos[:len(eos)]
+                    inflight.append({"eos": eos[-1], "stt": now})
+                elif kind == "translate":
+                    pending = [t for t in inflight if "translate" not in t]
+                    if pending:
+                        pending[0]["translate"] = now
+                elif kind == "error":
+                    stats.errors += 1
+
+        up = asyncio.create_task(uplink())
+        down = asyncio.create_task(downlink())
+        await done.wait()
+        for t in (up, down):
+            t.cancel()
+
+    stats.lost += len(pending_eos)
+
+
+# ==========================
+# SERVIDOR
+# ==========================
+
+def spawn_server(kind, port, extra):
+    folder, script = SERVERS[kind]
+    cmd = [
+        sys.executable, script,
+        "--host", "127.0.0.1",
+        "--port", str(port),
+        "--src-locale", "es-ES",
+        "--tgt-lang", "en",
+        "--tts-voice", "en-US-JennyNeural",
+        "--name", f"BENCH-{kind.upper()}",
+        "--backend", "fake",
+        "--translation-cache-mb", "0",
+        *extra,
+    ]
+    # el servidor pcm lee el default de --port desde PORT
+    env = dict(os.environ, PORT=str(port))
+    env.pop("TTS_CACHE_DIR", None)
+    env.pop("TRANSLATION_CACHE_DB", None)
+    return subprocess.Popen(cmd, cwd=os.path.join(ROOT, folder), env=env, stdout=subprocess.DEVNULL)
+
+
+async def wait_ready(url, proc, timeout=15.0):
+    t_end = time.monotonic() + timeout
+    while time.monotonic() < t_end:
+        if proc is not None and proc.poll() is not None:
+            raise RuntimeError(f"server exited with code {proc.returncode}")
+        try:
+            async with websockets.connect(url) as ws:
+                await ws.recv()
+                return
+        except OSError:
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"server at {url} not ready after {timeout}s")
+
+
+# ==========================
+# RESULTADOS
+# ==========================
+
+def summarize(values):
+    if not values:
+        return None
+    ms = sorted(v * 1000 for v in values)
+    if len(ms) == 1:
+        q = ms * 99
+    else:
+        q = statistics.quantiles(ms, n=100, method="inclusive")
+    return {
+        "n": len(ms),
+        "mean": round(statistics.fmean(ms), 2),
+        "p50": round(q[49], 2),
+        "p95": round(q[94], 2),
+        "p99": round(q[98], 2),
+        "max": round(ms[-1], 2),
+    }
+
+
+async def bench_one(kind, url, args, speech, proc=None):
+    await wait_ready(url, proc)
+
+    rng = random.Random(args.seed)
+    stats = [ClientStats() for _ in range(args.clients)]
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        run_client(url, args, speech, s, rng.uniform(0, args.gap_ms / 1000))
+        for s in stats
+    ))
+    elapsed = time.perf_counter() - started
+
+    merged = {s: [] for s in STAGES}
+    for st in stats:
+        for s in STAGES:
+            merged[s].extend(st.samples[s])
+
+    completed = len(merged["total"])
+    return {
+        "server": kind,
+        "url": url,
+        "clients": args.clients,
+        "utterances_sent": sum(s.sent for s in stats),
+        "utterances_completed": completed,
+        "utterances_lost": sum(s.lost for s in stats),
+        "errors": sum(s.errors for s in stats),
+        "elapsed_s": round(elapsed, 2),
+        "throughput_utt_s": round(completed / elapsed, 2) if elapsed else 0.0,
+        "stages_ms": {s: summarize(merged[s]) for s in STAGES},
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except Exception:
+        return None
+
+
+def print_report(result, baseline=None):
+    print(f"\n[{result['server']}] {result['utterances_completed']}/{result['utterances_sent']} utterances, "
+          f"lost={result['utterances_lost']} errors={result['errors']} "
+          f"throughput={result['throughput_utt_s']}/s")
+    print(f"  {'stage':<26}{'p50':>10}{'p95':>10}{'p99':>10}")
+    for stage in STAGES:
+        s = result["stages_ms"][stage]
+        if not s:
+            print(f"  {stage:<26}{'-':>10}{'-':>10}{'-':>10}")
+            continue
+        line = f"  {stage:<26}{s['p50']:>10.1f}{s['p95']:>10.1f}{s['p99']:>10.1f}"
+        b = (baseline or {}).get("stages_ms", {}).get(stage)
+        if b:
+            line += f"   (p50 {s['p50'] - b['p50']:+.1f} / p95 {s['p95'] - b['p95']:+.1f} / p99 {s['p99'] - b['p99']:+.1f})"
+        print(line)
+
+
+async def main():
+    args = parse_args()
+    speech = load_speech(args)
+
+    kinds = ["translator", "pcm"] if args.server == "both" else [args.server]
+    if args.url:
+        kinds = kinds[:1]
+
+    results = []
+    for i, kind in enumerate(kinds):
+        if args.url:
+            results.append(await bench_one(kind, args.url, args, speech))
+            continue
+
+        port = args.port + i
+        proc = spawn_server(kind, port, args.server_arg)
+        try:
+            results.append(await bench_one(kind, f"ws://127.0.0.1:{port}", args, speech, proc))
+        finally:
+            proc.terminate()
+            try:
+                proc.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = {r["server"]: r for r in json.load(f)["results"]}
+
+    for r in results:
+        print_report(r, baseline.get(r["server"]))
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "params": {k: v for k, v in vars(args).items() if k not in ("out", "compare")},
+        "results": results,
+    }
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nresults written to {args.out}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
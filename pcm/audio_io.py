@@ -0,0 +1,482 @@
+import os
+import stat
+import errno
+import time
+import asyncio
+from collections import deque
+from typing import Optional
+
+try:
+    import alsaaudio
+except ImportError:  # sin pyalsaaudio: arecord/aplay
+    alsaaudio = None
+
+ALSA_AVAILABLE = alsaaudio is not None
+
+
+# ==========================
+# E/S DE AUDIO DE LOS CLIENTES (sin executor)
+# ==========================
+#
+# Tres backends (--audio-backend), todos en el propio event loop:
+#
+#   alsa     pyalsaaudio en proceso, PCM no bloqueante; sus poll fds se
+#            registran en el loop. Sin procesos hijos.
+#   arecord  arecord/aplay como procesos hijos; el pipe de arecord se
+#            registra en el loop (add_reader) y aplay se alimenta por un
+#            pipe asyncio (drain()).
+#   file     dispositivo falso para pruebas: el "dispositivo" de captura es
+#            un fichero PCM raw (se entrega a ritmo de reloj) o un FIFO, y el
+#            de reproducción un fichero o FIFO donde se escribe el PCM.
+#
+# El periodo (--period-ms) y los buffers del dispositivo
+# (--capture-buffer-ms, --device-buffer-ms) son configurables: el audio
+# capturado llega cada periodo (20 ms), no cada segundo como con el antiguo
+# --period-size=16000.
+#
+# La captura se guarda en un anillo de `ring` buffers preasignados de
+# chunk_bytes: nada de bytes nuevos por trama. Cada consumidor pide un
+# lector (reader()) y su read() devuelve un memoryview del chunk completo, válido hasta que el anillo da la vuelta;
+# quien lo use más tarde debe copiarlo (el VAD, el encoder Opus y el
+# enmascarado del WebSocket ya copian). Si el consumidor se atrasa se pisa
+# el chunk más antiguo y se cuenta en `overruns`: la captura nunca bloquea.
+# Varios canales pueden leer el mismo dispositivo: cada lector tiene su
+# propia cola de chunks sobre el mismo anillo, sin copias.
+
+CAPTURE_RING = 8
+XRUN_RETRIES = 3   # -EPIPE seguidos antes de dar el dispositivo por perdido
+BACKENDS = ("alsa", "arecord", "file")
+
+
+def add_audio_args(p):
+    p.add_argument("--audio-backend", choices=BACKENDS,
+                   default=os.getenv("AUDIO_BACKEND", "arecord"),
+                   help="arecord/aplay, alsa (pyalsaaudio en proceso, experimental) "
+                        "o file (fichero/FIFO, para pruebas)")
+    p.add_argument("--period-ms", type=int, default=None,
+                   help="Periodo del dispositivo de captura y reproducción (por defecto --chunk-ms)")
+    p.add_argument("--capture-buffer-ms", type=int, default=80, help="Buffer del dispositivo de captura")
+
+
+async def _wait_writable(fds) -> None:
+    loop = asyncio.get_running_loop()
+    waiter = loop.create_future()
+    for fd in fds:
+        loop.add_writer(fd, lambda: waiter.done() or waiter.set_result(None))
+    try:
+        await waiter
+    finally:
+        for fd in fds:
+            loop.remove_writer(fd)
+
+
+# ==========================
+# CAPTURA
+# ==========================
+
+class CaptureReader:
+    """Cola de chunks de un lector; los chunks son vistas del anillo de la captura."""
+    def __init__(self, capture: "_RingCapture"):
+        self.capture = capture
+        self.ready: deque = deque()
+        self.event = asyncio.Event()
+        self.overruns = 0
+
+    def _push(self, slot: int) -> None:
+        if len(self.ready) == len(self.capture.buffers) - 1:
+            self.ready.popleft()   # el consumidor no llega: se pierde lo más viejo
+            self.overruns += 1
+        self.ready.append(slot)
+        self.event.set()
+
+    def close(self) -> None:
+        self.capture._remove(self)
+
+    async def read(self) -> memoryview:
+        """Siguiente chunk completo. EOFError si la captura terminó."""
+        while not self.ready:
+            if self.capture.eof:
+                raise EOFError("capture ended")
+            self.event.clear()
+            await self.event.wait()
+        return self.capture.views[self.ready.popleft()]
+
+
+class _RingCapture:
+    def __init__(self, chunk_bytes: int, ring=CAPTURE_RING):
+        self.chunk_bytes = chunk_bytes
+        self.buffers = [bytearray(chunk_bytes) for _ in range(ring)]
+        self.views = [memoryview(b) for b in self.buffers]
+        self.slot = 0          # buffer que se está llenando
+        self.filled = 0
+        self.readers = []
+        self.closed_overruns = 0   # de lectores ya cerrados
+        self.eof = False
+        self.xruns = 0         # desbordes del propio dispositivo
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def reader(self) -> CaptureReader:
+        reader = CaptureReader(self)
+        self.readers.append(reader)
+        return reader
+
+    def _remove(self, reader: CaptureReader) -> None:
+        if reader in self.readers:
+            self.readers.remove(reader)
+            self.closed_overruns += reader.overruns
+
+    def _free(self) -> memoryview:
+        """Hueco libre del buffer que se está llenando."""
+        return self.views[self.slot][self.filled:]
+
+    def _commit(self, n: int) -> None:
+        self.filled += n
+        if self.filled < self.chunk_bytes:
+            return
+        for reader in self.readers:
+            reader._push(self.slot)
+        self.slot = (self.slot + 1) % len(self.buffers)
+        self.filled = 0
+
+    def _copy_in(self, data) -> None:
+        """Para backends que entregan sus propios bytes (pyalsaaudio)."""
+        data = memoryview(data)
+        while data:
+            free = self._free()
+            n = min(len(free), len(data))
+            free[:n] = data[:n]
+            data = data[n:]
+            self._commit(n)
+
+    def _finish(self) -> None:
+        self.eof = True
+        for reader in self.readers:
+            reader.event.set()
+
+    @property
+    def overruns(self) -> int:
+        return self.closed_overruns + sum(r.overruns for r in self.readers)
+
+    def stats(self) -> dict:
+        return {"overruns": self.overruns, "xruns": self.xruns}
+
+
+class _PipeCapture(_RingCapture):
+    """Lee un pipe/FIFO registrado en el loop, con readinto() directo al anillo."""
+    file = None
+
+    def _attach(self, fd: int) -> None:
+        self.loop = asyncio.get_running_loop()
+        os.set_blocking(fd, False)
+        self.file = open(fd, "rb", buffering=0, closefd=False)
+        self.loop.add_reader(fd, self._on_readable)
+
+    def _on_readable(self) -> None:
+        while True:
+            try:
+                n = self.file.readinto(self._free())
+            except BlockingIOError:
+                return
+            if n is None:
+                return
+            if n == 0:
+                self._detach()
+                return
+            self._commit(n)
+
+    def _detach(self) -> None:
+        if not self.eof:
+            self.loop.remove_reader(self.file.fileno())
+            self._finish()
+
+
+class ArecordCapture(_PipeCapture):
+    def __init__(self, device: str, rate: int, channels: int, chunk_bytes: int,
+                 period_ms=20, buffer_ms=80, ring=CAPTURE_RING):
+        super().__init__(chunk_bytes, ring)
+        self.cmd = [
+            "arecord",
+            "-D", device,
+            "-f", "S16_LE",
+            "-r", str(rate),
+            "-c", str(channels),
+            "-t", "raw",
+            f"--period-time={period_ms * 1000}",
+            f"--buffer-time={buffer_ms * 1000}",
+        ]
+        self.proc: Optional[asyncio.subprocess.Process] = None
+        self.fd: Optional[int] = None
+
+    async def open(self) -> None:
+        # pipe propio (no el StreamReader de asyncio) para leer con readinto() al anillo
+        self.fd, write_fd = os.pipe()
+        try:
+            self.proc = await asyncio.create_subprocess_exec(
+                *self.cmd, stdout=write_fd, stderr=asyncio.subprocess.DEVNULL,
+            )
+        except BaseException:
+            os.close(self.fd)
+            raise
+        finally:
+            os.close(write_fd)
+        self._attach(self.fd)
+
+    async def close(self) -> None:
+        if self.proc is None:
+            return
+        self._detach()
+        try:
+            self.proc.terminate()
+            await asyncio.wait_for(self.proc.wait(), timeout=2)
+        except (ProcessLookupError, asyncio.TimeoutError):
+            pass
+        os.close(self.fd)
+
+
+class AlsaCapture(_RingCapture):
+    def __init__(self, device: str, rate: int, channels: int, chunk_bytes: int,
+                 period_ms=20, buffer_ms=80, ring=CAPTURE_RING):
+        super().__init__(chunk_bytes, ring)
+        self.device = device
+        self.rate = rate
+        self.channels = channels
+        self.period_frames = rate * period_ms // 1000
+        self.periods = max(2, buffer_ms // period_ms)
+        self.pcm = None
+        self.fds = []
+
+    async def open(self) -> None:
+        self.loop = asyncio.get_running_loop()
+        self.pcm = alsaaudio.PCM(
+            type=alsaaudio.PCM_CAPTURE, mode=alsaaudio.PCM_NONBLOCK, device=self.device,
+            rate=self.rate, channels=self.channels, format=alsaaudio.PCM_FORMAT_S16_LE,
+            periodsize=self.period_frames, periods=self.periods,
+        )
+        self.fds = [fd for fd, _ in self.pcm.polldescriptors()]
+        for fd in self.fds:
+            self.loop.add_reader(fd, self._on_readable)
+
+    def _on_readable(self) -> None:
+        retries = 0
+        while True:
+            try:
+                length, data = self.pcm.read()
+            except alsaaudio.ALSAAudioError as e:
+                self._fail(str(e))
+                return
+            if length == -errno.EPIPE and retries < XRUN_RETRIES:
+                self.xruns += 1   # overrun: pyalsaaudio ya ha vuelto a preparar el PCM
+                retries += 1
+                continue
+            if length < 0:
+                # dispositivo desconectado, -EBADFD...: la captura termina
+                self._fail(os.strerror(-length))
+                return
+            if length == 0:
+                return
+            retries = 0
+            self._copy_in(data)
+
+    def _fail(self, reason: str) -> None:
+        print(f"[alsa] capture {self.device} failed: {reason}", flush=True)
+        self._stop()
+
+    def _stop(self) -> None:
+        if self.pcm is None:
+            return
+        for fd in self.fds:
+            self.loop.remove_reader(fd)
+        self.pcm.close()
+        self.pcm = None
+        self._finish()
+
+    async def close(self) -> None:
+        self._stop()
+
+
+class FileCapture(_PipeCapture):
+    """
+    Dispositivo falso: un FIFO (lo que escriba otro proceso, a su ritmo) o un
+    fichero PCM raw, que se entrega periodo a periodo a ritmo de reloj y
+    termina en EOF.
+    """
+    def __init__(self, path: str, rate: int, channels: int, chunk_bytes: int,
+                 period_ms=20, ring=CAPTURE_RING):
+        super().__init__(chunk_bytes, ring)
+        self.path = path
+        self.period = period_ms / 1000
+        self.period_bytes = rate * period_ms // 1000 * channels * 2
+        self.fd: Optional[int] = None
+        self.task: Optional[asyncio.Task] = None
+
+    async def open(self) -> None:
+        self.fd = os.open(self.path, os.O_RDONLY | os.O_NONBLOCK)
+        if stat.S_ISFIFO(os.fstat(self.fd).st_mode):
+            self._attach(self.fd)
+            return
+        self.loop = asyncio.get_running_loop()
+        self.file = open(self.fd, "rb", buffering=0, closefd=False)
+        self.task = asyncio.create_task(self._paced())
+
+    async def _paced(self) -> None:
+        start = time.monotonic()
+        periods = 0
+        while True:
+            want = self.period_bytes
+            while want:
+                free = self._free()
+                n = self.file.readinto(free[:min(len(free), want)])
+                if not n:
+                    self._finish()
+                    return
+                want -= n
+                self._commit(n)
+            periods += 1
+            await asyncio.sleep(max(0.0, start + periods * self.period - time.monotonic()))
+
+    async def close(self) -> None:
+        if self.fd is None:
+            return
+        if self.task is not None:
+            self.task.cancel()
+            self._finish()
+        else:
+            self._detach()
+        os.close(self.fd)
+        self.fd = None
+
+
+def open_capture(args, device: str, chunk_bytes: int):
+    period_ms = args.period_ms or args.chunk_ms
+    if args.audio_backend == "file":
+        return FileCapture(device, args.rate, args.channels, chunk_bytes, period_ms)
+    if args.audio_backend == "alsa":
+        if not ALSA_AVAILABLE:
+            raise RuntimeError("--audio-backend alsa needs pyalsaaudio (pip install pyalsaaudio)")
+        return AlsaCapture(device, args.rate, args.channels, chunk_bytes, period_ms, args.capture_buffer_ms)
+    return ArecordCapture(device, args.rate, args.channels, chunk_bytes, period_ms, args.capture_buffer_ms)
+
+
+# ==========================
+# REPRODUCCIÓN
+# ==========================
+#
+# La interfaz que usa playback.PlaybackEngine: open(), write(pcm), close().
+# El motor ya marca el ritmo; write() sólo espera si el dispositivo está lleno.
+
+class AplayOutput:
+    """aplay -t raw persistente alimentado por un pipe asyncio."""
+    def __init__(self, device: str, rate: int, channels: int, buffer_ms: int, period_ms=20):
+        self.cmd = [
+            "aplay",
+            "-D", device,
+            "-t", "raw",
+            "-f", "S16_LE",
+            "-r", str(rate),
+            "-c", str(channels),
+            f"--period-time={period_ms * 1000}",
+            f"--buffer-time={buffer_ms * 1000}",
+            "-",
+        ]
+        self.proc: Optional[asyncio.subprocess.Process] = None
+
+    async def open(self) -> None:
+        self.proc = await asyncio.create_subprocess_exec(
+            *self.cmd, stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL,
+        )
+
+    async def write(self, data) -> None:
+        self.proc.stdin.write(data)
+        await self.proc.stdin.drain()
+
+    async def close(self) -> None:
+        if self.proc is None:
+            return
+        try:
+            self.proc.stdin.close()
+            self.proc.terminate()
+            await asyncio.wait_for(self.proc.wait(), timeout=2)
+        except (ProcessLookupError, asyncio.TimeoutError):
+            pass
+
+
+class AlsaOutput:
+    """PCM de reproducción no bloqueante; con el buffer lleno se espera a su poll fd."""
+    def __init__(self, device: str, rate: int, channels: int, buffer_ms: int, period_ms=20):
+        self.device = device
+        self.rate = rate
+        self.channels = channels
+        self.frame_bytes = channels * 2
+        self.period_frames = rate * period_ms // 1000
+        # el motor escribe buffer_ms por delante: tienen que caber en el dispositivo
+        self.periods = max(2, buffer_ms // period_ms + 1)
+        self.pcm = None
+        self.fds = []
+        self.underruns = 0
+
+    async def open(self) -> None:
+        self.pcm = alsaaudio.PCM(
+            type=alsaaudio.PCM_PLAYBACK, mode=alsaaudio.PCM_NONBLOCK, device=self.device,
+            rate=self.rate, channels=self.channels, format=alsaaudio.PCM_FORMAT_S16_LE,
+            periodsize=self.period_frames, periods=self.periods,
+        )
+        self.fds = [fd for fd, _ in self.pcm.polldescriptors()]
+
+    async def write(self, data) -> None:
+        data = memoryview(data)
+        retries = 0
+        while data:
+            frames = self.pcm.write(data)
+            if frames == -errno.EPIPE and retries < XRUN_RETRIES:
+                self.underruns += 1   # underrun: pyalsaaudio vuelve a preparar; se reintenta
+                retries += 1
+                continue
+            if frames < 0:
+                raise OSError(-frames, f"playback {self.device}: {os.strerror(-frames)}")
+            if frames == 0:
+                await _wait_writable(self.fds)
+                continue
+            retries = 0
+            data = data[frames * self.frame_bytes:]
+
+    async def close(self) -> None:
+        if self.pcm is not None:
+            self.pcm.close()
+            self.pcm = None
+
+
+class FileOutput:
+    """Dispositivo falso: escribe el PCM en un fichero (se trunca) o en un FIFO."""
+    def __init__(self, path: str):
+        self.path = path
+        self.fd: Optional[int] = None
+
+    async def open(self) -> None:
+        # un FIFO bloquea aquí hasta que haya lector
+        self.fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        os.set_blocking(self.fd, False)
+
+    async def write(self, data) -> None:
+        data = memoryview(data)
+        while data:
+            try:
+                data = data[os.write(self.fd, data):]
+            except BlockingIOError:
+                await _wait_writable([self.fd])
+
+    async def close(self) -> None:
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+def open_playback(args, device: str):
+    period_ms = args.period_ms or args.chunk_ms
+    if args.audio_backend == "file":
+        return FileOutput(device)
+    if args.audio_backend == "alsa":
+        if not ALSA_AVAILABLE:
+            raise RuntimeError("--audio-backend alsa needs pyalsaaudio (pip install pyalsaaudio)")
+        return AlsaOutput(device, args.rate, args.channels, args.device_buffer_ms, period_ms)
+    return AplayOutput(device, args.rate, args.channels, args.device_buffer_ms, period_ms)
@@ -0,0 +1,871 @@
+import io
+import os
+import json
+import wave
+import array
+import argparse
+import random
+import asyncio
+import contextlib
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import aiohttp
+import azure.cognitiveservices.speech as speechsdk
+
+import metrics
+from batching import BatchingTranslator
+from cache import TranslationCache, CachedTranslator, AudioCache, CachedTts
+from vad import VadStt, DEFAULT_PAD_MS
+from codec import OggOpusDemuxer, OpusEncoder, encode_pcm, pack_packets
+
+
+# ==========================
+# BACKENDS STT / TRANSLATE / TTS
+# ==========================
+#
+# Los servidores no llaman a Azure directamente: usan tres backends con la
+# misma interfaz para que podamos cambiar Azure por fakes locales y medir
+# el pipeline sin red.
+#
+#   stt.open(loop, locale, sample_rate, channels, on_recognized, on_partial=None) -> sesión
+#       sesión.write(chunk) / sesión.end_turn() / sesión.close()
+#       end_turn() cierra el turno en curso sin esperar el silencio en
+#       tiempo real (o mantiene viva la sesión si no había voz).
+#       on_recognized(text) / on_partial(hipótesis) pueden llamarse desde cualquier hilo.
+#
+#   await translator.translate(text, tgt_lang, src_lang=None) -> str
+#   await translator.translate_multi(text, tgt_langs, src_lang=None) -> {lang: str}
+#   await translator.translate_many(texts, tgt_langs, src_lang=None) -> [{lang: str}]
+#       src_lang=None deja que el servicio detecte el idioma de origen.
+#   await translator.close()
+#
+#   await tts.synthesize(text, voice, codec="wav") -> WAV (RIFF), bytes o memoryview
+#   await tts.stream(text, voice, on_chunk, codec="pcm") -> bool
+#       on_chunk(pcm) se llama SIEMPRE en el event loop (bytes o memoryview).
+#       Con codec="opus": synthesize() devuelve codec.pack_packets(...) y
+#       on_chunk recibe un paquete Opus por llamada.
+
+
+TRANSLATOR_URL = "https://api.cognitive.microsofttranslator.com/translate?api-version=3.0"
+
+WAV_FORMAT = speechsdk.SpeechSynthesisOutputFormat.Riff16Khz16BitMonoPcm
+PCM_FORMAT = speechsdk.SpeechSynthesisOutputFormat.Raw16Khz16BitMonoPcm
+OPUS_FORMAT = speechsdk.SpeechSynthesisOutputFormat.Ogg16Khz16BitMonoOpus
+
+# formatos que se sintetizan por PushAudioOutputStream (streaming)
+STREAM_FORMATS = (PCM_FORMAT, OPUS_FORMAT)
+
+
+# ==========================
+# AZURE
+# ==========================
+
+def _is_error(details) -> bool:
+    return details is not None and details.reason == speechsdk.CancellationReason.Error
+
+
+def _count_tts_failure(result) -> None:
+    if result.reason == speechsdk.ResultReason.Canceled:
+        metrics.CANCELLATIONS.inc(service="tts")
+        if _is_error(result.cancellation_details):
+            metrics.AZURE_ERRORS.inc(service="tts")
+    else:
+        metrics.AZURE_ERRORS.inc(service="tts")
+
+
+class AzureSttSession:
+    def __init__(self, loop, speech_key, speech_region, locale, sample_rate, channels,
+                 on_recognized: Callable[[str], None], segmentation_ms: Optional[int] = None,
+                 auto_restart: bool = False, on_partial: Optional[Callable[[str], None]] = None):
+        self.loop = loop
+        # silencio que dispara la segmentación del SDK, empujado de golpe en end_turn()
+        bytes_per_ms = sample_rate * channels * 2 // 1000
+        self.pad = bytes(bytes_per_ms * (segmentation_ms or DEFAULT_PAD_MS))
+        self.keepalive = bytes(bytes_per_ms * 20)
+        self.pending = False
+
+        speech_config = speechsdk.SpeechConfig(subscription=speech_key, region=speech_region)
+        speech_config.speech_recognition_language = locale
+        if segmentation_ms:
+            speech_config.set_property(
+                speechsdk.PropertyId.Speech_SegmentationSilenceTimeoutMs,
+                str(segmentation_ms)
+            )
+
+        fmt = speechsdk.audio.AudioStreamFormat(
+            samples_per_second=sample_rate,
+            bits_per_sample=16,
+            channels=channels
+        )
+        self.push_stream = speechsdk.audio.PushAudioInputStream(fmt)
+        audio_config = speechsdk.audio.AudioConfig(stream=self.push_stream)
+
+        self.recognizer = speechsdk.SpeechRecognizer(
+            speech_config=speech_config,
+            audio_config=audio_config
+        )
+
+        def _on_recognized(evt):
+            try:
+                if evt.result.reason != speechsdk.ResultReason.RecognizedSpeech:
+                    return
+                text = (evt.result.text or "").strip()
+                if text:
+                    on_recognized(text)
+            except Exception:
+                pass
+
+        self.recognizer.recognized.connect(_on_recognized)
+
+        if on_partial is not None:
+            def _on_recognizing(evt):
+                try:
+                    text = (evt.result.text or "").strip()
+                    if text:
+                        on_partial(text)
+                except Exception:
+                    pass
+
+            self.recognizer.recognizing.connect(_on_recognizing)
+
+        def _count_canceled(evt):
+            metrics.CANCELLATIONS.inc(service="stt")
+            if _is_error(getattr(evt, "cancellation_details", None)):
+                metrics.AZURE_ERRORS.inc(service="stt")
+
+        self.recognizer.canceled.connect(_count_canceled)
+
+        if auto_restart:
+            def on_canceled(evt):
+                print("STT canceled:", evt)
+                loop.call_soon_threadsafe(self._restart)
+
+            def on_session_stopped(evt):
+                print("STT session stopped")
+                loop.call_soon_threadsafe(self._restart)
+
+            self.recognizer.canceled.connect(on_canceled)
+            self.recognizer.session_stopped.connect(on_session_stopped)
+
+        self.recognizer.start_continuous_recognition()
+
+    def _restart(self):
+        try:
+            self.recognizer.stop_continuous_recognition()
+        except Exception:
+            pass
+        self.recognizer.start_continuous_recognition()
+
+    def write(self, chunk: bytes) -> None:
+        self.pending = True
+        self.push_stream.write(chunk)
+
+    def end_turn(self) -> None:
+        self.push_stream.write(self.pad if self.pending else self.keepalive)
+        self.pending = False
+
+    def close(self) -> None:
+        try:
+            self.push_stream.close()
+        except Exception:
+            pass
+        try:
+            self.recognizer.stop_continuous_recognition()
+        except Exception:
+            pass
+
+
+class AzureStt:
+    def __init__(self, speech_key, speech_region, segmentation_ms=None, auto_restart=False):
+        self.speech_key = speech_key
+        self.speech_region = speech_region
+        self.segmentation_ms = segmentation_ms
+        self.auto_restart = auto_restart
+
+    def open(self, loop, locale, sample_rate, channels, on_recognized, on_partial=None):
+        return AzureSttSession(
+            loop, self.speech_key, self.speech_region, locale, sample_rate, channels,
+            on_recognized, segmentation_ms=self.segmentation_ms, auto_restart=self.auto_restart,
+            on_partial=on_partial
+        )
+
+
+class AzureTranslator:
+    """
+    Cliente único por proceso para Translator: una sola ClientSession con
+    pool de conexiones keep-alive, caché DNS y headers/URLs precalculados,
+    compartida por todas las conexiones WS.
+    """
+    def __init__(self, key, region, pool_size=32, keepalive=60.0, dns_ttl=300):
+        self.headers = {
+            "Ocp-Apim-Subscription-Key": key,
+            "Ocp-Apim-Subscription-Region": region,
+            "Content-Type": "application/json",
+        }
+        self.pool_size = pool_size
+        self.keepalive = keepalive
+        self.dns_ttl = dns_ttl
+
+        self.urls = {}
+        self.session = None
+        self.requests = 0
+        self.errors = 0
+        self.inflight = 0   # peticiones en curso (con conexión o esperándola)
+
+    def _session(self) -> aiohttp.ClientSession:
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.pool_size,
+                limit_per_host=self.pool_size,
+                ttl_dns_cache=self.dns_ttl,
+                keepalive_timeout=self.keepalive,
+                enable_cleanup_closed=True,
+            )
+            self.session = aiohttp.ClientSession(
+                connector=connector,
+                headers=self.headers,
+                timeout=aiohttp.ClientTimeout(total=10),
+            )
+        return self.session
+
+    def _url(self, tgt_langs: Tuple[str, ...], src_lang: Optional[str]) -> str:
+        url = self.urls.get((src_lang, tgt_langs))
+        if url is None:
+            url = TRANSLATOR_URL + "".join(f"&to={lang}" for lang in tgt_langs)
+            if src_lang:
+                url += f"&from={src_lang}"
+            self.urls[(src_lang, tgt_langs)] = url
+        return url
+
+    async def translate(self, text: str, tgt_lang: str, src_lang: Optional[str] = None) -> str:
+        return (await self.translate_many([text], (tgt_lang,), src_lang))[0][tgt_lang]
+
+    async def translate_multi(self, text: str, tgt_langs: Sequence[str],
+                              src_lang: Optional[str] = None) -> Dict[str, str]:
+        return (await self.translate_many([text], tgt_langs, src_lang))[0]
+
+    async def translate_many(self, texts: List[str], tgt_langs: Sequence[str],
+                             src_lang: Optional[str] = None) -> List[Dict[str, str]]:
+        """Una sola petición: varios textos x varios idiomas (`to=` repetido)."""
+        self.requests += 1
+        self.inflight += 1
+        try:
+            body = [{"Text": text} for text in texts]
+            async with self._session().post(self._url(tuple(tgt_langs), src_lang), json=body) as resp:
+                resp.raise_for_status()
+                data = await resp.json()
+                return [
+                    {t["to"]: t["text"] for t in item["translations"]}
+                    for item in data
+                ]
+        except Exception:
+            self.errors += 1
+            metrics.AZURE_ERRORS.inc(service="translator")
+            raise
+        finally:
+            self.inflight -= 1
+
+    async def close(self) -> None:
+        if self.session is not None:
+            await self.session.close()
+
+    def stats(self) -> dict:
+        # contadas aquí: el connector de aiohttp no las expone públicamente
+        in_use = min(self.inflight, self.pool_size)
+        return {
+            "pool_size": self.pool_size,
+            "in_use": in_use,
+            "waiting": self.inflight - in_use,
+            "utilization": round(in_use / self.pool_size, 3) if self.pool_size else 0.0,
+            "requests": self.requests,
+            "errors": self.errors,
+        }
+
+
+class TtsPushCallback(speechsdk.audio.PushAudioOutputStreamCallback):
+    """
+    Azure TTS irá llamando write(audio_buffer) mientras va sintetizando.
+    Nosotros reenviamos esos bytes al event loop (on_chunk). El sintetizador
+    se reutiliza entre frases, así que on_chunk se reasigna en cada una.
+    """
+    def __init__(self, loop: asyncio.AbstractEventLoop, on_chunk: Optional[Callable[[bytes], None]] = None):
+        super().__init__()
+        self.loop = loop
+        self.on_chunk = on_chunk
+        self.closed = False
+
+    def write(self, audio_buffer: memoryview) -> int:
+        on_chunk = self.on_chunk
+        if self.closed or on_chunk is None:
+            return len(audio_buffer)
+        data = bytes(audio_buffer)
+        # thread-safe -> event loop
+        self.loop.call_soon_threadsafe(on_chunk, data)
+        return len(data)
+
+    def close(self) -> None:
+        self.closed = True
+
+
+def build_synthesizer(speech_key, speech_region, tts_voice, output_format=WAV_FORMAT, audio_config=None):
+    config = speechsdk.SpeechConfig(subscription=speech_key, region=speech_region)
+    config.speech_synthesis_voice_name = tts_voice
+    config.set_speech_synthesis_output_format(output_format)
+    return speechsdk.SpeechSynthesizer(speech_config=config, audio_config=audio_config)
+
+
+def build_streaming_synth(loop, on_chunk, speech_key, speech_region, tts_voice, output_format=PCM_FORMAT):
+    cb = TtsPushCallback(loop, on_chunk)
+    push_stream = speechsdk.audio.PushAudioOutputStream(cb)
+    audio_out = speechsdk.audio.AudioConfig(stream=push_stream)
+
+    # CRÍTICO: salida RAW PCM (no RIFF/WAV) u Ogg/Opus para stream real
+    synth = build_synthesizer(speech_key, speech_region, tts_voice, output_format, audio_out)
+    return synth, cb
+
+
+# ==========================
+# POOL DE SINTETIZADORES
+# ==========================
+
+class PooledSynth:
+    """
+    Sintetizador + conexión abierta al servicio. La conexión se pre-abre
+    (Connection.open) para que la primera frase no pague el handshake;
+    `healthy` pasa a False si el servicio la cierra.
+    """
+    def __init__(self, synth, callback: Optional[TtsPushCallback] = None):
+        self.synth = synth
+        self.callback = callback
+        self.healthy = False
+        self.uses = 0
+
+        self.connection = speechsdk.Connection.from_speech_synthesizer(synth)
+        self.connection.connected.connect(lambda evt: setattr(self, "healthy", True))
+        self.connection.disconnected.connect(lambda evt: setattr(self, "healthy", False))
+
+    def connect(self) -> None:
+        """Bloqueante: abrir (o reabrir) la conexión."""
+        self.connection.open(True)
+        self.healthy = True
+
+
+class SynthesizerPool:
+    """
+    Pool por proceso de sintetizadores Azure, indexado por (voz, formato).
+    Cada clave tiene como máximo `max_size` instancias; si están todas en
+    uso, acquire() espera. Las instancias ociosas se revisan cada
+    `health_interval` segundos y se reconectan si el servicio las cerró.
+    """
+    def __init__(self, speech_key, speech_region, max_size=4, health_interval=30.0):
+        self.speech_key = speech_key
+        self.speech_region = speech_region
+        self.max_size = max_size
+        self.health_interval = health_interval
+
+        self.idle = {}       # key -> [PooledSynth]
+        self.slots = {}      # key -> asyncio.Semaphore
+        self.created = {}    # key -> int
+        self.health_task = None
+
+    def _slots(self, key):
+        if key not in self.slots:
+            self.slots[key] = asyncio.Semaphore(self.max_size)
+            self.idle[key] = []
+            self.created[key] = 0
+        return self.slots[key]
+
+    def _build(self, loop, voice, output_format) -> PooledSynth:
+        if output_format in STREAM_FORMATS:
+            synth, cb = build_streaming_synth(loop, None, self.speech_key, self.speech_region, voice, output_format)
+            pooled = PooledSynth(synth, cb)
+        else:
+            pooled = PooledSynth(build_synthesizer(self.speech_key, self.speech_region, voice, output_format))
+        pooled.connect()
+        return pooled
+
+    async def _checkout(self, voice, output_format) -> PooledSynth:
+        loop = asyncio.get_running_loop()
+        key = (voice, output_format)
+        await self._slots(key).acquire()
+        try:
+            idle = self.idle[key]
+            while idle:
+                pooled = idle.pop()
+                if not pooled.healthy:
+                    try:
+                        await loop.run_in_executor(None, pooled.connect)
+                    except BaseException as e:
+                        # se descarta (como en _health_loop): deja de contar en created
+                        self.created[key] -= 1
+                        if not isinstance(e, Exception):
+                            raise
+                        print(f"TTS pool: reconnect failed for {voice}: {e}")
+                        continue
+                return pooled
+
+            pooled = await loop.run_in_executor(None, self._build, loop, voice, output_format)
+            self.created[key] += 1
+            return pooled
+        except BaseException:
+            self.slots[key].release()
+            raise
+
+    def _checkin(self, voice, output_format, pooled: Optional[PooledSynth]) -> None:
+        key = (voice, output_format)
+        if pooled is not None:
+            if pooled.callback is not None:
+                pooled.callback.on_chunk = None
+            self.idle[key].append(pooled)
+        else:
+            self.created[key] -= 1
+        self.slots[key].release()
+
+    @contextlib.asynccontextmanager
+    async def acquire(self, voice, output_format):
+        pooled = await self._checkout(voice, output_format)
+        try:
+            yield pooled
+        except BaseException:
+            # estado desconocido (cancelación a mitad de frase, error SDK): se descarta
+            self._checkin(voice, output_format, None)
+            raise
+        else:
+            pooled.uses += 1
+            self._checkin(voice, output_format, pooled)
+
+    async def warmup(self, voice, output_format, count=1) -> None:
+        """Crea y conecta `count` sintetizadores antes de aceptar clientes."""
+        count = min(count, self.max_size)
+        held = [await self._checkout(voice, output_format) for _ in range(count)]
+        for pooled in held:
+            self._checkin(voice, output_format, pooled)
+
+        if self.health_task is None and self.health_interval:
+            self.health_task = asyncio.create_task(self._health_loop())
+
+    async def _health_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.health_interval)
+            for key, idle in self.idle.items():
+                for pooled in list(idle):
+                    if pooled.healthy:
+                        continue
+                    try:
+                        await loop.run_in_executor(None, pooled.connect)
+                    except Exception as e:
+                        print(f"TTS pool: reconnect failed for {key[0]}: {e}")
+                        if pooled in idle:
+                            idle.remove(pooled)
+                            self.created[key] -= 1
+
+    def stats(self) -> dict:
+        return {
+            f"{voice}/{fmt.name}": {
+                "created": self.created[(voice, fmt)],
+                "idle": len(self.idle[(voice, fmt)]),
+                "healthy": sum(p.healthy for p in self.idle[(voice, fmt)]),
+            }
+            for voice, fmt in self.slots
+        }
+
+
+class AzureTts:
+    def __init__(self, speech_key, speech_region, pool_size=4):
+        self.pool = SynthesizerPool(speech_key, speech_region, max_size=pool_size)
+
+    async def warmup(self, voice: str, streaming: bool, count=1) -> None:
+        # Opus es opt-in: su pool se crea al llegar la primera sesión Opus
+        await self.pool.warmup(voice, PCM_FORMAT if streaming else WAV_FORMAT, count)
+
+    def stats(self) -> dict:
+        return {"pool": self.pool.stats()}
+
+    async def synthesize(self, text: str, voice: str, codec: str = "wav") -> bytes:
+        if codec == "opus":
+            packets = []
+            if not await self.stream(text, voice, packets.append, codec="opus"):
+                raise RuntimeError("TTS failed")
+            return pack_packets(packets)
+
+        loop = asyncio.get_running_loop()
+
+        async with self.pool.acquire(voice, WAV_FORMAT) as pooled:
+            result = await loop.run_in_executor(
+                None,
+                lambda: pooled.synth.speak_text_async(text).get()
+            )
+
+        if result.reason != speechsdk.ResultReason.SynthesizingAudioCompleted:
+            _count_tts_failure(result)
+            raise RuntimeError("TTS failed")
+
+        return result.audio_data
+
+    async def stream(self, text: str, voice: str, on_chunk: Callable[[bytes], None], codec: str = "pcm") -> bool:
+        loop = asyncio.get_running_loop()
+        output_format = PCM_FORMAT
+        if codec == "opus":
+            # el servicio manda Ogg/Opus: reenviamos paquetes sueltos
+            output_format = OPUS_FORMAT
+            demuxer = OggOpusDemuxer()
+            on_packet = on_chunk
+
+            def on_chunk(data):
+                for packet in demuxer.feed(data):
+                    on_packet(packet)
+
+        async with self.pool.acquire(voice, output_format) as pooled:
+            pooled.callback.on_chunk = on_chunk
+            pooled.callback.closed = False
+
+            # speak_text_async().get() bloquea, así que lo hacemos en executor
+            def _do_speak():
+                return pooled.synth.speak_text_async(text).get()
+
+            result = await loop.run_in_executor(None, _do_speak)
+
+        if result.reason != speechsdk.ResultReason.SynthesizingAudioCompleted:
+            _count_tts_failure(result)
+            return False
+        return True
+
+
+# ==========================
+# FAKES (load testing)
+# ==========================
+
+FAKE_PHRASES = [
+    "hola",
+    "gracias",
+    "sí",
+    "puedes repetir eso",
+    "buenos días a todos",
+    "vamos a empezar la reunión",
+    "no te escucho bien",
+    "muchas gracias por venir hoy",
+]
+
+
+class Jitter:
+    """Latencias deterministas: base ± jitter con semilla fija."""
+    def __init__(self, base_ms: float, jitter_ms: float, rng: random.Random):
+        self.base_ms = base_ms
+        self.jitter_ms = jitter_ms
+        self.rng = rng
+
+    def seconds(self) -> float:
+        ms = self.base_ms + self.rng.uniform(-self.jitter_ms, self.jitter_ms)
+        return max(0.0, ms) / 1000.0
+
+
+class FakeSttSession:
+    """
+    Detecta fin de habla por energía (pico de muestras S16_LE) y, tras
+    `segmentation_ms` de silencio, emite una frase fija con la latencia
+    configurada. Con `on_partial`, mientras dura la voz emite cada
+    `partial_ms` una hipótesis con una palabra más de la frase.
+    Todo ocurre en el event loop: no crea hilos.
+    """
+    def __init__(self, loop, sample_rate, channels, on_recognized, latency: Jitter, rng: random.Random,
+                 segmentation_ms=800, threshold=500, on_partial=None, partial_ms=250):
+        self.loop = loop
+        self.bytes_per_ms = sample_rate * channels * 2 / 1000
+        self.on_recognized = on_recognized
+        self.on_partial = on_partial
+        self.partial_ms = partial_ms
+        self.latency = latency
+        self.rng = rng
+        self.segmentation_ms = segmentation_ms
+        self.threshold = threshold
+
+        self.in_speech = False
+        self.silence_ms = 0.0
+        self.speech_ms = 0.0
+        self.phrase = None
+        self.handles = []
+        self.closed = False
+
+    def write(self, chunk: bytes) -> None:
+        if self.closed or not chunk:
+            return
+        samples = array.array("h", chunk[: len(chunk) - len(chunk) % 2])
+        peak = max(max(samples, default=0), -min(samples, default=0))
+
+        if peak >= self.threshold:
+            if not self.in_speech and self.on_partial is not None:
+                self.phrase = self.rng.choice(FAKE_PHRASES)
+                self.speech_ms = 0.0
+            self.in_speech = True
+            self.silence_ms = 0.0
+            if self.on_partial is not None:
+                self._partial(len(chunk) / self.bytes_per_ms)
+            return
+
+        if not self.in_speech:
+            return
+
+        self.silence_ms += len(chunk) / self.bytes_per_ms
+        if self.silence_ms >= self.segmentation_ms:
+            self.in_speech = False
+            self.silence_ms = 0.0
+            text = self.phrase or self.rng.choice(FAKE_PHRASES)
+            self.phrase = None
+            self.handles = [h for h in self.handles if not h.cancelled()]
+            self.handles.append(self.loop.call_later(self.latency.seconds(), self._emit, text))
+
+    def _partial(self, ms: float) -> None:
+        before = int(self.speech_ms // self.partial_ms)
+        self.speech_ms += ms
+        if int(self.speech_ms // self.partial_ms) > before:
+            words = self.phrase.split()
+            self.on_partial(" ".join(words[:min(len(words), before + 1)]))
+
+    def end_turn(self) -> None:
+        if self.in_speech:
+            self.write(bytes(int(self.segmentation_ms * self.bytes_per_ms)))
+
+    def _emit(self, text):
+        if not self.closed:
+            self.on_recognized(text)
+
+    def close(self) -> None:
+        self.closed = True
+        for h in self.handles:
+            h.cancel()
+        self.handles.clear()
+
+
+class FakeStt:
+    def __init__(self, latency: Jitter, rng: random.Random, segmentation_ms=800):
+        self.latency = latency
+        self.rng = rng
+        self.segmentation_ms = segmentation_ms
+
+    def open(self, loop, locale, sample_rate, channels, on_recognized, on_partial=None):
+        return FakeSttSession(
+            loop, sample_rate, channels, on_recognized, self.latency, self.rng,
+            segmentation_ms=self.segmentation_ms, on_partial=on_partial
+        )
+
+
+class FakeTranslator:
+    def __init__(self, latency: Jitter):
+        self.latency = latency
+        self.requests = 0
+
+    async def translate(self, text: str, tgt_lang: str, src_lang: Optional[str] = None) -> str:
+        return (await self.translate_many([text], (tgt_lang,), src_lang))[0][tgt_lang]
+
+    async def translate_multi(self, text: str, tgt_langs: Sequence[str],
+                              src_lang: Optional[str] = None) -> Dict[str, str]:
+        return (await self.translate_many([text], tgt_langs, src_lang))[0]
+
+    async def translate_many(self, texts: List[str], tgt_langs: Sequence[str],
+                             src_lang: Optional[str] = None) -> List[Dict[str, str]]:
+        self.requests += 1
+        await asyncio.sleep(self.latency.seconds())
+        return [{lang: f"[{lang}] {text}" for lang in tgt_langs} for text in texts]
+
+    async def close(self) -> None:
+        pass
+
+    def stats(self) -> dict:
+        return {"requests": self.requests}
+
+
+class FakeTts:
+    """
+    Genera un tono de duración proporcional al texto. `latency` es el
+    tiempo hasta el primer byte; el resto sale `speed` veces más rápido
+    que tiempo real, como hace el servicio.
+    """
+    def __init__(self, latency: Jitter, sample_rate=16000, ms_per_char=60, chunk_ms=100, speed=10.0):
+        self.latency = latency
+        self.sample_rate = sample_rate
+        self.ms_per_char = ms_per_char
+        self.chunk_ms = chunk_ms
+        self.speed = speed
+
+        period = array.array("h", [3000, 0, -3000, 0] * (sample_rate // 1600))
+        self.period = period.tobytes()
+
+    async def warmup(self, voice: str, streaming: bool, count=1) -> None:
+        pass
+
+    def pcm_for(self, text: str) -> bytes:
+        n_bytes = int(self.sample_rate * len(text) * self.ms_per_char / 1000) * 2
+        reps = n_bytes // len(self.period) + 1
+        return (self.period * reps)[:n_bytes]
+
+    async def synthesize(self, text: str, voice: str, codec: str = "wav") -> bytes:
+        await asyncio.sleep(self.latency.seconds())
+        if codec == "opus":
+            return pack_packets(encode_pcm(self.pcm_for(text), self.sample_rate))
+        buf = io.BytesIO()
+        with wave.open(buf, "wb") as w:
+            w.setnchannels(1)
+            w.setsampwidth(2)
+            w.setframerate(self.sample_rate)
+            w.writeframes(self.pcm_for(text))
+        return buf.getvalue()
+
+    async def stream(self, text: str, voice: str, on_chunk: Callable[[bytes], None], codec: str = "pcm") -> bool:
+        await asyncio.sleep(self.latency.seconds())
+        encoder = OpusEncoder(self.sample_rate) if codec == "opus" else None
+        pcm = self.pcm_for(text)
+        step = int(self.sample_rate * self.chunk_ms / 1000) * 2
+        for i in range(0, len(pcm), step):
+            if i:
+                await asyncio.sleep(self.chunk_ms / 1000 / self.speed)
+            if encoder is None:
+                on_chunk(pcm[i:i + step])
+                continue
+            last = i + step >= len(pcm)
+            for packet in encoder.encode(pcm[i:i + step]) + (encoder.flush() if last else []):
+                on_chunk(packet)
+        return True
+
+
+# ==========================
+# FACTORY
+# ==========================
+
+@dataclass
+class Backends:
+    stt: object
+    translator: object
+    tts: object
+
+    def stats(self) -> dict:
+        return {
+            name: backend.stats()
+            for name, backend in (("stt", self.stt), ("translator", self.translator), ("tts", self.tts))
+            if hasattr(backend, "stats")
+        }
+
+    async def close(self) -> None:
+        await self.translator.close()
+
+
+async def report_stats(name, backends: Backends, interval: float, extra=None, sink=None):
+    """
+    Cada `interval` s junta las estadísticas de los backends (más `extra()`)
+    y las imprime como una línea JSON, o se las pasa a `sink` (modo workers).
+    """
+    while True:
+        await asyncio.sleep(interval)
+        stats = backends.stats()
+        if extra is not None:
+            stats.update(extra())
+        if sink is not None:
+            sink(stats)
+        else:
+            print(f"[{name}] stats", json.dumps(stats, ensure_ascii=False), flush=True)
+
+
+def add_backend_args(p):
+    p.add_argument("--backend", choices=["azure", "fake"], default=os.getenv("BACKEND", "azure"))
+    p.add_argument("--tts-pool-size", type=int, default=4, help="Sintetizadores máximos por voz/formato")
+    p.add_argument("--tts-warmup", type=int, default=1, help="Sintetizadores pre-conectados al arrancar")
+
+    p.add_argument("--translator-pool-size", type=int, default=32, help="Conexiones HTTP máximas a Translator")
+    p.add_argument("--translator-keepalive", type=float, default=60.0, help="Segundos de keep-alive por conexión")
+    p.add_argument("--translate-batch-ms", type=float, default=5.0,
+                   help="Espera máxima para agrupar traducciones de varias conexiones (0 = sin batching)")
+    p.add_argument("--translate-batch-max", type=int, default=100, help="Frases máximas por petición")
+    p.add_argument("--translate-batch-chars", type=int, default=10_000, help="Caracteres máximos por petición")
+    p.add_argument("--translation-cache-mb", type=float, default=8.0, help="Tope de memoria de la caché (0 = sin caché)")
+    p.add_argument("--translation-cache-ttl", type=float, default=86400.0, help="Segundos de vida de cada traducción")
+    p.add_argument("--translation-cache-db", default=os.getenv("TRANSLATION_CACHE_DB"),
+                   help="SQLite para persistir la caché entre reinicios")
+    p.add_argument("--tts-cache-dir", default=os.getenv("TTS_CACHE_DIR"),
+                   help="Directorio de la caché de audio sintetizado (sin valor = sin caché)")
+    p.add_argument("--tts-cache-mb", type=float, default=256.0, help="Tope en disco de la caché de audio")
+    p.add_argument("--vad", action=argparse.BooleanOptionalAction, default=True,
+                   help="Filtrar el silencio antes del STT (--no-vad lo manda todo)")
+    p.add_argument("--vad-frame-ms", type=int, default=20, help="Trama de análisis del VAD")
+    p.add_argument("--vad-energy-db", type=float, default=-45.0, help="Energía mínima de voz (dBFS RMS)")
+    p.add_argument("--vad-zcr-max", type=float, default=0.35, help="Tasa máxima de cruces por cero de la voz")
+    p.add_argument("--vad-hangover-ms", type=int, default=300, help="Silencio que cierra un turno")
+    p.add_argument("--vad-preroll-ms", type=int, default=200, help="Audio previo que se manda al detectar voz")
+    p.add_argument("--stats-interval", type=float, default=0.0, help="Imprimir estadísticas cada N segundos (0 = nunca)")
+
+    p.add_argument("--fake-stt-ms", type=float, default=300.0)
+    p.add_argument("--fake-translate-ms", type=float, default=150.0)
+    p.add_argument("--fake-tts-ms", type=float, default=250.0)
+    p.add_argument("--fake-jitter-ms", type=float, default=50.0)
+    p.add_argument("--fake-seed", type=int, default=1234)
+
+
+def check_backend_args(p, args):
+    if args.backend != "azure":
+        return
+    for opt in ("speech_key", "speech_region", "translator_key", "translator_region"):
+        if not getattr(args, opt):
+            p.error(f"--{opt.replace('_', '-')} is required with --backend azure")
+
+
+def build_backends(args, segmentation_ms=None, auto_restart=False) -> Backends:
+    backends = _build_base_backends(args, segmentation_ms, auto_restart)
+
+    if args.vad:
+        backends.stt = VadStt(
+            backends.stt,
+            frame_ms=args.vad_frame_ms,
+            energy_db=args.vad_energy_db,
+            zcr_max=args.vad_zcr_max,
+            hangover_ms=args.vad_hangover_ms,
+            preroll_ms=args.vad_preroll_ms,
+        )
+
+    if args.translate_batch_ms > 0:
+        backends.translator = BatchingTranslator(
+            backends.translator,
+            max_delay=args.translate_batch_ms / 1000,
+            max_items=args.translate_batch_max,
+            max_chars=args.translate_batch_chars,
+        )
+
+    if args.translation_cache_mb > 0:
+        cache = TranslationCache(
+            max_bytes=int(args.translation_cache_mb * 1024 * 1024),
+            ttl=args.translation_cache_ttl,
+            db_path=args.translation_cache_db,
+        )
+        backends.translator = CachedTranslator(backends.translator, cache)
+
+    if args.tts_cache_dir:
+        # con --workers N cada worker usa su subdirectorio y 1/N del tope: el
+        # índice LRU es por proceso y en total no se pasa de --tts-cache-mb
+        directory, cache_mb = args.tts_cache_dir, args.tts_cache_mb
+        worker_id = getattr(args, "worker_id", None)
+        if worker_id is not None:
+            directory = os.path.join(directory, f"worker-{worker_id}")
+            cache_mb /= args.workers
+        audio_cache = AudioCache(directory, max_bytes=int(cache_mb * 1024 * 1024))
+        backends.tts = CachedTts(backends.tts, audio_cache)
+
+    return backends
+
+
+def _build_base_backends(args, segmentation_ms, auto_restart) -> Backends:
+    if args.backend == "fake":
+        rng = random.Random(args.fake_seed)
+        jitter = args.fake_jitter_ms
+        return Backends(
+            stt=FakeStt(Jitter(args.fake_stt_ms, jitter, rng), rng, segmentation_ms=segmentation_ms or 800),
+            translator=FakeTranslator(Jitter(args.fake_translate_ms, jitter, rng)),
+            tts=FakeTts(Jitter(args.fake_tts_ms, jitter, rng), sample_rate=args.sample_rate),
+        )
+
+    return Backends(
+        stt=AzureStt(args.speech_key, args.speech_region, segmentation_ms=segmentation_ms, auto_restart=auto_restart),
+        translator=AzureTranslator(
+            args.translator_key, args.translator_region,
+            pool_size=args.translator_pool_size, keepalive=args.translator_keepalive
+        ),
+        tts=AzureTts(args.speech_key, args.speech_region, pool_size=args.tts_pool_size),
+    )
@@ -0,0 +1,114 @@
+import asyncio
+from typing import Dict, List, Optional, Sequence
+
+
+# ==========================
+# MICRO-BATCHING DE TRADUCCIONES
+# ==========================
+#
+# Translator acepta un array de textos por petición. En vez de una petición
+# por frase, juntamos las frases pendientes de todas las conexiones durante
+# `max_delay` segundos (o hasta `max_items` / `max_chars`) y hacemos una sola
+# llamada por idioma origen + conjunto de idiomas destino. Cada conexión sigue esperando su
+# propio resultado, así que el orden por conexión no cambia.
+
+# límites del servicio: 1000 elementos y 50.000 caracteres por petición
+AZURE_MAX_ITEMS = 1000
+AZURE_MAX_CHARS = 50_000
+
+
+class BatchingTranslator:
+    def __init__(self, inner, max_delay=0.005, max_items=100, max_chars=10_000):
+        self.inner = inner
+        self.max_delay = max_delay
+        self.max_items = min(max_items, AZURE_MAX_ITEMS)
+        self.max_chars = min(max_chars, AZURE_MAX_CHARS)
+
+        self.pending = {}   # (src, (langs...)) -> [(text, future)]
+        self.chars = {}     # (src, (langs...)) -> int (caracteres x idiomas, como factura el servicio)
+        self.timers = {}    # (src, (langs...)) -> TimerHandle
+        self.inflight = set()
+
+        self.batches = 0
+        self.items = 0
+        self.max_batch = 0
+        self.errors = 0
+
+    async def translate(self, text: str, tgt_lang: str, src_lang: Optional[str] = None) -> str:
+        return (await self.translate_multi(text, (tgt_lang,), src_lang))[tgt_lang]
+
+    async def translate_multi(self, text: str, tgt_langs: Sequence[str],
+                              src_lang: Optional[str] = None) -> Dict[str, str]:
+        loop = asyncio.get_running_loop()
+        key = (src_lang, tuple(tgt_langs))
+        cost = len(text) * len(key[1])
+
+        if self.chars.get(key, 0) + cost > self.max_chars:
+            self._flush(key)
+
+        fut = loop.create_future()
+        self.pending.setdefault(key, []).append((text, fut))
+        self.chars[key] = self.chars.get(key, 0) + cost
+
+        if len(self.pending[key]) >= self.max_items:
+            self._flush(key)
+        elif key not in self.timers:
+            self.timers[key] = loop.call_later(self.max_delay, self._flush, key)
+
+        return await fut
+
+    def _flush(self, key) -> None:
+        timer = self.timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        batch = self.pending.pop(key, [])
+        self.chars.pop(key, None)
+
+        # quien se canceló mientras esperaba no viaja en la petición
+        batch = [(text, fut) for text, fut in batch if not fut.done()]
+        if not batch:
+            return
+
+        task = asyncio.create_task(self._send(key, batch))
+        self.inflight.add(task)
+        task.add_done_callback(self.inflight.discard)
+
+    async def _send(self, key, batch) -> None:
+        self.batches += 1
+        self.items += len(batch)
+        self.max_batch = max(self.max_batch, len(batch))
+        try:
+            results = await self.inner.translate_many([text for text, _ in batch], key[1], key[0])
+        except Exception as e:
+            self.errors += 1
+            for _, fut in batch:
+                if not fut.done():
+                    fut.set_exception(e)
+            return
+
+        for (_, fut), translated in zip(batch, results):
+            if not fut.done():
+                fut.set_result(translated)
+
+    async def translate_many(self, texts: List[str], tgt_langs: Sequence[str],
+                             src_lang: Optional[str] = None) -> List[Dict[str, str]]:
+        return await self.inner.translate_many(texts, tgt_langs, src_lang)
+
+    async def close(self) -> None:
+        for key in list(self.pending):
+            self._flush(key)
+        if self.inflight:
+            await asyncio.gather(*self.inflight, return_exceptions=True)
+        await self.inner.close()
+
+    def stats(self) -> dict:
+        stats = self.inner.stats() if hasattr(self.inner, "stats") else {}
+        stats["batching"] = {
+            "batches": self.batches,
+            "items": self.items,
+            "avg_batch": round(self.items / self.batches, 2) if self.batches else 0.0,
+            "max_batch": self.max_batch,
+            "pending": sum(len(b) for b in self.pending.values()),
+            "errors": self.errors,
+        }
+        return stats
@@ -0,0 +1,127 @@
+import struct
+from typing import List, Optional
+
+try:
+    import opuslib
+except ImportError:  # sin libopus: sólo PCM
+    opuslib = None
+
+OPUS_AVAILABLE = opuslib is not None
+
+
+# ==========================
+# CODEC DE AUDIO EN EL WEBSOCKET
+# ==========================
+#
+# El cliente pide Opus con ?codec=opus en la URL y el servidor contesta en
+# "ready" con el codec que va a usar ("opus" sólo si tiene opuslib; si no,
+# "pcm" y todo sigue como antes). Con Opus:
+#
+#   uplink:   cada mensaje binario es un paquete Opus de 20 ms
+#   downlink: pcm/     un paquete Opus por mensaje (tras el byte de destino)
+#             translator/  una frase por mensaje: paquetes con 2 bytes de
+#                          longitud delante (pack_packets)
+#
+# 16 kHz mono: 256 kbps en PCM, ~24 kbps en Opus.
+
+OPUS = "opus"
+PCM = "pcm"
+
+OPUS_FRAME_MS = 20
+MAX_FRAME_MS = 120
+
+
+def negotiate(requested: Optional[str]) -> str:
+    return OPUS if requested == OPUS and OPUS_AVAILABLE else PCM
+
+
+class OpusEncoder:
+    """Trocea PCM S16_LE en tramas de 20 ms y las codifica (voz, `bitrate` bps)."""
+    def __init__(self, sample_rate=16000, channels=1, bitrate=24000):
+        self.encoder = opuslib.Encoder(sample_rate, channels, opuslib.APPLICATION_VOIP)
+        self.encoder.bitrate = bitrate
+        self.frame_samples = sample_rate * OPUS_FRAME_MS // 1000
+        self.frame_bytes = self.frame_samples * channels * 2
+        self.buf = bytearray()
+
+    def encode(self, pcm) -> List[bytes]:
+        self.buf += pcm
+        packets = []
+        while len(self.buf) >= self.frame_bytes:
+            packets.append(self.encoder.encode(bytes(self.buf[:self.frame_bytes]), self.frame_samples))
+            del self.buf[:self.frame_bytes]
+        return packets
+
+    def flush(self) -> List[bytes]:
+        """Completa con silencio la última trama parcial."""
+        if not self.buf:
+            return []
+        return self.encode(bytes(self.frame_bytes - len(self.buf)))
+
+
+class OpusDecoder:
+    def __init__(self, sample_rate=16000, channels=1):
+        self.decoder = opuslib.Decoder(sample_rate, channels)
+        self.max_samples = sample_rate * MAX_FRAME_MS // 1000
+
+    def decode(self, packet) -> bytes:
+        return self.decoder.decode(bytes(packet), self.max_samples)
+
+
+def encode_pcm(pcm, sample_rate=16000, channels=1, bitrate=24000) -> List[bytes]:
+    encoder = OpusEncoder(sample_rate, channels, bitrate)
+    return encoder.encode(pcm) + encoder.flush()
+
+
+def pack_packets(packets) -> bytes:
+    return b"".join(struct.pack(">H", len(p)) + bytes(p) for p in packets)
+
+
+def unpack_packets(data) -> list:
+    packets = []
+    i = 0
+    while i + 2 <= len(data):
+        (n,) = struct.unpack_from(">H", data, i)
+        packets.append(data[i + 2:i + 2 + n])
+        i += 2 + n
+    return packets
+
+
+class OggOpusDemuxer:
+    """
+    Saca los paquetes Opus de un Ogg que llega a trozos (salida Ogg/Opus del
+    sintetizador). Se saltan las cabeceras OpusHead / OpusTags.
+    """
+    def __init__(self):
+        self.buf = bytearray()
+        self.partial = bytearray()  # paquete que continúa en la página siguiente
+
+    def feed(self, data) -> List[bytes]:
+        self.buf += data
+        packets = []
+        while True:
+            if len(self.buf) < 27:
+                break
+            if self.buf[:4] != b"OggS":
+                start = self.buf.find(b"OggS", 1)
+                del self.buf[:start if start > 0 else len(self.buf) - 3]
+                continue
+            n_segments = self.buf[26]
+            header_len = 27 + n_segments
+            if len(self.buf) < header_len:
+                break
+            lacing = self.buf[27:header_len]
+            if len(self.buf) < header_len + sum(lacing):
+                break
+
+            pos = header_len
+            for size in lacing:
+                self.partial += self.buf[pos:pos + size]
+                pos += size
+                if size < 255:
+                    packet = bytes(self.partial)
+                    self.partial.clear()
+                    if not packet.startswith((b"OpusHead", b"OpusTags")):
+                        packets.append(packet)
+            del self.buf[:pos]
+        return packets
@@ -0,0 +1,260 @@
+import os
+import time
+import asyncio
+import threading
+import contextlib
+import concurrent.futures
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Iterable, Optional
+
+
+# ==========================
+# MÉTRICAS PROMETHEUS (/metrics)
+# ==========================
+#
+# Registro mínimo sin dependencias: histogramas y contadores que se
+# actualizan en el event loop (o desde hilos del SDK) y métricas calculadas
+# al vuelo (sesiones, colas) registradas con `callback()`.
+#
+# Con --metrics-port cada proceso sirve /metrics en un hilo aparte. En modo
+# --workers cada worker manda su snapshot al supervisor por el pipe de
+# estadísticas y es el supervisor quien sirve la suma de todos.
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 0.75, 1.0, 1.5, 2.0, 3.0, 5.0, 10.0)
+PUSH_INTERVAL = 1.0
+
+_registry: Dict[str, "_Metric"] = {}
+_lock = threading.Lock()
+
+
+def _reset_lock():
+    # el supervisor hace fork con el hilo HTTP vivo: el lock podría copiarse tomado
+    global _lock
+    _lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_lock)
+
+
+def _label_key(labels: dict) -> tuple:
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key: Iterable, extra: str = "") -> str:
+    parts = [f'{k}="{v}"' for k, v in key]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        _registry[name] = self
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, help):
+        super().__init__(name, help)
+        self.values: Dict[tuple, float] = {}
+
+    def inc(self, amount=1.0, **labels) -> None:
+        key = _label_key(labels)
+        with _lock:
+            self.values[key] = self.values.get(key, 0.0) + amount
+
+    def snapshot(self) -> dict:
+        with _lock:
+            return dict(self.values)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, buckets=LATENCY_BUCKETS):
+        super().__init__(name, help)
+        self.buckets = tuple(buckets)
+        self.values: Dict[tuple, list] = {}   # etiquetas -> [cuentas por bucket..., +Inf, suma]
+
+    def observe(self, seconds: float, **labels) -> None:
+        key = _label_key(labels)
+        with _lock:
+            row = self.values.get(key)
+            if row is None:
+                row = self.values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    row[i] += 1
+            row[-2] += 1
+            row[-1] += seconds
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(time.monotonic() - start, **labels)
+
+    def snapshot(self) -> dict:
+        with _lock:
+            return {k: list(v) for k, v in self.values.items()}
+
+
+class Callback(_Metric):
+    """Valor calculado al leer: número, o dict valor-de-etiqueta -> número."""
+    def __init__(self, name, help, kind: str, fn: Callable, label: Optional[str] = None):
+        super().__init__(name, help)
+        self.kind = kind
+        self.fn = fn
+        self.label = label
+
+    def snapshot(self) -> dict:
+        value = self.fn()
+        if self.label is None:
+            return {(): float(value)}
+        return {((self.label, str(k)),): float(v) for k, v in value.items()}
+
+
+def callback(name: str, help: str, fn: Callable, kind="gauge", label: Optional[str] = None) -> None:
+    Callback(name, help, kind, fn, label)
+
+
+# --- métricas comunes a los dos servidores ---
+
+STT_FINALIZATION = Histogram(
+    "translator_stt_finalization_seconds", "Fin de voz (VAD) hasta el resultado final del STT")
+TRANSLATION = Histogram(
+    "translator_translation_seconds", "Tiempo de traducción por frase (todos los idiomas)")
+TTS_FIRST_BYTE = Histogram(
+    "translator_tts_first_byte_seconds", "Inicio de la síntesis hasta el primer audio")
+TTS_TOTAL = Histogram(
+    "translator_tts_total_seconds", "Síntesis completa de una frase")
+AZURE_ERRORS = Counter(
+    "translator_azure_errors_total", "Errores devueltos por Azure (service=stt|translator|tts)")
+CANCELLATIONS = Counter(
+    "translator_cancellations_total", "Cancelaciones de reconocimiento o síntesis (service=stt|tts)")
+
+
+# ==========================
+# SNAPSHOTS Y FORMATO TEXTO
+# ==========================
+
+def snapshot() -> dict:
+    """Estado de todas las métricas de este proceso (picklable, para el pipe)."""
+    return {
+        name: {"kind": m.kind, "help": m.help, "buckets": getattr(m, "buckets", None), "values": m.snapshot()}
+        for name, m in list(_registry.items())
+    }
+
+
+def merge_snapshots(items: Iterable[dict]) -> dict:
+    """Suma de snapshots de varios workers."""
+    merged: Dict[str, dict] = {}
+    for snap in items:
+        for name, metric in snap.items():
+            into = merged.setdefault(name, {**metric, "values": {}})
+            for key, value in metric["values"].items():
+                if key not in into["values"]:
+                    into["values"][key] = list(value) if isinstance(value, list) else value
+                elif isinstance(value, list):
+                    into["values"][key] = [a + b for a, b in zip(into["values"][key], value)]
+                else:
+                    into["values"][key] += value
+    return merged
+
+
+def render(snap: dict) -> str:
+    lines = []
+    for name, metric in sorted(snap.items()):
+        lines.append(f"# HELP {name} {metric['help']}")
+        lines.append(f"# TYPE {name} {metric['kind']}")
+        for key, value in sorted(metric["values"].items()):
+            if metric["kind"] != "histogram":
+                lines.append(f"{name}{_format_labels(key)} {value:g}")
+                continue
+            # observe() ya suma en todos los buckets >= valor: las cuentas son acumuladas
+            bounds = [f"{b:g}" for b in metric["buckets"]] + ["+Inf"]
+            for bound, count in zip(bounds, value):
+                le = f'le="{bound}"'
+                lines.append(f"{name}_bucket{_format_labels(key, le)} {count}")
+            lines.append(f"{name}_sum{_format_labels(key)} {value[-1]:g}")
+            lines.append(f"{name}_count{_format_labels(key)} {value[-2]}")
+    return "\n".join(lines) + "\n"
+
+
+# ==========================
+# SERVIDOR HTTP
+# ==========================
+
+def add_metrics_args(p):
+    p.add_argument("--metrics-port", type=int, default=int(os.getenv("METRICS_PORT", 0)),
+                   help="Puerto HTTP para /metrics (0 = desactivado)")
+
+
+def start_http_server(host: str, port: int, collect: Callable[[], dict], name="") -> ThreadingHTTPServer:
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            try:
+                body = render(collect()).encode()
+            except Exception as e:
+                self.send_error(500, str(e))
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *_):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    print(f"[{name}] metrics on http://{host}:{port}/metrics", flush=True)
+    return server
+
+
+async def _push(sink, interval: float):
+    while True:
+        sink(("metrics", snapshot()))
+        await asyncio.sleep(interval)
+
+
+def serve_metrics(args, name: str, sink=None) -> Optional[Callable[[], None]]:
+    """
+    Proceso único: sirve /metrics leyendo las métricas en el event loop.
+    Worker: empuja snapshots al supervisor. Devuelve la función que lo para.
+    """
+    if not args.metrics_port:
+        return None
+    if sink is not None:
+        task = asyncio.create_task(_push(sink, PUSH_INTERVAL))
+        return task.cancel
+
+    loop = asyncio.get_running_loop()
+
+    def collect() -> dict:
+        # las métricas calculadas leen estado del loop: se evalúan allí
+        fut = concurrent.futures.Future()
+
+        def run():
+            try:
+                fut.set_result(snapshot())
+            except Exception as e:
+                fut.set_exception(e)
+
+        loop.call_soon_threadsafe(run)
+        return fut.result(timeout=5)
+
+    server = start_http_server(args.host, args.metrics_port, collect, name)
+    return server.shutdown
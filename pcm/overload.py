@@ -0,0 +1,174 @@
+import asyncio
+import collections
+from typing import Callable, Optional
+
+
+# ==========================
+# SOBRECARGA: COLAS CON POLÍTICA Y PRESUPUESTO POR CONEXIÓN
+# ==========================
+#
+# Cada conexión tiene un presupuesto de bytes encolados (audio de entrada,
+# texto pendiente y audio sintetizado sin enviar). Cuando una cola se llena
+# o el presupuesto se agota se aplica la política de esa cola:
+#
+#   block        put() espera (backpressure hasta el socket del cliente)
+#   drop-oldest  se descarta lo más antiguo (latencia acotada)
+#   drop-newest  se descarta lo que llega
+#   coalesce     lo que llega se fusiona con el último elemento (texto)
+#   shed         se cierra la conexión (1013, el cliente reintenta)
+#
+# Nunca se descarta un None (fin de turno / fin de stream): con la cola
+# llena entra igualmente. Todo descarte queda contado en overload_stats().
+#
+# `block` sólo respeta el tamaño de la cola, no el presupuesto: lo que
+# encola cuenta en el presupuesto de las demás, pero put() no espera por él.
+
+POLICIES = ("block", "drop-oldest", "drop-newest", "coalesce", "shed")
+
+_counters = collections.Counter()
+
+
+def add_overload_args(p, audio_queue=50):
+    p.add_argument("--session-budget-mb", type=float, default=16.0,
+                   help="Bytes encolados máximos por conexión (audio + texto + TTS sin enviar)")
+    p.add_argument("--audio-queue", type=int, default=audio_queue, help="Chunks de audio en cola hacia STT")
+    p.add_argument("--audio-overload", choices=POLICIES, default="block",
+                   help="block: el lector del WebSocket espera y no se pierde voz (limitado por --audio-queue, "
+                        "no por --session-budget-mb); drop-oldest acota la latencia")
+    p.add_argument("--text-queue", type=int, default=50, help="Frases reconocidas pendientes de traducir")
+    p.add_argument("--text-overload", choices=POLICIES, default="coalesce")
+    p.add_argument("--output-overload", choices=POLICIES, default="shed",
+                   help="Si el cliente no lee el audio sintetizado a tiempo")
+
+
+def overload_stats() -> dict:
+    return dict(sorted(_counters.items()))
+
+
+def _size(item) -> int:
+    if item is None:
+        return 0
+    if isinstance(item, (bytes, bytearray, memoryview, str)):
+        return len(item)
+    text = getattr(item, "text", None)
+    return len(text) if isinstance(text, str) else 0
+
+
+class Budget:
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.used = 0
+
+
+class OverloadQueue(asyncio.Queue):
+    def __init__(self, name: str, maxsize=0, policy="block", budget: Optional[Budget] = None,
+                 coalesce: Optional[Callable] = None, on_shed: Optional[Callable[[str], None]] = None):
+        super().__init__(maxsize=maxsize)
+        self.name = name
+        self.policy = policy
+        self.budget = budget
+        self.coalesce = coalesce
+        self.on_shed = on_shed
+
+    # contabilidad del presupuesto en los hooks internos de asyncio.Queue
+    def _put(self, item):
+        if self.budget is not None:
+            self.budget.used += _size(item)
+        super()._put(item)
+
+    def _get(self):
+        item = super()._get()
+        if self.budget is not None:
+            self.budget.used -= _size(item)
+        return item
+
+    def _over(self, item) -> bool:
+        if item is None:
+            return False
+        if self.full():
+            return True
+        return self.budget is not None and self.budget.used + _size(item) > self.budget.max_bytes
+
+    async def put(self, item) -> None:
+        if self.policy == "block":
+            await super().put(item)
+        else:
+            self.offer(item)
+
+    def put_nowait(self, item) -> None:
+        self.offer(item)
+
+    def offer(self, item) -> bool:
+        """Encola sin bloquear aplicando la política. False si el elemento no entró."""
+        if item is None and self.full():
+            # el None entra aunque la cola esté llena (por encima de maxsize)
+            maxsize, self._maxsize = self._maxsize, 0
+            try:
+                super().put_nowait(None)
+            finally:
+                self._maxsize = maxsize
+            return True
+        if not self._over(item):
+            super().put_nowait(item)
+            return True
+
+        policy = self.policy
+        if policy == "coalesce" and self.coalesce is not None and self._queue and self._queue[-1] is not None:
+            last = self._queue[-1]
+            merged = self.coalesce(last, item)
+            if self.budget is not None:
+                self.budget.used += _size(merged) - _size(last)
+            self._queue[-1] = merged
+            _counters[f"{self.name}.coalesced"] += 1
+            return True
+
+        if policy == "drop-oldest":
+            while self._over(item) and self._drop_oldest():
+                _counters[f"{self.name}.dropped"] += 1
+            if not self._over(item):
+                super().put_nowait(item)
+                return True
+
+        if policy == "shed":
+            _counters[f"{self.name}.shed"] += 1
+            if self.on_shed is not None:
+                self.on_shed(f"{self.name} queue over budget")
+            return False
+
+        _counters[f"{self.name}.dropped"] += 1
+        return False
+
+    def _drop_oldest(self) -> bool:
+        for i, old in enumerate(self._queue):
+            if old is not None:
+                del self._queue[i]
+                if self.budget is not None:
+                    self.budget.used -= _size(old)
+                return True
+        return False
+
+
+class SessionOverload:
+    """Colas de una conexión compartiendo presupuesto; `on_shed` cierra la conexión."""
+    def __init__(self, args, on_shed: Callable[[str], None]):
+        self.args = args
+        self.budget = Budget(int(args.session_budget_mb * 1024 * 1024))
+        self.shed = False
+        self._on_shed = on_shed
+
+    def _shed(self, reason: str) -> None:
+        if not self.shed:
+            self.shed = True
+            _counters["sessions.shed"] += 1
+            self._on_shed(reason)
+
+    def audio_queue(self) -> OverloadQueue:
+        return OverloadQueue("audio", self.args.audio_queue, self.args.audio_overload,
+                             self.budget, on_shed=self._shed)
+
+    def text_queue(self, coalesce=None) -> OverloadQueue:
+        return OverloadQueue("text", self.args.text_queue, self.args.text_overload,
+                             self.budget, coalesce=coalesce, on_shed=self._shed)
+
+    def output_queue(self) -> OverloadQueue:
+        return OverloadQueue("output", 0, self.args.output_overload, self.budget, on_shed=self._shed)
@@ -0,0 +1,209 @@
+import os
+import sys
+import time
+import signal
+import asyncio
+import threading
+import collections
+from typing import Callable, Optional
+
+
+# ==========================
+# PERFILADO OPCIONAL (--profile)
+# ==========================
+#
+# Sin --profile no se instala nada: coste cero.
+#
+# Con --profile:
+#   - un hilo muestrea cada `--profile-interval-ms` las pilas de todos los
+#     hilos (event loop y executor) y las acumula en formato "folded"
+#     (hilo;función (fichero:línea);... cuenta), el que leen flamegraph.pl
+#     y speedscope;
+#   - se cronometra cada callback del loop (Handle._run): los que lo
+#     bloquean más de `--profile-slow-ms` se cuentan y se guardan los
+#     peores (sin el modo debug de asyncio, que captura pilas en cada
+#     call_soon y falsea el perfil);
+#   - con SIGUSR1 se escribe el .folded acumulado en `--profile-dir`, se
+#     imprime un resumen y se empieza de cero. Lo escribe el hilo de
+#     muestreo, así que funciona aunque el loop esté bloqueado.
+#
+# Con --workers el supervisor reenvía SIGUSR1 a todos los workers.
+
+TOP_SLOW = 10
+TOP_FRAMES = 15
+
+# hojas de hilos esperando (loop en select, executor sin trabajo)
+IDLE_FRAMES = ("select (selectors.py", "_worker (thread.py", "wait (threading.py")
+
+
+def add_profile_args(p):
+    p.add_argument("--profile", action="store_true", default=os.getenv("PROFILE") == "1",
+                   help="Muestrear pilas y avisar de callbacks lentos (SIGUSR1 vuelca el flamegraph)")
+    p.add_argument("--profile-interval-ms", type=float, default=10.0, help="Periodo de muestreo")
+    p.add_argument("--profile-slow-ms", type=float, default=50.0, help="Callback lento a partir de N ms")
+    p.add_argument("--profile-dir", default=os.getenv("PROFILE_DIR", "."), help="Dónde escribir los .folded")
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _describe(handle) -> str:
+    callback = handle._callback
+    task = getattr(callback, "__self__", None)
+    if isinstance(task, asyncio.Task):
+        coro = task.get_coro()
+        frame = getattr(coro, "cr_frame", None)
+        where = f" at {os.path.basename(frame.f_code.co_filename)}:{frame.f_lineno}" if frame else ""
+        return f"{task.get_name()} {getattr(coro, '__qualname__', coro)}{where}"
+    return getattr(callback, "__qualname__", None) or repr(callback)[:200]
+
+
+class _SlowCallbacks:
+    """Envuelve Handle._run para medir cada callback del loop."""
+    def __init__(self, threshold: float, lock: threading.Lock):
+        self.threshold = threshold
+        self.lock = lock  # el del Profiler: dump() corre en otro hilo
+        self.count = 0
+        self.worst = []  # [(segundos, descripción)]
+        self.original = None
+
+    def install(self):
+        self.original = original = asyncio.events.Handle._run
+        slow = self
+
+        def _run(handle):
+            start = time.perf_counter()
+            try:
+                return original(handle)
+            finally:
+                took = time.perf_counter() - start
+                if took >= slow.threshold:
+                    slow.record(took, handle)
+
+        asyncio.events.Handle._run = _run
+
+    def uninstall(self):
+        if self.original is not None:
+            asyncio.events.Handle._run = self.original
+            self.original = None
+
+    def record(self, took: float, handle) -> None:
+        with self.lock:
+            self.count += 1
+            if len(self.worst) < TOP_SLOW or took > self.worst[-1][0]:
+                self.worst.append((took, _describe(handle)))
+                self.worst.sort(key=lambda w: w[0], reverse=True)
+                del self.worst[TOP_SLOW:]
+
+
+class Profiler:
+    def __init__(self, name: str, interval_ms: float, slow_ms: float, out_dir: str):
+        self.name = name
+        self.interval = interval_ms / 1000
+        self.slow_ms = slow_ms
+        self.out_dir = out_dir
+
+        self.stacks = collections.Counter()
+        self.samples = 0
+        self.dumps = 0
+        self.lock = threading.Lock()
+        self.dump_requested = threading.Event()
+        self.stopped = threading.Event()
+        self.slow = _SlowCallbacks(slow_ms / 1000, self.lock)
+        self.thread: Optional[threading.Thread] = None
+
+    # --- instalación ---
+
+    def start(self) -> None:
+        self.slow.install()
+
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGUSR1, lambda *_: self.dump_requested.set())
+
+        self.thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+        self.thread.start()
+        print(f"[{self.name}] profiling every {self.interval * 1000:g} ms, "
+              f"slow callbacks > {self.slow_ms:g} ms (kill -USR1 {os.getpid()} to dump)", flush=True)
+
+    def stop(self) -> None:
+        self.stopped.set()
+        self.slow.uninstall()
+
+    # --- muestreo ---
+
+    def _run(self):
+        me = threading.get_ident()
+        while not self.stopped.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            frames = sys._current_frames()
+            sampled = []
+            for ident, frame in frames.items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame))
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                sampled.append(";".join(reversed(stack)))
+            del frames
+
+            with self.lock:
+                self.samples += 1
+                self.stacks.update(sampled)
+
+            if self.dump_requested.is_set():
+                self.dump_requested.clear()
+                self.dump()
+
+    def dump(self) -> Optional[str]:
+        with self.lock:
+            stacks, self.stacks = self.stacks, collections.Counter()
+            samples, self.samples = self.samples, 0
+            worst, self.slow.worst = self.slow.worst, []
+            self.slow.count = 0
+
+        path = os.path.join(self.out_dir, f"profile-{self.name}-{os.getpid()}-{int(time.time())}.folded")
+        try:
+            with open(path, "w", encoding="utf-8") as f:
+                for stack, count in stacks.most_common():
+                    f.write(f"{stack} {count}\n")
+        except OSError as e:
+            print(f"[{self.name}] profile dump failed: {e}", flush=True)
+            return None
+        self.dumps += 1
+
+        # resumen: funciones hoja más vistas (sin hilos parados en esperas)
+        leaves = collections.Counter()
+        for stack, count in stacks.items():
+            leaf = stack.rsplit(";", 1)[-1]
+            if not leaf.startswith(IDLE_FRAMES):
+                leaves[leaf] += count
+        print(f"[{self.name}] profile: {samples} samples -> {path}", flush=True)
+        for label, count in leaves.most_common(TOP_FRAMES):
+            print(f"[{self.name}]   {count:6d}  {label}", flush=True)
+        for took, what in worst:
+            print(f"[{self.name}]   slow {took * 1000:7.1f} ms  {what}", flush=True)
+        return path
+
+    def stats(self) -> dict:
+        return {"samples": self.samples, "dumps": self.dumps, "slow_callbacks": self.slow.count}
+
+
+_profiler: Optional[Profiler] = None
+
+
+def install(args, name: str) -> Optional[Callable[[], None]]:
+    """Arranca el perfilado si se pidió; devuelve la función que lo para."""
+    global _profiler
+    if not args.profile:
+        return None
+    _profiler = Profiler(name, args.profile_interval_ms, args.profile_slow_ms, args.profile_dir)
+    _profiler.start()
+    return _profiler.stop
+
+
+def profile_stats() -> dict:
+    return _profiler.stats() if _profiler is not None else {}
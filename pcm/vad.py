@@ -0,0 +1,196 @@
+import time
+from typing import Optional
+from collections import deque
+
+import numpy as np
+
+import metrics
+
+
+# ==========================
+# VAD EN EL SERVIDOR (antes del STT)
+# ==========================
+#
+# Se mete entre audio_q y stt.write(): clasifica tramas de `frame_ms` por
+# energía (dBFS) y cruces por cero, y sólo deja pasar la voz más
+# `preroll_ms` antes y `hangover_ms` después. El silencio no se manda
+# (salvo una trama cada `keepalive_ms` para que el servicio no cierre la
+# sesión), así que no se factura ni se procesa.
+#
+# Al acabar el hangover se llama a end_turn() de la sesión STT, que empuja
+# de golpe el silencio de segmentación: el reconocedor lo ve cumplido al
+# instante en vez de esperar 800 ms de audio en tiempo real. La misma clase
+# Vad sirve en los clientes para no mandar el silencio por la red.
+
+DEFAULT_PAD_MS = 800
+
+# por encima de energy_db + LOUD_MARGIN_DB es voz aunque cruce mucho por cero
+# (fricativas fuertes); el ZCR sólo filtra ruido/siseo cerca del umbral
+LOUD_MARGIN_DB = 15.0
+
+
+class Vad:
+    def __init__(self, sample_rate=16000, channels=1, frame_ms=20, energy_db=-45.0, zcr_max=0.35,
+                 hangover_ms=300, preroll_ms=200):
+        self.frame_bytes = int(sample_rate * frame_ms / 1000) * channels * 2
+        self.frame_ms = frame_ms
+        self.energy_db = energy_db
+        self.zcr_max = zcr_max
+        self.hangover_ms = hangover_ms
+
+        self.buf = bytearray()
+        self.preroll = deque(maxlen=max(1, preroll_ms // frame_ms))
+        self.active = False
+        self.silence_ms = 0
+
+    def reset(self) -> None:
+        self.buf.clear()
+        self.preroll.clear()
+        self.active = False
+        self.silence_ms = 0
+
+    def is_speech(self, frame: bytes) -> bool:
+        x = np.frombuffer(frame, dtype="<i2").astype(np.float32)
+        rms = np.sqrt(np.mean(x * x))
+        db = 20 * np.log10(rms / 32768.0 + 1e-9)
+        if db < self.energy_db:
+            return False
+        if db >= self.energy_db + LOUD_MARGIN_DB:
+            return True
+        zcr = np.count_nonzero(np.diff(np.signbit(x))) / len(x)
+        return zcr <= self.zcr_max
+
+    def feed(self, chunk: bytes):
+        """
+        Devuelve (voz, fin_de_habla, descartado): los bytes a mandar al STT,
+        si en este chunk terminó un turno y cuántos bytes se descartaron.
+        Se para en el fin de turno: lo que sigue queda en el buffer para la
+        siguiente llamada (ver segments()).
+        """
+        self.buf += chunk
+        out = []
+        eos = False
+        dropped = 0
+
+        while len(self.buf) >= self.frame_bytes:
+            frame = bytes(self.buf[:self.frame_bytes])
+            del self.buf[:self.frame_bytes]
+
+            if self.is_speech(frame):
+                if not self.active:
+                    self.active = True
+                    out.extend(self.preroll)
+                    self.preroll.clear()
+                out.append(frame)
+                self.silence_ms = 0
+            elif self.active:
+                out.append(frame)
+                self.silence_ms += self.frame_ms
+                if self.silence_ms >= self.hangover_ms:
+                    self.active = False
+                    self.silence_ms = 0
+                    eos = True
+                    break
+            else:
+                if len(self.preroll) == self.preroll.maxlen:
+                    dropped += len(self.preroll[0])
+                self.preroll.append(frame)
+
+        return b"".join(out), eos, dropped
+
+    def segments(self, chunk: bytes):
+        """feed() por turnos: el fin de un turno sale antes que la voz del siguiente."""
+        while True:
+            voice, eos, dropped = self.feed(chunk)
+            chunk = b""
+            yield voice, eos, dropped
+            if not eos:
+                return
+
+
+class VadSttSession:
+    def __init__(self, owner, inner, vad: Vad, keepalive_ms: int):
+        self.owner = owner
+        self.inner = inner
+        self.vad = vad
+        self.keepalive_bytes = int(keepalive_ms / vad.frame_ms) * vad.frame_bytes
+        self.idle_bytes = 0
+        self.turn_end: Optional[float] = None       # monotonic del último fin de voz
+        self.last_turn_end: Optional[float] = None  # el del último resultado final (trazas)
+
+    def recognized(self) -> None:
+        # latencia de finalización: fin de voz -> resultado final
+        turn_end, self.turn_end = self.turn_end, None
+        self.last_turn_end = turn_end
+        if turn_end is not None:
+            metrics.STT_FINALIZATION.observe(time.monotonic() - turn_end)
+
+    def write(self, chunk: bytes) -> None:
+        stats = self.owner
+        stats.bytes_in += len(chunk)
+
+        for voice, eos, dropped in self.vad.segments(chunk):
+            stats.bytes_dropped += dropped
+
+            if voice:
+                self.idle_bytes = 0
+                stats.bytes_out += len(voice)
+                self.inner.write(voice)
+            if eos:
+                stats.turns += 1
+                self.turn_end = time.monotonic()
+                self.inner.end_turn()
+
+            self.idle_bytes += dropped
+            if self.keepalive_bytes and self.idle_bytes >= self.keepalive_bytes:
+                self.idle_bytes = 0
+                self.inner.end_turn()
+
+    def end_turn(self) -> None:
+        """El cliente avisa de silencio: cerrar el turno aunque falte hangover."""
+        if self.vad.active:
+            self.owner.turns += 1
+            self.turn_end = time.monotonic()
+        self.vad.reset()
+        self.idle_bytes = 0
+        self.inner.end_turn()
+
+    def close(self) -> None:
+        self.inner.close()
+
+
+class VadStt:
+    """Envuelve cualquier backend STT; cada sesión lleva su propio VAD."""
+    def __init__(self, inner, keepalive_ms=10_000, **vad_options):
+        self.inner = inner
+        self.keepalive_ms = keepalive_ms
+        self.vad_options = vad_options
+
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.bytes_dropped = 0
+        self.turns = 0
+
+    def open(self, loop, locale, sample_rate, channels, on_recognized, on_partial=None):
+        session = None
+
+        def recognized(text: str):
+            if session is not None:
+                session.recognized()
+            on_recognized(text)
+
+        inner = self.inner.open(loop, locale, sample_rate, channels, recognized, on_partial)
+        vad = Vad(sample_rate, channels, **self.vad_options)
+        session = VadSttSession(self, inner, vad, self.keepalive_ms)
+        return session
+
+    def stats(self) -> dict:
+        stats = self.inner.stats() if hasattr(self.inner, "stats") else {}
+        stats["vad"] = {
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "bytes_dropped": self.bytes_dropped,
+            "sent_ratio": round(self.bytes_out / self.bytes_in, 3) if self.bytes_in else 0.0,
+            "turns": self.turns,
+        }
+        return stats
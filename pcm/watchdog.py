@@ -0,0 +1,188 @@
+import os
+import json
+import asyncio
+import threading
+import concurrent.futures
+from typing import Optional
+
+import metrics
+
+
+# ==========================
+# WATCHDOG: LAG DEL EVENT LOOP Y SATURACIÓN DEL EXECUTOR
+# ==========================
+#
+# Las llamadas bloqueantes del SDK (speak_text_async().get(), conexión de
+# sintetizadores) van al executor por defecto con run_in_executor(None, ...).
+# Si el executor se queda sin hilos las frases esperan en su cola; si algo
+# bloquea el loop, todo el servidor se retrasa. El watchdog:
+#
+#   - instala un ThreadPoolExecutor propio como executor por defecto
+#     (--executor-threads) que cuenta sus tareas en cola y en curso;
+#   - cada `--watchdog-interval-ms` mide cuánto tarda el loop en despertar
+#     respecto a lo pedido (lag) y la cola del executor;
+#   - lo publica en stats ("watchdog") y en /metrics;
+#   - marca el proceso como saturado si el lag medio pasa de
+#     `--max-loop-lag-ms` o la cola de `--max-executor-queue`, y sale de
+#     saturación al bajar de la mitad (histéresis). Mientras está saturado
+#     las sesiones nuevas se rechazan (1013) o se degradan (PCM sin Opus,
+#     pipeline de profundidad 1) según `--saturation-policy`.
+#
+# Por defecto sólo mide (policy off) y la cola límite es tantas tareas como
+# hilos: una ráfaga corta de síntesis no rechaza a nadie. Las sesiones ya
+# abiertas no se tocan.
+
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+EWMA_ALPHA = 0.2
+
+LOOP_LAG = metrics.Histogram(
+    "translator_loop_lag_seconds", "Retraso del event loop al despertar un timer", LAG_BUCKETS)
+SESSIONS_LIMITED = metrics.Counter(
+    "translator_sessions_limited_total", "Sesiones nuevas rechazadas o degradadas por saturación (action=...)")
+
+
+def add_watchdog_args(p):
+    p.add_argument("--executor-threads", type=int, default=None,
+                   help="Hilos del executor por defecto (por defecto min(32, cores + 4))")
+    p.add_argument("--watchdog-interval-ms", type=float, default=100.0)
+    p.add_argument("--max-loop-lag-ms", type=float, default=250.0, help="Lag medio que marca saturación")
+    p.add_argument("--max-executor-queue", type=int, default=None,
+                   help="Tareas en cola del executor que marcan saturación (por defecto, tantas como hilos)")
+    p.add_argument("--saturation-policy", choices=["reject", "degrade", "off"],
+                   default=os.getenv("SATURATION_POLICY", "off"),
+                   help="Qué hacer con las sesiones nuevas mientras el proceso está saturado")
+
+
+class CountingExecutor(concurrent.futures.ThreadPoolExecutor):
+    """ThreadPoolExecutor que cuenta sus tareas sin leer sus atributos privados."""
+    def __init__(self, max_workers: Optional[int] = None):
+        self.max_threads = max_workers or min(32, (os.cpu_count() or 1) + 4)
+        super().__init__(max_workers=self.max_threads, thread_name_prefix="executor")
+        self._lock = threading.Lock()
+        self.pending = 0        # enviadas y aún sin terminar
+        self.active = 0         # corriendo en un hilo
+
+    def submit(self, fn, /, *args, **kwargs):
+        def run():
+            with self._lock:
+                self.active += 1
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                with self._lock:
+                    self.active -= 1
+                    self.pending -= 1
+
+        with self._lock:
+            self.pending += 1
+        try:
+            return super().submit(run)
+        except BaseException:
+            with self._lock:
+                self.pending -= 1
+            raise
+
+    def state(self) -> dict:
+        with self._lock:
+            pending, active = self.pending, self.active
+        return {"queue": max(0, pending - active), "active": active, "max_threads": self.max_threads}
+
+
+class Watchdog:
+    def __init__(self, name: str, interval_ms=100.0, max_lag_ms=250.0, max_queue: Optional[int] = None,
+                 policy="off", executor_threads: Optional[int] = None):
+        self.name = name
+        self.interval = interval_ms / 1000
+        self.max_lag = max_lag_ms / 1000
+        self.policy = policy
+        self.executor = CountingExecutor(executor_threads)
+        self.max_queue = max_queue if max_queue is not None else self.executor.max_threads
+
+        self.lag = 0.0          # media móvil (s)
+        self.saturated = False
+        self.episodes = 0
+        self.rejected = 0
+        self.degraded = 0
+        self.task: Optional[asyncio.Task] = None
+
+    @classmethod
+    def from_args(cls, args, name: str) -> "Watchdog":
+        return cls(name, args.watchdog_interval_ms, args.max_loop_lag_ms, args.max_executor_queue,
+                   args.saturation_policy, args.executor_threads)
+
+    def start(self) -> None:
+        loop = asyncio.get_running_loop()
+        loop.set_default_executor(self.executor)
+        self.task = asyncio.create_task(self._run())
+
+        metrics.callback("translator_executor_queue", "Tareas esperando hilo en el executor",
+                         lambda: self.executor_state()["queue"])
+        metrics.callback("translator_executor_active", "Hilos del executor ocupados",
+                         lambda: self.executor_state()["active"])
+        metrics.callback("translator_executor_threads", "Hilos máximos del executor",
+                         lambda: self.executor_state()["max_threads"])
+        metrics.callback("translator_saturated", "1 si el proceso está saturado", lambda: int(self.saturated))
+
+    def stop(self) -> None:
+        if self.task:
+            self.task.cancel()
+
+    # --- medición ---
+
+    def executor_state(self) -> dict:
+        return self.executor.state()
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - expected)
+            LOOP_LAG.observe(lag)
+            self.lag += EWMA_ALPHA * (lag - self.lag)
+            self._update(self.executor_state()["queue"])
+
+    def _update(self, queue: int) -> None:
+        if not self.saturated and (self.lag > self.max_lag or queue > self.max_queue):
+            self.saturated = True
+            self.episodes += 1
+            print(f"[{self.name}] saturated: loop lag {self.lag * 1000:.1f} ms, executor queue {queue} "
+                  f"(new sessions: {self.policy})", flush=True)
+        elif self.saturated and self.lag < self.max_lag / 2 and queue <= self.max_queue // 2:
+            self.saturated = False
+            print(f"[{self.name}] recovered: loop lag {self.lag * 1000:.1f} ms, executor queue {queue}", flush=True)
+
+    # --- admisión ---
+
+    def admit(self) -> str:
+        """'accept', 'degrade' o 'reject' para una sesión nueva."""
+        if not self.saturated or self.policy == "off":
+            return "accept"
+        if self.policy == "degrade":
+            self.degraded += 1
+        else:
+            self.rejected += 1
+        SESSIONS_LIMITED.inc(action=self.policy)
+        return self.policy
+
+    def stats(self) -> dict:
+        ex = self.executor_state()
+        return {
+            "lag_avg_ms": round(self.lag * 1000, 1),
+            "executor_queue": ex["queue"],
+            "executor_active": ex["active"],
+            "executor_utilization": round(ex["active"] / ex["max_threads"], 3) if ex["max_threads"] else 0.0,
+            "saturated": int(self.saturated),
+            "episodes": self.episodes,
+            "rejected": self.rejected,
+            "degraded": self.degraded,
+        }
+
+
+async def reject_saturated(ws) -> None:
+    """Sesión nueva con el proceso saturado: aviso y cierre 1013 (el cliente reintenta)."""
+    try:
+        await ws.send(json.dumps({"type": "error", "error": "server saturated, retry later"}, ensure_ascii=False))
+        await ws.close(code=1013, reason="server saturated")
+    except Exception:
+        pass
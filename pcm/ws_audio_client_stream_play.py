@@ -1,9 +1,15 @@
+import json
 import asyncio
 import argparse
-import subprocess
 import sys
 import websockets
 
+from protocol import untag_frame, with_query, SILENCE_MESSAGE
+from vad import Vad
+from codec import OPUS, OPUS_AVAILABLE, OpusEncoder, OpusDecoder
+from playback import PlaybackEngine
+from audio_io import add_audio_args, open_capture, open_playback
+
 
 def parse_args():
     p = argparse.ArgumentParser("WS Audio Client (PCM streaming)")
@@ -11,11 +17,32 @@ def parse_args():
     p.add_argument("--capture", required=True)
     p.add_argument("--playback", required=True)
     p.add_argument("--name", default="CHANNEL")
+    p.add_argument("--lang", help="Idioma a reproducir si el servidor traduce a varios (por defecto el primero)")
 
     p.add_argument("--rate", type=int, default=16000)
     p.add_argument("--channels", type=int, default=1)
     p.add_argument("--chunk-ms", type=int, default=20)
     p.add_argument("--bytes-per-sample", type=int, default=2)
+    p.add_argument("--codec", choices=["opus", "pcm"], default="pcm",
+                   help="opus: audio comprimido si el servidor (y opuslib) lo permiten (opt-in)")
+    p.add_argument("--opus-bitrate", type=int, default=24000)
+
+    # VAD: sólo se manda la voz; el silencio se sustituye por {"type": "silence"}
+    p.add_argument("--vad", action=argparse.BooleanOptionalAction, default=True)
+    p.add_argument("--vad-energy-db", type=float, default=-45.0, help="Energía mínima de voz (dBFS RMS)")
+    p.add_argument("--vad-hangover-ms", type=int, default=300, help="Silencio que cierra un turno")
+    p.add_argument("--vad-preroll-ms", type=int, default=200, help="Audio previo que se manda al detectar voz")
+    p.add_argument("--silence-keepalive-ms", type=int, default=10_000,
+                   help="Repetir el aviso de silencio cada N ms mientras no se hable")
+
+    # reproducción: una sola salida con jitter buffer (ver playback.py)
+    p.add_argument("--prebuffer-ms", type=int, default=60, help="Audio mínimo en cola antes de empezar una frase")
+    p.add_argument("--max-prebuffer-ms", type=int, default=400, help="Tope del jitter buffer adaptativo")
+    p.add_argument("--device-buffer-ms", type=int, default=80, help="Audio escrito por delante de lo que suena")
+    p.add_argument("--barge-in", action="store_true", help="Cortar la reproducción en cuanto se habla (VAD)")
+
+    # dispositivo de audio: ALSA en proceso, arecord/aplay o fichero (ver audio_io.py)
+    add_audio_args(p)
     return p.parse_args()
 
 
@@ -24,70 +51,127 @@ async def main():
 
     chunk_bytes = int(args.rate * args.chunk_ms / 1000) * args.channels * args.bytes_per_sample
 
-    arecord_cmd = [
-        "arecord",
-        "-D", args.capture,
-        "-f", "S16_LE",
-        "-r", str(args.rate),
-        "-c", str(args.channels),
-        "-t", "raw",
-        "--buffer-size=64000",
-        "--period-size=16000",
-    ]
-
-    # aplay persistente (PCM RAW)
-    aplay_cmd = [
-        "aplay",
-        "-D", args.playback,
-        "-t", "raw",
-        "-f", "S16_LE",
-        "-r", str(args.rate),
-        "-c", str(args.channels),
-        "-"
-    ]
-
-    print(f"[{args.name}] Connecting to: {args.ws}")
-
-    async with websockets.connect(args.ws, max_size=None, ping_interval=20, ping_timeout=20) as ws:
-        print(f"[{args.name}] WS connected")
-
-        arec = subprocess.Popen(arecord_cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
-        aplay = subprocess.Popen(aplay_cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-
-        loop = asyncio.get_running_loop()
+    url = args.ws
+    if args.codec == OPUS and OPUS_AVAILABLE:
+        url = with_query(url, "codec", OPUS)
+
+    print(f"[{args.name}] Connecting to: {url}")
+
+    async with websockets.connect(url, max_size=None, ping_interval=20, ping_timeout=20) as ws:
+        print(f"[{args.name}] WS connected (audio: {args.audio_backend})")
+
+        # captura y reproducción en el propio loop, sin hilos (ver audio_io.py)
+        capture = open_capture(args, args.capture, chunk_bytes)
+        await capture.open()
         stopped = asyncio.Event()
 
+        output = open_playback(args, args.playback)
+        await output.open()
+        player = PlaybackEngine(
+            output, args.rate, args.channels,
+            frame_ms=args.chunk_ms,
+            prebuffer_ms=args.prebuffer_ms,
+            max_prebuffer_ms=args.max_prebuffer_ms,
+            device_ms=args.device_buffer_ms,
+        )
+
+        vad = None
+        if args.vad:
+            vad = Vad(
+                args.rate, args.channels,
+                frame_ms=args.chunk_ms,
+                energy_db=args.vad_energy_db,
+                hangover_ms=args.vad_hangover_ms,
+                preroll_ms=args.vad_preroll_ms,
+            )
+        keepalive_bytes = int(args.silence_keepalive_ms / args.chunk_ms) * chunk_bytes
+        uplink_bytes = {"captured": 0, "sent": 0}
+
+        ready = asyncio.Event()
+        codec = {"encoder": None, "decoder": None}  # según "ready"
+
+        async def send_audio(pcm):
+            encoder = codec["encoder"]
+            if encoder is None:
+                uplink_bytes["sent"] += len(pcm)
+                await ws.send(pcm)
+                return
+            for packet in encoder.encode(pcm):
+                uplink_bytes["sent"] += len(packet)
+                await ws.send(packet)
+
         async def uplink():
+            idle_bytes = 0
+            await ready.wait()
+            reader = capture.reader()  # desde ahora: sin audio viejo de antes del "ready"
             try:
                 while True:
-                    data = await loop.run_in_executor(None, arec.stdout.read, chunk_bytes)
-                    if not data:
-                        await asyncio.sleep(0.01)
+                    data = await reader.read()  # memoryview del anillo: se copia al enviar
+                    uplink_bytes["captured"] += len(data)
+
+                    if vad is None:
+                        await send_audio(data)
                         continue
-                    await ws.send(data)
+
+                    was_active = vad.active
+                    for voice, eos, dropped in vad.segments(data):
+                        if args.barge_in and vad.active and not was_active:
+                            player.flush()  # se habla encima: cortar lo que suena
+                        was_active = vad.active
+                        if voice:
+                            await send_audio(voice)
+                        idle_bytes += dropped
+                        if eos or idle_bytes >= keepalive_bytes:
+                            idle_bytes = 0
+                            await ws.send(SILENCE_MESSAGE)
             except Exception:
                 stopped.set()
+            finally:
+                reader.close()
+
+        langs = []  # destinos anunciados en "ready"
 
         async def downlink():
+            nonlocal langs
             try:
                 async for msg in ws:
                     if isinstance(msg, str):
                         print(f"[{args.name}] SERVER:", msg)
+                        evt = json.loads(msg)
+                        if evt.get("type") == "ready":
+                            langs = [t["lang"] for t in evt.get("targets", [])]
+                            if evt.get("codec") == OPUS:
+                                codec["encoder"] = OpusEncoder(args.rate, args.channels, args.opus_bitrate)
+                                codec["decoder"] = OpusDecoder(args.rate, args.channels)
+                            ready.set()
+                        elif evt.get("type") == "tts_end":
+                            if len(langs) <= 1 or evt.get("lang") == (args.lang or langs[0]):
+                                player.end_utterance()  # fin de la frase que se reproduce
                         continue
 
-                    # BINARIO PCM raw: lo escribimos al aplay abierto
-                    try:
-                        aplay.stdin.write(msg)
-                        aplay.stdin.flush()
-                    except Exception:
-                        stopped.set()
-                        break
+                    # varios destinos: 1 byte de índice delante del audio
+                    if len(langs) > 1:
+                        index, msg = untag_frame(msg)
+                        if langs[index] != (args.lang or langs[0]):
+                            continue
+
+                    # BINARIO PCM raw (o un paquete Opus): al motor de reproducción
+                    if codec["decoder"] is not None:
+                        msg = codec["decoder"].decode(msg)
+                    player.feed(msg)
+            except Exception:
+                stopped.set()
+
+        async def playback():
+            try:
+                await player.run()
             except Exception:
                 stopped.set()
 
         tasks = [
             asyncio.create_task(uplink()),
             asyncio.create_task(downlink()),
+            asyncio.create_task(playback()),
         ]
 
         try:
@@ -95,19 +179,13 @@ async def main():
         finally:
             for t in tasks:
                 t.cancel()
-
-            try:
-                arec.terminate()
-            except Exception:
-                pass
-            try:
-                aplay.stdin.close()
-            except Exception:
-                pass
-            try:
-                aplay.terminate()
-            except Exception:
-                pass
+            if uplink_bytes["captured"]:
+                sent = 100 * uplink_bytes["sent"] / uplink_bytes["captured"]
+                print(f"[{args.name}] uplink sent {sent:.0f}% of captured audio")
+            print(f"[{args.name}] capture", json.dumps(capture.stats()))
+            print(f"[{args.name}] playback", json.dumps(player.stats()))
+            await output.close()
+            await capture.close()
 
 
 if __name__ == "__main__":
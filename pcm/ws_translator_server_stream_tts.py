@@ -1,10 +1,24 @@
 import os
 import json
+import time
 import asyncio
 import argparse
-import aiohttp
 import websockets
-import azure.cognitiveservices.speech as speechsdk
+
+from dataclasses import asdict
+
+from backends import add_backend_args, check_backend_args, build_backends, report_stats
+from workers import add_worker_args, run_workers
+from protocol import default_targets, targets_from_path, codec_from_path, tag_frame, source_lang, is_silence
+from codec import OPUS, OpusDecoder, negotiate
+from incremental import StablePrefixTracker
+from pipeline import Pipeline, Utterance, drain, pipeline_stats
+from overload import SessionOverload, add_overload_args, overload_stats
+import metrics
+import tracing
+import profiling
+from watchdog import Watchdog, add_watchdog_args, reject_saturated
+from tracing import Trace, tracing_stats
 
 
 def parse_args():
@@ -21,135 +35,188 @@ def parse_args():
     p.add_argument("--translator-region", default=os.getenv("TRANSLATOR_REGION"))
 
     p.add_argument("--src-locale", default=os.getenv("SRC_LOCALE"))
-    p.add_argument("--tgt-lang", default=os.getenv("TGT_LANG"))
-    p.add_argument("--tts-voice", default=os.getenv("TTS_VOICE"))
+    p.add_argument("--tgt-lang", default=os.getenv("TGT_LANG"), help="Uno o varios idiomas separados por comas")
+    p.add_argument("--tts-voice", default=os.getenv("TTS_VOICE"), help="Una voz por idioma, en el mismo orden")
 
     p.add_argument("--sample-rate", type=int, default=os.getenv("RATE", 16000))
     p.add_argument("--channels", type=int, default=os.getenv("CHANNELS", 1))
 
-    return p.parse_args()
-
-
-async def translate_text(session: aiohttp.ClientSession, key: str, region: str, tgt_lang: str, text: str) -> str:
-    url = f"https://api.cognitive.microsofttranslator.com/translate?api-version=3.0&to={tgt_lang}"
-    headers = {
-        "Ocp-Apim-Subscription-Key": key,
-        "Ocp-Apim-Subscription-Region": region,
-        "Content-Type": "application/json",
-    }
-    async with session.post(url, headers=headers, json=[{"Text": text}], timeout=aiohttp.ClientTimeout(total=10)) as resp:
-        data = await resp.json()
-        return data[0]["translations"][0]["text"]
-
-
-class TtsPushCallback(speechsdk.audio.PushAudioOutputStreamCallback):
-    """
-    Azure TTS irá llamando write(audio_buffer) mientras va sintetizando.
-    Nosotros empujamos esos bytes a una asyncio.Queue para mandarlos por WS.
-    """
-    def __init__(self, loop: asyncio.AbstractEventLoop, q: asyncio.Queue):
-        super().__init__()
-        self.loop = loop
-        self.q = q
-        self.closed = False
-
-    def write(self, audio_buffer: memoryview) -> int:
-        if self.closed:
-            return 0
-        data = bytes(audio_buffer)
-        # thread-safe -> cola asyncio
-        self.loop.call_soon_threadsafe(self.q.put_nowait, data)
-        return len(data)
-
-    def close(self) -> None:
-        self.closed = True
-        # sentinel: None indica fin de stream
-        self.loop.call_soon_threadsafe(self.q.put_nowait, None)
-
-
-def build_streaming_synth(loop, q, speech_key, speech_region, tts_voice):
-    cfg = speechsdk.SpeechConfig(subscription=speech_key, region=speech_region)
-    cfg.speech_synthesis_voice_name = tts_voice
-
-    # CRÍTICO: salida RAW PCM (no RIFF/WAV) para stream real
-    cfg.set_speech_synthesis_output_format(
-        speechsdk.SpeechSynthesisOutputFormat.Raw16Khz16BitMonoPcm
-    )
+    p.add_argument("--pipeline-depth", type=int, default=2,
+                   help="Frases que pueden traducirse/sintetizarse por delante de la que se envía")
+    p.add_argument("--echo-guard", action="store_true", default=os.getenv("ECHO_GUARD") == "1",
+                   help="Descartar frases reconocidas mientras se envía audio (altavoz abierto)")
+
+    # traducir el prefijo estable de los parciales sin esperar al final de la frase
+    p.add_argument("--incremental", action="store_true", default=os.getenv("INCREMENTAL") == "1")
+    p.add_argument("--incremental-stable", type=int, default=2,
+                   help="Hipótesis parciales seguidas que deben coincidir para confirmar palabras")
+    p.add_argument("--incremental-min-words", type=int, default=3,
+                   help="Palabras mínimas por segmento confirmado")
+
+    add_backend_args(p)
+    add_worker_args(p)
+    metrics.add_metrics_args(p)
+    tracing.add_tracing_args(p)
+    profiling.add_profile_args(p)
+    add_watchdog_args(p)
+    add_overload_args(p, audio_queue=50)
+
+    args = p.parse_args()
+    check_backend_args(p, args)
+    try:
+        args.targets = default_targets(args.tgt_lang, args.tts_voice)
+    except ValueError as e:
+        p.error(str(e))
+    return args
+
+
+async def handle_client(ws, args, backends, degraded=False):
+    loop = asyncio.get_running_loop()
 
-    cb = TtsPushCallback(loop, q)
-    push_stream = speechsdk.audio.PushAudioOutputStream(cb)
-    audio_out = speechsdk.audio.AudioConfig(stream=push_stream)
+    try:
+        targets = targets_from_path(ws.path, args.targets)
+    except ValueError as e:
+        await ws.send(json.dumps({"type": "error", "error": str(e)}, ensure_ascii=False))
+        return
 
-    synth = speechsdk.SpeechSynthesizer(speech_config=cfg, audio_config=audio_out)
-    return synth
+    # con varios destinos cada chunk PCM va etiquetado con el índice del destino
+    tagged = len(targets) > 1
 
+    # Opus en los dos sentidos si el cliente lo pide y tenemos opuslib
+    # degradada (proceso saturado): PCM sin Opus, sin frases por delante
+    codec = "pcm" if degraded else negotiate(codec_from_path(ws.path))
+    decoder = OpusDecoder(args.sample_rate, args.channels) if codec == OPUS else None
+    tts_codec = OPUS if codec == OPUS else "pcm"
 
-async def handle_client(ws, args):
-    loop = asyncio.get_running_loop()
+    langs = [t.lang for t in targets]
+    src_lang = source_lang(args.src_locale)
 
     # --- Señal listo ---
-    await ws.send(json.dumps({"type": "ready", "channel": args.name}, ensure_ascii=False))
+    await ws.send(json.dumps({
+        "type": "ready",
+        "channel": args.name,
+        "targets": [asdict(t) for t in targets],
+        "codec": codec,
+        "degraded": degraded,
+    }, ensure_ascii=False))
 
     # --- Colas ---
-    audio_q: asyncio.Queue[bytes] = asyncio.Queue(maxsize=50)   # audio crudo hacia STT
-    text_q: asyncio.Queue[str] = asyncio.Queue(maxsize=50)       # frases finales
     closed = asyncio.Event()
 
-    speaking = False  # evita re-entradas mientras TTS está sonando
-
-    # --- Azure STT (streaming entrada) ---
-    speech_cfg = speechsdk.SpeechConfig(subscription=args.speech_key, region=args.speech_region)
-    speech_cfg.speech_recognition_language = args.src_locale
-    speech_cfg.set_property(
-        speechsdk.PropertyId.Speech_SegmentationSilenceTimeoutMs,
-        "800"
+    # política de sobrecarga y presupuesto de memoria por conexión (ver overload.py)
+    overload = SessionOverload(args, lambda reason: closed.set())
+    audio_q = overload.audio_queue()   # audio crudo hacia STT
+
+    # --- Pipeline traducir -> sintetizar -> enviar (ver pipeline.py) ---
+
+    async def translate(utt: Utterance):
+        utt.trace.attributes.update(channel=args.name, langs=",".join(langs), final=utt.final)
+        stt_msg = {"type": "stt", "text": utt.text, **utt.trace.fields()}
+        if tracker is not None:
+            stt_msg["final"] = utt.final
+        await ws.send(json.dumps(stt_msg, ensure_ascii=False))
+
+        # una sola llamada para todos los idiomas destino
+        with metrics.TRANSLATION.time():
+            utt.translations = await backends.translator.translate_multi(utt.text, langs, src_lang)
+
+    async def synthesize(utt: Utterance, index: int, on_chunk):
+        target = targets[index]
+        ok = await backends.tts.stream(utt.translations[target.lang], target.voice, on_chunk, codec=tts_codec)
+        if not ok:
+            raise RuntimeError("TTS failed")
+
+    async def send_stream(utt: Utterance, index: int):
+        target = targets[index]
+        await ws.send(json.dumps(
+            {"type": "tts_start", "lang": target.lang, **utt.trace.fields()}, ensure_ascii=False
+        ))
+        async for chunk in drain(utt.outputs[index]):
+            await ws.send(tag_frame(index, chunk) if tagged else chunk)  # binario PCM
+        if index in utt.tts_errors:
+            await ws.send(json.dumps(
+                {"type": "error", "lang": target.lang, "error": utt.tts_errors[index]}, ensure_ascii=False
+            ))
+        await ws.send(json.dumps(
+            {"type": "tts_end", "lang": target.lang, **utt.trace.fields()}, ensure_ascii=False
+        ))
+
+    async def send(utt: Utterance):
+        if utt.error is not None:
+            await ws.send(json.dumps({"type": "error", "error": utt.error, **utt.trace.fields()}, ensure_ascii=False))
+            return
+        for t in targets:
+            await ws.send(json.dumps(
+                {"type": "translate", "lang": t.lang, "text": utt.translations[t.lang], **utt.trace.fields()},
+                ensure_ascii=False
+            ))
+        # un stream por idioma, en paralelo
+        await asyncio.gather(*(send_stream(utt, i) for i in range(len(targets))))
+
+    pipeline = Pipeline(
+        len(targets), translate, synthesize, send, depth=1 if degraded else args.pipeline_depth,
+        text_q=overload.text_queue(coalesce=Utterance.merge), new_output=overload.output_queue,
     )
 
-    fmt = speechsdk.audio.AudioStreamFormat(samples_per_second=args.sample_rate, bits_per_sample=16, channels=args.channels)
-    push_in = speechsdk.audio.PushAudioInputStream(fmt)
-    audio_in_cfg = speechsdk.audio.AudioConfig(stream=push_in)
-    recognizer = speechsdk.SpeechRecognizer(speech_config=speech_cfg, audio_config=audio_in_cfg)
+    def speaking() -> bool:
+        # con --echo-guard no se aceptan frases nuevas mientras hay audio en curso
+        return args.echo_guard and pipeline.busy
+
+    def new_trace(recognized: float) -> Trace:
+        # fin de voz del VAD del servidor, si lo hay
+        return Trace(recognized, getattr(stt, "last_turn_end", None))
 
-    def on_recognized(evt: speechsdk.SpeechRecognitionEventArgs):
-        nonlocal speaking
+    # --- STT (streaming entrada) ---
+    def on_recognized(text: str):
         try:
-            if speaking:
-                return
-            if evt.result.reason != speechsdk.ResultReason.RecognizedSpeech:
+            if speaking():
                 return
-            text = (evt.result.text or "").strip()
-            if not text:
-                return
-            loop.call_soon_threadsafe(text_q.put_nowait, text)
+            loop.call_soon_threadsafe(pipeline.put_nowait, text, True, new_trace(time.monotonic()))
         except Exception:
             pass
 
-    recognizer.recognizing.connect(on_recognized)
-    recognizer.start_continuous_recognition()
+    # --- Modo incremental: segmentos del prefijo estable + cola final ---
+    tracker = None
+    on_partial = None
+    ignoring = False  # la frase empezó mientras sonaba TTS: se descarta entera
 
-    def on_canceled(evt):
-        print("STT canceled:", evt)
-        loop.call_soon_threadsafe(restart_recognizer)
+    if args.incremental and not degraded:
+        tracker = StablePrefixTracker(args.incremental_stable, args.incremental_min_words)
 
-    def on_session_stopped(evt):
-        print("STT session stopped")
-        loop.call_soon_threadsafe(restart_recognizer)
+        def _start_phrase():
+            nonlocal ignoring
+            if not tracker.active:
+                ignoring = speaking()
 
-    def restart_recognizer():
-        try:
-            recognizer.stop_continuous_recognition()
-        except:
-            pass
-        recognizer.start_continuous_recognition()
+        def _partial(text: str):
+            _start_phrase()
+            segment = tracker.feed(text)
+            if segment and not ignoring:
+                pipeline.put_nowait(segment, final=False)
+
+        def _final(text: str, trace: Trace):
+            _start_phrase()
+            tail = tracker.final(text)
+            if tail and not ignoring:
+                pipeline.put_nowait(tail, trace=trace)
+
+        def on_partial(text: str):
+            loop.call_soon_threadsafe(_partial, text)
+
+        def on_recognized(text: str):
+            loop.call_soon_threadsafe(_final, text, new_trace(time.monotonic()))
 
-    recognizer.canceled.connect(on_canceled)
-    recognizer.session_stopped.connect(on_session_stopped)
+    stt = backends.stt.open(
+        loop, args.src_locale, args.sample_rate, args.channels, on_recognized, on_partial
+    )
 
     async def ws_reader():
         try:
             async for msg in ws:
                 if isinstance(msg, bytes):
-                    await audio_q.put(msg)  # backpressure
+                    await audio_q.put(decoder.decode(msg) if decoder else msg)  # según --audio-overload
+                elif is_silence(msg):
+                    await audio_q.put(None)  # fin de turno (VAD del cliente)
         finally:
             closed.set()
 
@@ -160,115 +227,104 @@ async def handle_client(ws, args):
                     chunk = await asyncio.wait_for(audio_q.get(), timeout=1.0)
                 except asyncio.TimeoutError:
                     continue
-                push_in.write(chunk)
+                if chunk is None:
+                    stt.end_turn()
+                else:
+                    stt.write(chunk)
         finally:
-            try:
-                push_in.close()
-            except Exception:
-                pass
-
-    async def tts_sender(pcm_q: asyncio.Queue):
-        """
-        Lee PCM raw chunks desde pcm_q y los manda por WS.
-        pcm_q recibe bytes y un None al final.
-        """
-        while True:
-            chunk = await pcm_q.get()
-            if chunk is None:
-                break
-            await ws.send(chunk)  # binario PCM
-
-    async def pipeline_worker():
-        nonlocal speaking
-        async with aiohttp.ClientSession() as session:
-            while not closed.is_set():
-                try:
-                    text = await asyncio.wait_for(text_q.get(), timeout=1.0)
-                except asyncio.TimeoutError:
-                    continue
-
-                try:
-                    speaking = True
-                    await ws.send(json.dumps({"type": "stt", "text": text}, ensure_ascii=False))
-
-                    translated = await translate_text(
-                        session,
-                        args.translator_key,
-                        args.translator_region,
-                        args.tgt_lang,
-                        text
-                    )
-                    await ws.send(json.dumps({"type": "translate", "text": translated}, ensure_ascii=False))
-                    await ws.send(json.dumps({"type": "tts_start"}, ensure_ascii=False))
-
-                    # --- TTS Streaming ---
-                    pcm_q: asyncio.Queue = asyncio.Queue(maxsize=2000)
-
-                    synth = build_streaming_synth(
-                        loop, pcm_q,
-                        args.speech_key, args.speech_region, args.tts_voice
-                    )
-
-                    # Lanzamos sender que va mandando chunks mientras se sintetiza
-                    sender_task = asyncio.create_task(tts_sender(pcm_q))
-
-                    # speak_text_async().get() bloquea, así que lo hacemos en executor
-                    def _do_speak():
-                        res = synth.speak_text_async(translated).get()
-                        return res.reason
-
-                    reason = await loop.run_in_executor(None, _do_speak)
-
-                    # cuando termina, el callback close() ya habrá metido None en la cola
-                    await sender_task
-
-                    if reason != speechsdk.ResultReason.SynthesizingAudioCompleted:
-                        await ws.send(json.dumps({"type": "error", "error": f"TTS failed: {reason}"}, ensure_ascii=False))
-
-                    await ws.send(json.dumps({"type": "tts_end"}, ensure_ascii=False))
-
-                    # NO usamos synth.close() (no existe en tu build)
-                    del synth
-
-                except Exception as e:
-                    try:
-                        await ws.send(json.dumps({"type": "error", "error": str(e)}, ensure_ascii=False))
-                    except Exception:
-                        pass
-                finally:
-                    speaking = False
+            stt.close()
 
     tasks = [
         asyncio.create_task(ws_reader()),
         asyncio.create_task(stt_audio_writer()),
-        asyncio.create_task(pipeline_worker()),
+        *pipeline.start(),
     ]
 
     try:
         await closed.wait()
     finally:
+        pipeline.cancel()
         for t in tasks:
             t.cancel()
+        if overload.shed:
+            print(f"[{args.name}] connection shed: session over budget")
+            await ws.close(code=1013, reason="server overloaded")
+        stt.close()
+
+
+async def serve(args, stats_sink=None):
+    watchdog = Watchdog.from_args(args, args.name)
+    watchdog.start()
+
+    backends = build_backends(args, segmentation_ms=800, auto_restart=True)
+    tracing.configure(args.trace_file, args.name)
+
+    # conexiones TTS listas antes del primer cliente
+    for target in args.targets:
+        await backends.tts.warmup(target.voice, streaming=True, count=args.tts_warmup)
+    print(f"[{args.name}] WS Translator running on ws://{args.host}:{args.port} "
+          f"(backend: {args.backend}, pid {os.getpid()})")
+
+    sessions = {"active": 0, "total": 0}
+
+    metrics.callback("translator_sessions_active", "Conexiones WebSocket abiertas", lambda: sessions["active"])
+    metrics.callback("translator_queue_depth", "Frases en cada cola del pipeline (suma de conexiones)",
+                     lambda: {k: v for k, v in pipeline_stats().items() if k.endswith("_q") or k == "in_flight"},
+                     label="queue")
+    metrics.callback("translator_overload_events_total", "Descartes, fusiones y cierres por sobrecarga",
+                     overload_stats, kind="counter", label="event")
+
+    async def serve_client(ws):
+        admission = watchdog.admit()
+        if admission == "reject":
+            await reject_saturated(ws)
+            return
+        sessions["active"] += 1
+        sessions["total"] += 1
         try:
-            recognizer.stop_continuous_recognition()
-        except Exception:
-            pass
-
-
-async def main():
-    args = parse_args()
-    print(f"[{args.name}] WS Translator running on ws://{args.host}:{args.port}")
+            await handle_client(ws, args, backends, degraded=admission == "degrade")
+        finally:
+            sessions["active"] -= 1
 
     async with websockets.serve(
-        lambda ws: handle_client(ws, args),
+        serve_client,
         args.host,
         args.port,
         max_size=50_000_000,
         ping_interval=20,
         ping_timeout=20,
+        reuse_port=args.workers > 1,
     ):
-        await asyncio.Future()
+        stats_task = None
+        if args.stats_interval > 0:
+            stats_task = asyncio.create_task(report_stats(
+                args.name, backends, args.stats_interval,
+                extra=lambda: {"sessions": dict(sessions), "pipeline": pipeline_stats(),
+                               "overload": overload_stats(), "tracing": tracing_stats(),
+                               "profile": profiling.profile_stats(), "watchdog": watchdog.stats()}, sink=stats_sink
+            ))
+        stop_metrics = metrics.serve_metrics(args, args.name, stats_sink)
+        stop_profile = profiling.install(args, args.name)
+        try:
+            await asyncio.Future()
+        finally:
+            if stats_task:
+                stats_task.cancel()
+            if stop_metrics:
+                stop_metrics()
+            if stop_profile:
+                stop_profile()
+            watchdog.stop()
+            await backends.close()
+
+
+def main():
+    args = parse_args()
+    if args.workers > 1:
+        run_workers(serve, args, args.name)
+    else:
+        asyncio.run(serve(args))
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    main()
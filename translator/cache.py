@@ -0,0 +1,387 @@
+import os
+import re
+import mmap
+import stat
+import time
+import asyncio
+import hashlib
+import sqlite3
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Optional, Sequence
+
+from codec import pack_packets, unpack_packets
+
+
+# ==========================
+# CACHÉ DE TRADUCCIONES
+# ==========================
+#
+# Memoria: LRU + TTL con tope de bytes.
+# Disco (opcional): SQLite, sobrevive a reinicios del contenedor. Todas las
+# operaciones de disco van a un único hilo para no bloquear el event loop.
+
+_SPACES = re.compile(r"\s+")
+_EDGE_PUNCT = "¿¡.!?,;: "
+
+ENTRY_OVERHEAD = 120  # bytes aproximados por entrada (tupla, OrderedDict, floats)
+
+
+def normalize_text(text: str) -> str:
+    return _SPACES.sub(" ", text.casefold()).strip(_EDGE_PUNCT)
+
+
+class TranslationCache:
+    def __init__(self, max_bytes=8 * 1024 * 1024, ttl=86400.0, db_path: Optional[str] = None,
+                 max_disk_entries=200_000):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.max_disk_entries = max_disk_entries
+
+        self.entries = OrderedDict()  # key -> (value, expires_at, size)
+        self.bytes = 0
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expired = 0
+
+        self.db = None
+        self.disk = None
+        self.disk_writes = 0
+        if db_path:
+            self.disk = ThreadPoolExecutor(max_workers=1, thread_name_prefix="translation-cache")
+            self.db = sqlite3.connect(db_path, check_same_thread=False)
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("PRAGMA synchronous=NORMAL")
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS translations ("
+                " src TEXT, tgt TEXT, text TEXT, value TEXT, created REAL,"
+                " PRIMARY KEY (src, tgt, text))"
+            )
+            self.db.commit()
+
+    @staticmethod
+    def key(text: str, src: str, tgt: str):
+        return normalize_text(text), src, tgt
+
+    # ----- memoria -----
+
+    def _get_mem(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        value, expires_at, size = entry
+        if expires_at < time.monotonic():
+            del self.entries[key]
+            self.bytes -= size
+            self.expired += 1
+            return None
+        self.entries.move_to_end(key)
+        return value
+
+    def _put_mem(self, key, value: str, ttl: float):
+        size = ENTRY_OVERHEAD + len(key[0]) + len(value) + len(key[1]) + len(key[2])
+        if size > self.max_bytes:
+            return
+        old = self.entries.pop(key, None)
+        if old is not None:
+            self.bytes -= old[2]
+        self.entries[key] = (value, time.monotonic() + ttl, size)
+        self.bytes += size
+        while self.bytes > self.max_bytes:
+            _, (_, _, s) = self.entries.popitem(last=False)
+            self.bytes -= s
+            self.evictions += 1
+
+    # ----- disco -----
+
+    def _get_disk(self, key):
+        row = self.db.execute(
+            "SELECT value, created FROM translations WHERE src=? AND tgt=? AND text=?",
+            (key[1], key[2], key[0])
+        ).fetchone()
+        if row is None:
+            return None
+        value, created = row
+        age = time.time() - created
+        if age > self.ttl:
+            return None
+        return value, self.ttl - age
+
+    def _put_disk(self, key, value: str):
+        self.db.execute(
+            "INSERT OR REPLACE INTO translations VALUES (?, ?, ?, ?, ?)",
+            (key[1], key[2], key[0], value, time.time())
+        )
+        self.disk_writes += 1
+        if self.disk_writes % 1000 == 0:
+            self.db.execute("DELETE FROM translations WHERE created < ?", (time.time() - self.ttl,))
+            self.db.execute(
+                "DELETE FROM translations WHERE rowid IN ("
+                " SELECT rowid FROM translations ORDER BY created DESC LIMIT -1 OFFSET ?)",
+                (self.max_disk_entries,)
+            )
+        self.db.commit()
+
+    # ----- API -----
+
+    async def get(self, text: str, src: str, tgt: str) -> Optional[str]:
+        key = self.key(text, src, tgt)
+        value = self._get_mem(key)
+        if value is not None:
+            self.hits += 1
+            return value
+
+        if self.db is not None:
+            found = await asyncio.get_running_loop().run_in_executor(self.disk, self._get_disk, key)
+            if found is not None:
+                value, ttl_left = found
+                self._put_mem(key, value, ttl_left)
+                self.disk_hits += 1
+                return value
+
+        self.misses += 1
+        return None
+
+    async def put(self, text: str, src: str, tgt: str, value: str) -> None:
+        key = self.key(text, src, tgt)
+        self._put_mem(key, value, self.ttl)
+        if self.db is not None:
+            await asyncio.get_running_loop().run_in_executor(self.disk, self._put_disk, key, value)
+
+    def close(self) -> None:
+        if self.disk is not None:
+            self.disk.submit(self.db.close)
+            self.disk.shutdown(wait=True)
+            self.disk = None
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_ratio": round((self.hits + self.disk_hits) / lookups, 3) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expired": self.expired,
+        }
+
+
+class CachedTranslator:
+    """
+    Envuelve cualquier backend de traducción. Peticiones idénticas en vuelo
+    comparten una sola llamada al servicio.
+    """
+    def __init__(self, inner, cache: TranslationCache):
+        self.inner = inner
+        self.cache = cache
+        self.inflight = {}
+
+    async def translate(self, text: str, tgt_lang: str, src_lang: Optional[str] = None) -> str:
+        return (await self.translate_multi(text, (tgt_lang,), src_lang))[tgt_lang]
+
+    async def translate_multi(self, text: str, tgt_langs: Sequence[str],
+                              src_lang: Optional[str] = None) -> Dict[str, str]:
+        """Sólo los idiomas que no están en caché van al servicio."""
+        src = src_lang or ""
+        result = {}
+        missing = []
+        for lang in tgt_langs:
+            cached = await self.cache.get(text, src, lang)
+            if cached is not None:
+                result[lang] = cached
+            else:
+                missing.append(lang)
+        if not missing:
+            return result
+
+        # la llamada va en su propia tarea: si se cancela la sesión que la
+        # lanzó, las demás que esperan la misma frase siguen recibiéndola
+        key = (normalize_text(text), src, tuple(missing))
+        task = self.inflight.get(key)
+        if task is None:
+            task = self.inflight[key] = asyncio.create_task(self._fetch(key, text, missing, src_lang))
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())  # nadie esperando
+        result.update(await asyncio.shield(task))
+        return result
+
+    async def _fetch(self, key, text: str, missing: Sequence[str], src_lang: Optional[str]) -> Dict[str, str]:
+        try:
+            translated = await self.inner.translate_multi(text, missing, src_lang)
+        finally:
+            del self.inflight[key]
+        for lang, value in translated.items():
+            await self.cache.put(text, src_lang or "", lang, value)
+        return translated
+
+    async def close(self) -> None:
+        await self.inner.close()
+        self.cache.close()
+
+    def stats(self) -> dict:
+        stats = self.inner.stats() if hasattr(self.inner, "stats") else {}
+        stats["cache"] = self.cache.stats()
+        return stats
+
+
+# ==========================
+# CACHÉ DE AUDIO TTS
+# ==========================
+#
+# Direccionada por contenido: sha256(voz, formato, texto) -> fichero en disco.
+# Los aciertos se sirven con mmap, sin copiar el audio a memoria del proceso,
+# y se pueden mandar tal cual por el WebSocket.
+
+class AudioCache:
+    def __init__(self, directory: str, max_bytes=256 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+        self.entries = OrderedDict()  # key -> size (orden LRU)
+        self.bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        os.makedirs(directory, exist_ok=True)
+        self._load_index()
+
+    def _load_index(self):
+        found = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.endswith(".tmp"):
+                os.unlink(path)
+                continue
+            st = os.stat(path)
+            if not stat.S_ISREG(st.st_mode):
+                continue  # worker-N/ de otro modo de arranque
+            found.append((st.st_atime, name, st.st_size))
+        for _, name, size in sorted(found):
+            self.entries[name] = size
+            self.bytes += size
+        self._evict()
+
+    @staticmethod
+    def key(voice: str, output_format: str, text: str) -> str:
+        h = hashlib.sha256(f"{voice}\0{output_format}\0{text.strip()}".encode("utf-8"))
+        return h.hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key)
+
+    def get(self, key: str) -> Optional[memoryview]:
+        """memoryview sobre el fichero mapeado; el mmap se libera con la vista."""
+        if key not in self.entries:
+            self.misses += 1
+            return None
+        try:
+            with open(self._path(key), "rb") as f:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            self._drop(key)
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return memoryview(mm)
+
+    def _write(self, key: str, data: bytes) -> None:
+        tmp = self._path(key) + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, self._path(key))
+
+    async def put(self, key: str, data: bytes) -> None:
+        if not data or len(data) > self.max_bytes:
+            return
+        await asyncio.get_running_loop().run_in_executor(None, self._write, key, data)
+        if key in self.entries:
+            self.bytes -= self.entries.pop(key)
+        self.entries[key] = len(data)
+        self.bytes += len(data)
+        self._evict()
+
+    def _drop(self, key: str) -> None:
+        self.bytes -= self.entries.pop(key, 0)
+        try:
+            os.unlink(self._path(key))
+        except OSError:
+            pass
+
+    def _evict(self):
+        while self.bytes > self.max_bytes and self.entries:
+            key = next(iter(self.entries))
+            self._drop(key)
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 3) if lookups else 0.0,
+            "evictions": self.evictions,
+        }
+
+
+class CachedTts:
+    """
+    Envuelve cualquier backend TTS. En stream() los aciertos se trocean en
+    chunks de `chunk_bytes` igual que una síntesis en streaming.
+    """
+    def __init__(self, inner, cache: AudioCache, chunk_bytes=3200):
+        self.inner = inner
+        self.cache = cache
+        self.chunk_bytes = chunk_bytes
+
+    async def warmup(self, voice: str, streaming: bool, count=1) -> None:
+        await self.inner.warmup(voice, streaming, count)
+
+    async def synthesize(self, text: str, voice: str, codec: str = "wav"):
+        key = self.cache.key(voice, codec, text)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+
+        audio = await self.inner.synthesize(text, voice, codec=codec)
+        await self.cache.put(key, audio)
+        return audio
+
+    async def stream(self, text: str, voice: str, on_chunk: Callable[[bytes], None], codec: str = "pcm") -> bool:
+        # Opus se guarda con pack_packets(): la misma entrada sirve a synthesize()
+        key = self.cache.key(voice, codec, text)
+        cached = self.cache.get(key)
+        if cached is not None:
+            if codec == "opus":
+                for packet in unpack_packets(cached):
+                    on_chunk(packet)
+            else:
+                for i in range(0, len(cached), self.chunk_bytes):
+                    on_chunk(cached[i:i + self.chunk_bytes])
+            return True
+
+        chunks = []
+
+        def _tee(chunk):
+            chunks.append(chunk)
+            on_chunk(chunk)
+
+        ok = await self.inner.stream(text, voice, _tee, codec=codec)
+        if ok:
+            await self.cache.put(key, pack_packets(chunks) if codec == "opus" else b"".join(chunks))
+        return ok
+
+    def stats(self) -> dict:
+        stats = self.inner.stats() if hasattr(self.inner, "stats") else {}
+        stats["cache"] = self.cache.stats()
+        return stats
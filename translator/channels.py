@@ -0,0 +1,106 @@
+import json
+import asyncio
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+from urllib.parse import urlsplit
+
+from protocol import MAX_TARGETS, Target, default_targets
+
+
+# ==========================
+# CANALES (varios pares de idiomas en un proceso)
+# ==========================
+#
+# channels.json:
+#
+#   {"channels": [
+#     {"name": "SPA-ENG", "port": 9001, "src_locale": "es-ES",
+#      "targets": [{"lang": "en", "voice": "en-US-JennyNeural"}]},
+#     {"name": "ENG-SPA", "port": 9002, "src_locale": "en-US",
+#      "tgt_lang": "es", "tts_voice": "es-ES-ElviraNeural"}
+#   ]}
+#
+# Un cliente elige canal por:
+#   1. la ruta de la URL (ws://host:9000/spa-eng, por defecto /<name en minúsculas>)
+#   2. el puerto, si el canal tiene uno propio (compatible con un contenedor por par)
+#   3. un primer mensaje {"type": "hello", "channel": "SPA-ENG"}
+
+HELLO_TIMEOUT = 5.0
+
+
+@dataclass
+class Channel:
+    name: str
+    src_locale: str
+    targets: List[Target]
+    path: Optional[str] = None
+    port: Optional[int] = None
+
+    def __post_init__(self):
+        if self.path is None:
+            self.path = "/" + self.name.lower()
+
+
+def channel_from_dict(raw: dict) -> Channel:
+    if "targets" in raw:
+        targets = [Target(t["lang"], t["voice"]) for t in raw["targets"]]
+    else:
+        targets = default_targets(raw.get("tgt_lang"), raw.get("tts_voice"))
+    if not raw.get("name") or not raw.get("src_locale") or not targets:
+        raise ValueError(f"channel needs name, src_locale and targets: {raw}")
+    if len(targets) > MAX_TARGETS:
+        raise ValueError(f"{raw['name']}: at most {MAX_TARGETS} targets per channel")
+    return Channel(
+        name=raw["name"],
+        src_locale=raw["src_locale"],
+        targets=targets,
+        path=raw.get("path"),
+        port=raw.get("port"),
+    )
+
+
+def load_channels(path: str) -> List[Channel]:
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    return [channel_from_dict(raw) for raw in data["channels"]]
+
+
+@dataclass
+class ChannelRegistry:
+    channels: List[Channel]
+    by_name: Dict[str, Channel] = field(init=False)
+    by_path: Dict[str, Channel] = field(init=False)
+
+    def __post_init__(self):
+        self.by_name = {c.name.lower(): c for c in self.channels}
+        self.by_path = {c.path.rstrip("/").lower(): c for c in self.channels}
+        if len(self.by_name) != len(self.channels) or len(self.by_path) != len(self.channels):
+            raise ValueError("channel names and paths must be unique")
+
+    def ports(self) -> Dict[int, Channel]:
+        return {c.port: c for c in self.channels if c.port}
+
+    def voices(self):
+        return sorted({t.voice for c in self.channels for t in c.targets})
+
+    def match_path(self, path: Optional[str]) -> Optional[Channel]:
+        route = urlsplit(path or "").path.rstrip("/").lower()
+        return self.by_path.get(route) if route else None
+
+    async def select(self, ws, default: Optional[Channel]) -> Channel:
+        channel = self.match_path(ws.path)
+        if channel is not None:
+            return channel
+        if default is not None:
+            return default
+
+        msg = await asyncio.wait_for(ws.recv(), HELLO_TIMEOUT)
+        if not isinstance(msg, str):
+            raise ValueError("expected a hello message selecting the channel")
+        hello = json.loads(msg)
+        if hello.get("type") != "hello":
+            raise ValueError("expected a hello message selecting the channel")
+        channel = self.by_name.get(str(hello.get("channel", "")).lower())
+        if channel is None:
+            raise ValueError(f"unknown channel: {hello.get('channel')}")
+        return channel
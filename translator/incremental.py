@@ -0,0 +1,89 @@
+import re
+from typing import List, Optional
+
+
+# ==========================
+# TRADUCCIÓN INCREMENTAL (prefijo estable)
+# ==========================
+#
+# Con resultados parciales del STT ("recognizing") no hace falta esperar al
+# final de la frase: el prefijo de palabras que se repite en las últimas
+# `min_stable` hipótesis ya no va a cambiar, así que se confirma y se
+# traduce/sintetiza mientras el orador sigue hablando. La última palabra
+# de cada hipótesis nunca se confirma (puede estar a medias).
+#
+# Cuando llega el resultado final ("recognized") sólo se manda la cola que
+# falta. Si el final no coincide con lo ya confirmado (el STT corrigió algo)
+# se repite desde la primera palabra distinta y se cuenta como revisión.
+
+_PUNCT = re.compile(r"[^\w']+")
+_CLAUSE_END = (",", ".", ";", ":", "?", "!")
+
+
+def _norm(word: str) -> str:
+    return _PUNCT.sub("", word.casefold())
+
+
+def _common_prefix(a: List[str], b: List[str]) -> int:
+    n = 0
+    for x, y in zip(a, b):
+        if _norm(x) != _norm(y):
+            break
+        n += 1
+    return n
+
+
+class StablePrefixTracker:
+    def __init__(self, min_stable=2, min_words=3):
+        self.min_stable = max(1, min_stable)
+        self.min_words = max(1, min_words)
+
+        self.history: List[List[str]] = []   # últimas hipótesis (palabras)
+        self.committed: List[str] = []       # palabras ya enviadas a traducir
+
+        self.commits = 0
+        self.revisions = 0
+
+    @property
+    def active(self) -> bool:
+        """Hay una frase en curso (alguna hipótesis desde el último final)."""
+        return bool(self.history or self.committed)
+
+    def feed(self, partial: str) -> Optional[str]:
+        """Hipótesis parcial -> segmento nuevo a traducir, o None."""
+        words = partial.split()
+        self.history = (self.history + [words])[-self.min_stable:]
+        if len(self.history) < self.min_stable:
+            return None
+
+        stable = len(words) - 1
+        for other in self.history[:-1]:
+            stable = min(stable, _common_prefix(other, words))
+        if _common_prefix(self.committed, words) < len(self.committed):
+            return None  # la hipótesis contradice lo confirmado: esperar al final
+
+        candidate = words[len(self.committed):stable]
+        if len(candidate) < self.min_words:
+            return None
+
+        # preferir cortar en un final de cláusula si lo hay
+        for i in range(len(candidate) - 1, self.min_words - 2, -1):
+            if candidate[i].endswith(_CLAUSE_END):
+                candidate = candidate[:i + 1]
+                break
+
+        self.committed += candidate
+        self.commits += 1
+        return " ".join(candidate)
+
+    def final(self, text: str) -> Optional[str]:
+        """Resultado final -> lo que falta por traducir, o None. Reinicia el estado."""
+        words = text.split()
+        n = _common_prefix(self.committed, words)
+        if n < len(self.committed):
+            self.revisions += 1
+
+        self.history = []
+        self.committed = []
+        tail = words[n:]
+        return " ".join(tail) if tail else None
@@ -0,0 +1,183 @@
+import time
+import asyncio
+import weakref
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, List, Optional
+
+import metrics
+from tracing import Trace, export as export_trace
+
+
+# ==========================
+# PIPELINE POR CONEXIÓN: TRADUCIR -> SINTETIZAR -> ENVIAR
+# ==========================
+#
+# Tres etapas concurrentes, un worker cada una, unidas por colas acotadas:
+#
+#   text_q -> [traducir] -> synth_q -> [sintetizar] -> send_q -> [enviar]
+#
+# Mientras la frase N se envía, la N+1 ya se está traduciendo y
+# sintetizando. Cada etapa procesa las frases en orden, así que la salida
+# sale en el mismo orden en que se reconoció. La etapa de síntesis mete la
+# frase en send_q antes de sintetizar y va llenando una cola por destino:
+# el envío empieza con el primer chunk, igual que sin pipeline.
+#
+# `depth` acota cuántas frases pueden ir por delante de la que se envía.
+# Cada etapa marca sus tiempos en utt.trace (ver tracing.py).
+# `text_q` y `new_output` permiten usar las colas con política de
+# sobrecarga de overload.py; por defecto son asyncio.Queue.
+
+@dataclass
+class Utterance:
+    text: str
+    final: bool = True
+    translations: Optional[Dict[str, str]] = None
+    error: Optional[str] = None                                  # fallo al traducir
+    tts_errors: Dict[int, str] = field(default_factory=dict)     # destino -> fallo TTS
+    outputs: List[asyncio.Queue] = field(default_factory=list)  # una por destino; None = fin
+    trace: Trace = field(default_factory=Trace)
+
+    def merge(self, other: "Utterance") -> "Utterance":
+        """Fusiona dos frases pendientes (cola de texto saturada); se queda la traza más antigua."""
+        merged = Utterance(f"{self.text} {other.text}", other.final, trace=self.trace)
+        merged.trace.attributes["coalesced"] = int(self.trace.attributes.get("coalesced", 0)) + 1
+        return merged
+
+
+_active = weakref.WeakSet()
+_totals = {"utterances": 0, "errors": 0}
+
+
+class Pipeline:
+    def __init__(self, n_outputs: int,
+                 translate: Callable[[Utterance], Awaitable[None]],
+                 synthesize: Callable[[Utterance, int, Callable], Awaitable[None]],
+                 send: Callable[[Utterance], Awaitable[None]],
+                 depth=2, max_pending=50,
+                 text_q: Optional[asyncio.Queue] = None,
+                 new_output: Callable[[], asyncio.Queue] = asyncio.Queue):
+        self.n_outputs = n_outputs
+        self.translate = translate
+        self.synthesize = synthesize
+        self.send = send
+
+        self.text_q: asyncio.Queue = text_q if text_q is not None else asyncio.Queue(maxsize=max_pending)
+        self.new_output = new_output
+        self.synth_q: asyncio.Queue = asyncio.Queue(maxsize=depth)
+        self.send_q: asyncio.Queue = asyncio.Queue(maxsize=depth)
+        self.in_flight = 0
+        self.tasks = []
+        _active.add(self)
+
+    @property
+    def busy(self) -> bool:
+        return self.in_flight > 0
+
+    def put_nowait(self, text: str, final: bool = True, trace: Optional[Trace] = None) -> None:
+        self.text_q.put_nowait(Utterance(text, final, trace=trace or Trace()))
+
+    def start(self) -> List[asyncio.Task]:
+        self.tasks = [
+            asyncio.create_task(self._translate_stage()),
+            asyncio.create_task(self._synth_stage()),
+            asyncio.create_task(self._send_stage()),
+        ]
+        return self.tasks
+
+    def cancel(self) -> None:
+        _active.discard(self)
+        for t in self.tasks:
+            t.cancel()
+
+    async def _translate_stage(self):
+        while True:
+            utt = await self.text_q.get()
+            self.in_flight += 1
+            _totals["utterances"] += 1
+            utt.trace.mark("translate_start")
+            try:
+                await self.translate(utt)
+            except Exception as e:
+                utt.error = str(e)
+            utt.trace.mark("translate_end")
+            await self.synth_q.put(utt)
+
+    async def _synth_stage(self):
+        while True:
+            utt = await self.synth_q.get()
+            utt.outputs = [self.new_output() for _ in range(self.n_outputs)]
+            await self.send_q.put(utt)
+            if utt.error is None:
+                await asyncio.gather(*(self._synth_one(utt, i) for i in range(self.n_outputs)))
+            else:
+                for q in utt.outputs:
+                    q.put_nowait(None)
+
+    async def _synth_one(self, utt: Utterance, index: int):
+        out = utt.outputs[index]
+        start = time.monotonic()
+        utt.trace.mark(f"tts_start.{index}", start)
+        first = True
+
+        def emit(chunk):
+            nonlocal first
+            if first:
+                first = False
+                now = time.monotonic()
+                utt.trace.mark(f"tts_first_byte.{index}", now)
+                metrics.TTS_FIRST_BYTE.observe(now - start)
+            out.put_nowait(chunk)
+
+        try:
+            await self.synthesize(utt, index, emit)
+        except Exception as e:
+            utt.tts_errors[index] = str(e)
+        else:
+            metrics.TTS_TOTAL.observe(time.monotonic() - start)
+        finally:
+            utt.trace.mark(f"tts_end.{index}")
+            out.put_nowait(None)
+
+    async def _send_stage(self):
+        while True:
+            utt = await self.send_q.get()
+            utt.trace.mark("send_start")
+            try:
+                await self.send(utt)
+            except Exception:
+                pass  # conexión cerrada: la sesión se está cerrando
+            finally:
+                self.in_flight -= 1
+                if utt.error is not None or utt.tts_errors:
+                    _totals["errors"] += 1
+                utt.trace.mark("send_end")
+                export_trace(utt.trace, utt.error, utt.tts_errors)
+
+    def depths(self) -> dict:
+        return {
+            "text_q": self.text_q.qsize(),
+            "synth_q": self.synth_q.qsize(),
+            "send_q": self.send_q.qsize(),
+            "in_flight": self.in_flight,
+        }
+
+
+async def drain(out: asyncio.Queue):
+    """Itera los chunks de una salida hasta el None final."""
+    while True:
+        chunk = await out.get()
+        if chunk is None:
+            return
+        yield chunk
+
+
+def pipeline_stats() -> dict:
+    """Profundidad de las colas sumada sobre todas las conexiones activas."""
+    total = {"text_q": 0, "synth_q": 0, "send_q": 0, "in_flight": 0}
+    peak = 0
+    for p in list(_active):
+        d = p.depths()
+        for k in total:
+            total[k] += d[k]
+        peak = max(peak, d["in_flight"])
+    return {**total, "max_in_flight": peak, "connections": len(_active), **_totals}
@@ -0,0 +1,165 @@
+import time
+import struct
+import asyncio
+from collections import deque
+from typing import Tuple
+
+
+# ==========================
+# REPRODUCCIÓN: UN SOLO STREAM DE SALIDA CON JITTER BUFFER
+# ==========================
+#
+# En vez de lanzar un aplay por frase, una única salida (audio_io.AplayOutput)
+# queda abierta toda la sesión y el motor le escribe tramas de `frame_ms` a ritmo de
+# reloj, con sólo `device_ms` por delante de lo que suena (así un flush
+# corta el audio casi al instante). Sin frase pendiente se escribe
+# silencio: el dispositivo no se para y la siguiente frase empieza sin
+# abrir ALSA ni arrancar procesos.
+#
+# Jitter buffer adaptativo: una frase empieza a sonar cuando hay
+# `target_ms` de audio en cola o cuando ya llegó entera. Si a mitad de
+# frase se vacía la cola (la red o el TTS no llegan) se cuenta un underrun,
+# se sube el objetivo UNDERRUN_STEP_MS y se vuelve a acumular; cada frase
+# sin cortes lo baja RECOVER_STEP_MS hasta el mínimo.
+#
+# flush() (barge-in) descarta todo lo pendiente.
+
+UNDERRUN_STEP_MS = 20
+RECOVER_STEP_MS = 5
+
+_END = None  # marca de fin de frase en la cola
+
+
+def parse_wav(data) -> Tuple[int, int, int, memoryview]:
+    """RIFF/WAVE -> (sample_rate, channels, bits, pcm) sin copiar el PCM."""
+    mv = memoryview(data)
+    if len(mv) < 12 or bytes(mv[0:4]) != b"RIFF" or bytes(mv[8:12]) != b"WAVE":
+        raise ValueError("not a RIFF/WAVE file")
+
+    fmt = None
+    pos = 12
+    while pos + 8 <= len(mv):
+        chunk_id = bytes(mv[pos:pos + 4])
+        size = struct.unpack_from("<I", mv, pos + 4)[0]
+        body = pos + 8
+        if chunk_id == b"fmt ":
+            audio_format, channels, rate, _, _, bits = struct.unpack_from("<HHIIHH", mv, body)
+            if audio_format != 1:
+                raise ValueError(f"unsupported WAV format {audio_format}")
+            fmt = (rate, channels, bits)
+        elif chunk_id == b"data":
+            if fmt is None:
+                raise ValueError("WAV data before fmt chunk")
+            # el TTS en streaming puede dejar el tamaño a 0 o 0xFFFFFFFF
+            end = len(mv) if size in (0, 0xFFFFFFFF) else min(len(mv), body + size)
+            return (*fmt, mv[body:end])
+        pos = body + size + (size & 1)
+    raise ValueError("WAV without data chunk")
+
+
+class PlaybackEngine:
+    def __init__(self, output, rate=16000, channels=1, frame_ms=20,
+                 prebuffer_ms=60, max_prebuffer_ms=400, device_ms=80):
+        self.output = output
+        self.rate = rate
+        self.channels = channels
+        self.frame_ms = frame_ms
+        self.frame_bytes = int(rate * frame_ms / 1000) * channels * 2
+        self.silence = bytes(self.frame_bytes)
+        self.min_prebuffer_ms = prebuffer_ms
+        self.max_prebuffer_ms = max_prebuffer_ms
+        self.device_frames = max(1, device_ms // frame_ms)
+
+        self.queue: deque = deque()    # tramas de frame_bytes y marcas _END
+        self.partial = bytearray()     # resto que aún no llena una trama
+        self.queued_frames = 0
+        self.complete = 0              # frases enteras en cola
+        self.playing = False
+        self.target_ms = prebuffer_ms
+        self.clean = True              # frase actual sin underruns
+
+        self.utterances = 0
+        self.underruns = 0
+        self.flushes = 0
+
+    # --- entrada (desde el downlink) ---
+
+    def feed(self, pcm) -> None:
+        self.partial += pcm
+        n = len(self.partial) // self.frame_bytes * self.frame_bytes
+        for i in range(0, n, self.frame_bytes):
+            self.queue.append(bytes(self.partial[i:i + self.frame_bytes]))
+        self.queued_frames += n // self.frame_bytes
+        del self.partial[:n]
+
+    def end_utterance(self) -> None:
+        if self.partial:
+            self.partial += bytes(self.frame_bytes - len(self.partial))
+            self.feed(b"")
+        self.queue.append(_END)
+        self.complete += 1
+
+    def flush(self) -> None:
+        """Barge-in: descarta lo pendiente (lo ya enviado al dispositivo son ≤ device_ms)."""
+        if self.queue or self.partial:
+            self.flushes += 1
+        self.queue.clear()
+        self.partial.clear()
+        self.queued_frames = 0
+        self.complete = 0
+        self.playing = False
+
+    # --- salida ---
+
+    def _next_frame(self) -> bytes:
+        while True:
+            if not self.playing:
+                buffered_ms = self.queued_frames * self.frame_ms
+                if self.complete == 0 and buffered_ms < self.target_ms:
+                    return self.silence
+                self.playing = True
+                self.clean = True
+
+            if not self.queue:
+                # se vació a mitad de frase: esperar a más audio con más margen
+                self.underruns += 1
+                self.clean = False
+                self.playing = False
+                self.target_ms = min(self.max_prebuffer_ms, self.target_ms + UNDERRUN_STEP_MS)
+                return self.silence
+
+            frame = self.queue.popleft()
+            if frame is not _END:
+                self.queued_frames -= 1
+                return frame
+
+            self.complete -= 1
+            self.utterances += 1
+            self.playing = False
+            if self.clean:
+                self.target_ms = max(self.min_prebuffer_ms, self.target_ms - RECOVER_STEP_MS)
+
+    async def run(self) -> None:
+        """Escribe una trama cada frame_ms, con device_frames por delante."""
+        frame_s = self.frame_ms / 1000
+        start = time.monotonic()
+        written = 0
+        while True:
+            played = (time.monotonic() - start) / frame_s
+            if played > written:
+                # nos retrasamos (loop ocupado): re-anclar el reloj
+                start = time.monotonic() - written * frame_s
+                played = written
+            if written - played < self.device_frames:
+                await self.output.write(self._next_frame())
+                written += 1
+            else:
+                await asyncio.sleep(frame_s)
+
+    def stats(self) -> dict:
+        return {
+            "utterances": self.utterances,
+            "underruns": self.underruns,
+            "flushes": self.flushes,
+            "target_ms": self.target_ms,
+        }
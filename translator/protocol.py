@@ -0,0 +1,123 @@
+import json
+from dataclasses import dataclass
+from typing import List, Optional
+from urllib.parse import urlsplit, parse_qs
+
+
+# ==========================
+# PROTOCOLO WS
+# ==========================
+#
+# Un canal puede traducir a varios idiomas a la vez (un solo STT). Los
+# destinos salen de --tgt-lang/--tts-voice (listas separadas por comas) o
+# de la URL del cliente:
+#
+#   ws://host:9001/?targets=en:en-US-JennyNeural,fr:fr-CA-JeanNeural
+#
+# La URL sólo puede elegir entre las voces configuradas en el canal (cada
+# voz es un sintetizador en el pool) y como mucho MAX_TARGETS destinos.
+#
+# El mensaje "ready" anuncia la lista de destinos. Con más de un destino,
+# cada mensaje binario lleva delante 1 byte con el índice del destino en
+# esa lista; con uno solo el audio viaja tal cual (clientes antiguos).
+#
+# Un cliente con VAD no manda el silencio: al terminar cada turno (y luego
+# cada pocos segundos mientras siga callado) manda {"type": "silence"} y el
+# servidor cierra el turno en el STT sin esperar audio.
+#
+# Con ?codec=opus el audio viaja comprimido en los dos sentidos si el
+# servidor puede ("codec" en "ready"); ver codec.py.
+
+MAX_TARGETS = 8     # muy por debajo de los 256 índices de tag_frame
+
+
+@dataclass
+class Target:
+    lang: str
+    voice: str
+
+
+# locales cuyo código en Translator no es el prefijo de idioma
+_TRANSLATOR_LANGS = {"zh-CN": "zh-Hans", "zh-TW": "zh-Hant", "zh-HK": "yue", "pt-PT": "pt-pt"}
+
+
+def source_lang(locale: Optional[str]) -> Optional[str]:
+    """es-ES -> es (parámetro from= de Translator)."""
+    if not locale:
+        return None
+    return _TRANSLATOR_LANGS.get(locale, locale.split("-")[0])
+
+
+def split_list(value: Optional[str]) -> List[str]:
+    return [v.strip() for v in (value or "").split(",") if v.strip()]
+
+
+def default_targets(tgt_lang: str, tts_voice: str) -> List[Target]:
+    langs = split_list(tgt_lang)
+    voices = split_list(tts_voice)
+    if not langs:
+        raise ValueError("at least one target language is required")
+    if len(langs) != len(voices):
+        raise ValueError(f"{len(langs)} target languages but {len(voices)} TTS voices")
+    if len(langs) > MAX_TARGETS:
+        raise ValueError(f"at most {MAX_TARGETS} targets per channel")
+    return [Target(lang, voice) for lang, voice in zip(langs, voices)]
+
+
+def targets_from_path(path: Optional[str], default: List[Target]) -> List[Target]:
+    query = parse_qs(urlsplit(path or "").query)
+    spec = query.get("targets")
+    if not spec:
+        return default
+
+    items = split_list(spec[0])
+    if len(items) > MAX_TARGETS:
+        raise ValueError(f"at most {MAX_TARGETS} targets")
+
+    voices = {t.voice for t in default}
+    targets = []
+    for item in items:
+        lang, _, voice = item.partition(":")
+        if not lang or not voice:
+            raise ValueError(f"target '{item}' must be lang:voice")
+        if voice not in voices:
+            raise ValueError(f"voice '{voice}' is not configured (available: {', '.join(sorted(voices))})")
+        target = Target(lang, voice)
+        if target in targets:
+            raise ValueError(f"duplicate target '{item}'")
+        targets.append(target)
+    return targets or default
+
+
+def codec_from_path(path: Optional[str]) -> Optional[str]:
+    """Codec pedido por el cliente (?codec=opus); ver codec.py."""
+    value = parse_qs(urlsplit(path or "").query).get("codec")
+    return value[0].lower() if value else None
+
+
+def resume_from_path(path: Optional[str]) -> Optional[str]:
+    """Token de una sesión anterior (?resume=...) que el cliente quiere retomar."""
+    value = parse_qs(urlsplit(path or "").query).get("resume")
+    return value[0] if value else None
+
+
+def with_query(url: str, key: str, value: str) -> str:
+    return f"{url}{'&' if urlsplit(url).query else '?'}{key}={value}"
+
+
+def tag_frame(index: int, data) -> bytes:
+    return bytes((index,)) + data
+
+
+def untag_frame(data: bytes):
+    return data[0], data[1:]
+
+
+SILENCE_MESSAGE = json.dumps({"type": "silence"})
+
+
+def is_silence(msg: str) -> bool:
+    try:
+        return json.loads(msg).get("type") == "silence"
+    except (ValueError, AttributeError):
+        return False
@@ -0,0 +1,129 @@
+import os
+import json
+import secrets
+import asyncio
+from typing import Dict, Optional
+
+from websockets.exceptions import ConnectionClosed
+
+
+# ==========================
+# SESIONES REANUDABLES
+# ==========================
+#
+# Con --resume-grace-s > 0 el mensaje "ready" lleva un token ("resume").
+# Si el WebSocket se cae (cierre anormal, no 1000/1001), la sesión (recognizer, pipeline, colas) no se
+# cierra: queda desenganchada hasta `resume-grace-s` segundos. Un cliente
+# que reconecta con ?resume=<token> recibe otra vez "ready" con
+# "resumed": true y sigue en la misma sesión: el audio que reenvía llega al
+# mismo recognizer y las frases que estaban en el pipeline se le envían al
+# volver (mientras tanto send() espera). Si el token no existe o caducó se
+# abre una sesión nueva ("resumed": false).
+#
+# Tras una caída real (wifi) el servidor tarda en notarla (ping_interval +
+# ping_timeout) y el cliente suele volver antes: un token válido se queda
+# con la sesión aunque siga enganchada al WebSocket viejo, que se corta.
+# "ready" lleva también "received", los mensajes de audio/silencio que
+# llegaron, para que el cliente reenvíe lo que se perdió en el corte.
+#
+# Los tokens viven en la memoria de un proceso: con --workers N el kernel
+# reparte las conexiones (SO_REUSEPORT) y la reconexión puede caer en otro
+# worker, así que con más de un worker no se reanuda.
+
+
+CLEAN_CLOSE_CODES = (1000, 1001)
+
+
+def closed_cleanly(ws) -> bool:
+    """Cierre normal del cliente (no una caída): la sesión termina sin esperar."""
+    return ws.close_code in CLEAN_CLOSE_CODES
+
+
+def add_resume_args(p):
+    p.add_argument("--resume-grace-s", type=float, default=float(os.getenv("RESUME_GRACE_S", 30)),
+                   help="Segundos que una sesión espera a que su cliente reconecte "
+                        "(0 = sin reanudar; con --workers > 1 siempre 0)")
+
+
+class Link:
+    """El WebSocket actual de una sesión; cambia cuando el cliente reconecta."""
+    def __init__(self, ws, ready: dict):
+        self.ws = ws
+        self.ready = ready            # mensaje "ready" original, para repetirlo
+        self.token: Optional[str] = None
+        self.attached = asyncio.Event()
+        self.attached.set()
+        self.resuming = False         # un cliente está retomándola
+        self.resumes = 0
+        self.received = 0             # mensajes de audio/silencio recibidos del cliente
+
+    async def send(self, msg) -> None:
+        """Envía por el WebSocket actual; desenganchada, espera a que vuelva el cliente."""
+        while True:
+            await self.attached.wait()
+            ws = self.ws
+            try:
+                await ws.send(msg)
+                return
+            except ConnectionClosed:
+                self.detach(ws)
+
+    def detach(self, ws) -> None:
+        if ws is self.ws:
+            self.attached.clear()
+
+    async def wait_attached(self, timeout: float) -> bool:
+        try:
+            await asyncio.wait_for(self.attached.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def attach(self, ws) -> None:
+        try:
+            await ws.send(json.dumps({**self.ready, "resume": self.token, "resumed": True,
+                                      "received": self.received}, ensure_ascii=False))
+        finally:
+            self.resuming = False
+        stale, self.ws = self.ws, ws
+        self.resumes += 1
+        self.attached.set()
+        if stale is not ws and not stale.closed:
+            # el ping aún no detectó la caída: cortar el WebSocket viejo ya
+            stale.transport.abort()
+
+
+class ResumeRegistry:
+    def __init__(self, grace_s: float):
+        self.grace_s = grace_s
+        self.links: Dict[str, Link] = {}
+        self.resumed = 0
+        self.expired = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.grace_s > 0
+
+    def register(self, link: Link) -> Optional[str]:
+        if not self.enabled:
+            return None
+        link.token = secrets.token_urlsafe(16)
+        self.links[link.token] = link
+        return link.token
+
+    def forget(self, link: Link) -> None:
+        self.links.pop(link.token, None)
+
+    def take(self, token: Optional[str]) -> Optional[Link]:
+        """La sesión del token, si existe (aunque el WebSocket viejo parezca vivo)."""
+        link = self.links.get(token) if token else None
+        if link is None or link.resuming:
+            return None
+        link.resuming = True
+        self.resumed += 1
+        return link
+
+    def stats(self) -> dict:
+        detached = sum(1 for link in self.links.values() if not link.attached.is_set())
+        return {"sessions": len(self.links), "detached": detached,
+                "resumed": self.resumed, "expired": self.expired}
@@ -0,0 +1,162 @@
+import os
+import json
+import time
+from typing import Dict, Optional
+
+
+# ==========================
+# TRAZAS POR FRASE
+# ==========================
+#
+# Cada frase reconocida lleva un trace_id y marcas de tiempo monotónicas
+# (ms) en cada frontera de etapa:
+#
+#   speech_end -> recognized -> translate_start -> translate_end
+#     -> tts_start.i -> tts_first_byte.i -> tts_end.i   (una por destino)
+#     -> send_start -> send_end
+#
+# El trace_id y las marcas hechas hasta ese momento van en los mensajes
+# JSON ("trace_id", "ts"). Con --trace-file cada frase terminada se escribe
+# como una línea OTLP-JSON (formato del file exporter de OpenTelemetry):
+# se puede cargar en Jaeger/Tempo o leer con jq sin collector en vivo.
+
+SCOPE = "gadget-translator"
+
+# monotonic -> epoch para los spans exportados
+_EPOCH_OFFSET_NS = time.time_ns() - time.monotonic_ns()
+
+_exporter: Optional["FileExporter"] = None
+
+
+def _new_id(n_bytes: int) -> str:
+    return os.urandom(n_bytes).hex()
+
+
+class Trace:
+    def __init__(self, recognized: Optional[float] = None, speech_end: Optional[float] = None):
+        self.trace_id = _new_id(16)
+        self.marks: Dict[str, float] = {}
+        self.attributes: Dict[str, object] = {}
+        if speech_end is not None:
+            self.marks["speech_end"] = speech_end
+        self.mark("recognized", recognized)
+
+    def mark(self, name: str, at: Optional[float] = None) -> None:
+        self.marks[name] = time.monotonic() if at is None else at
+
+    def fields(self) -> dict:
+        """Campos para los mensajes JSON: trace_id y marcas en ms monotónicos."""
+        return {
+            "trace_id": self.trace_id,
+            "ts": {k: round(v * 1000, 1) for k, v in self.marks.items()},
+        }
+
+
+# ==========================
+# EXPORTADOR OTLP-JSON A FICHERO
+# ==========================
+
+def _attr(key: str, value) -> dict:
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int):
+        return {"key": key, "value": {"intValue": str(value)}}
+    if isinstance(value, float):
+        return {"key": key, "value": {"doubleValue": value}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+
+def _span(trace: Trace, name: str, start: float, end: float, parent: Optional[str] = None,
+          attributes: Optional[dict] = None, error: Optional[str] = None) -> dict:
+    span = {
+        "traceId": trace.trace_id,
+        "spanId": _new_id(8),
+        "name": name,
+        "kind": 1,  # INTERNAL
+        "startTimeUnixNano": str(int(start * 1e9) + _EPOCH_OFFSET_NS),
+        "endTimeUnixNano": str(int(end * 1e9) + _EPOCH_OFFSET_NS),
+        "attributes": [_attr(k, v) for k, v in (attributes or {}).items()],
+    }
+    if parent:
+        span["parentSpanId"] = parent
+    if error:
+        span["status"] = {"code": 2, "message": error}
+    return span
+
+
+def build_spans(trace: Trace, error: Optional[str] = None, tts_errors: Optional[dict] = None) -> list:
+    m = trace.marks
+    start = m.get("speech_end", m["recognized"])
+    end = m.get("send_end", max(m.values()))
+
+    root = _span(trace, "utterance", start, end, attributes=trace.attributes, error=error)
+    spans = [root]
+    parent = root["spanId"]
+
+    def child(name, a, b, **kw):
+        if a in m and b in m:
+            spans.append(_span(trace, name, m[a], m[b], parent, **kw))
+
+    child("stt.finalize", "speech_end", "recognized")
+    child("queue.wait", "recognized", "translate_start")
+    child("translate", "translate_start", "translate_end", error=error)
+
+    index = 0
+    while f"tts_start.{index}" in m:
+        attrs = {"target": index}
+        if f"tts_first_byte.{index}" in m:
+            attrs["first_byte_ms"] = round((m[f"tts_first_byte.{index}"] - m[f"tts_start.{index}"]) * 1000, 1)
+        child(f"tts.{index}", f"tts_start.{index}", f"tts_end.{index}",
+              attributes=attrs, error=(tts_errors or {}).get(index))
+        index += 1
+
+    child("send", "send_start", "send_end")
+    return spans
+
+
+class FileExporter:
+    """Una línea OTLP-JSON (resourceSpans) por frase, en modo append."""
+    def __init__(self, path: str, service: str):
+        self.path = path
+        self.service = service
+        self.file = open(path, "a", encoding="utf-8")
+        self.exported = 0
+        self.errors = 0
+
+    def export(self, spans: list) -> None:
+        line = json.dumps({"resourceSpans": [{
+            "resource": {"attributes": [_attr("service.name", self.service), _attr("process.pid", os.getpid())]},
+            "scopeSpans": [{"scope": {"name": SCOPE}, "spans": spans}],
+        }]}, ensure_ascii=False)
+        try:
+            # flush por línea: con O_APPEND varios workers pueden compartir fichero
+            self.file.write(line + "\n")
+            self.file.flush()
+            self.exported += 1
+        except OSError:
+            self.errors += 1
+
+    def close(self) -> None:
+        self.file.close()
+
+
+def add_tracing_args(p):
+    p.add_argument("--trace-file", default=os.getenv("TRACE_FILE"),
+                   help="Fichero OTLP-JSON donde escribir un trace por frase")
+
+
+def configure(path: Optional[str], service: str) -> None:
+    global _exporter
+    if path:
+        _exporter = FileExporter(path, service)
+
+
+def export(trace: Trace, error: Optional[str] = None, tts_errors: Optional[dict] = None) -> None:
+    if _exporter is not None:
+        _exporter.export(build_spans(trace, error, tts_errors))
+
+
+def tracing_stats() -> dict:
+    if _exporter is None:
+        return {}
+    return {"exported": _exporter.exported, "errors": _exporter.errors}
@@ -0,0 +1,204 @@
+import os
+import json
+import time
+import signal
+import asyncio
+import multiprocessing
+from multiprocessing.connection import wait
+
+import metrics
+
+
+# ==========================
+# MODO MULTI-PROCESO (--workers N)
+# ==========================
+#
+# El supervisor hace fork de N workers; cada uno levanta su propio event
+# loop y escucha en el mismo puerto con SO_REUSEPORT, así el kernel reparte
+# las conexiones entre los 4 cores del Pi. Si un worker muere se vuelve a
+# lanzar (con espera creciente si cae en bucle). Cada worker manda sus
+# estadísticas por un pipe y el supervisor imprime la suma. Por el mismo
+# pipe llegan los snapshots de métricas ("metrics", {...}) y el supervisor
+# sirve /metrics con la suma de todos los workers.
+
+RESTART_WINDOW = 60.0
+MAX_RESTART_DELAY = 30.0
+
+# métricas que no se suman entre workers sino que se promedian
+_MEAN_KEYS = ("ratio", "utilization", "avg")
+# picos (max_in_flight, max_batch...) y capacidades configuradas por worker
+# (pool_size, max_bytes...): se toma el máximo, sumarlos no significa nada
+_PEAK_PREFIX = "max_"
+_CAPACITY_KEYS = ("pool_size", "max_threads")
+
+
+def add_worker_args(p):
+    p.add_argument("--workers", type=int, default=1,
+                   help="Procesos worker compartiendo el puerto (SO_REUSEPORT)")
+
+
+def merge_stats(items):
+    """Suma recursiva de dicts de estadísticas (promedio en ratios, máximo en picos y capacidades)."""
+    items = [i for i in items if i]
+    if not items:
+        return {}
+    merged = {}
+    for key in dict.fromkeys(k for i in items for k in i):
+        values = [i[key] for i in items if key in i]
+        if all(isinstance(v, dict) for v in values):
+            merged[key] = merge_stats(values)
+        elif all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in values):
+            if key.startswith(_PEAK_PREFIX) or key in _CAPACITY_KEYS:
+                merged[key] = max(values)
+            elif any(m in key for m in _MEAN_KEYS):
+                merged[key] = round(sum(values) / len(values), 3)
+            else:
+                merged[key] = sum(values)
+        else:
+            merged[key] = values[0]
+    return merged
+
+
+def _worker_entry(serve, args, worker_id, conn):
+    # el supervisor gestiona SIGINT; el worker sólo muere por SIGTERM
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    def sink(stats):
+        try:
+            conn.send(stats)
+        except (OSError, ValueError):
+            pass
+
+    args.worker_id = worker_id
+    asyncio.run(serve(args, stats_sink=sink))
+
+
+class Supervisor:
+    def __init__(self, serve, args, name):
+        self.serve = serve
+        self.args = args
+        self.name = name
+        self.ctx = multiprocessing.get_context("fork")
+
+        self.procs = {}     # worker_id -> Process
+        self.conns = {}     # worker_id -> Connection
+        self.latest = {}    # worker_id -> último dict de stats
+        self.metrics = {}   # worker_id -> último snapshot de métricas
+        self.crashes = {}   # worker_id -> [timestamps]
+        self.restarts = 0
+        self.stopping = False
+
+    def _spawn(self, worker_id):
+        parent, child = self.ctx.Pipe(duplex=False)
+        proc = self.ctx.Process(
+            target=_worker_entry,
+            args=(self.serve, self.args, worker_id, child),
+            name=f"{self.name}-worker-{worker_id}",
+            daemon=True,
+        )
+        proc.start()
+        child.close()
+        self.procs[worker_id] = proc
+        self.conns[worker_id] = parent
+        print(f"[{self.name}] worker {worker_id} started (pid {proc.pid})", flush=True)
+
+    def _restart_delay(self, worker_id) -> float:
+        now = time.monotonic()
+        recent = [t for t in self.crashes.get(worker_id, []) if now - t < RESTART_WINDOW]
+        recent.append(now)
+        self.crashes[worker_id] = recent
+        return min(MAX_RESTART_DELAY, 0.5 * 2 ** (len(recent) - 1))
+
+    def _stop(self, *_):
+        self.stopping = True
+
+    def _forward(self, signum, _frame):
+        # SIGUSR1 (volcado del perfil) a todos los workers
+        for proc in list(self.procs.values()):
+            if proc.is_alive():
+                os.kill(proc.pid, signum)
+
+    def stats(self) -> dict:
+        merged = merge_stats(list(self.latest.values()))
+        merged["workers"] = {
+            "configured": self.args.workers,
+            "alive": sum(p.is_alive() for p in self.procs.values()),
+            "restarts": self.restarts,
+        }
+        return merged
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+        if getattr(self.args, "profile", False):
+            signal.signal(signal.SIGUSR1, self._forward)
+
+        for worker_id in range(self.args.workers):
+            self._spawn(worker_id)
+
+        if getattr(self.args, "metrics_port", 0):
+            metrics.callback("translator_workers_alive", "Workers vivos",
+                             lambda: sum(p.is_alive() for p in list(self.procs.values())))
+            metrics.callback("translator_worker_restarts_total", "Workers relanzados tras caerse",
+                             lambda: self.restarts, kind="counter")
+            metrics.start_http_server(
+                self.args.host, self.args.metrics_port,
+                lambda: metrics.merge_snapshots([metrics.snapshot(), *list(self.metrics.values())]),
+                self.name,
+            )
+
+        pending = {}  # worker_id -> momento de relanzar
+        next_report = time.monotonic() + (self.args.stats_interval or 0)
+
+        while not self.stopping:
+            now = time.monotonic()
+            for worker_id, at in list(pending.items()):
+                if now >= at:
+                    del pending[worker_id]
+                    self.restarts += 1
+                    self._spawn(worker_id)
+
+            sentinels = {p.sentinel: wid for wid, p in self.procs.items() if wid not in pending}
+            conns = {c: wid for wid, c in self.conns.items() if wid not in pending}
+            ready = wait(list(sentinels) + list(conns), timeout=0.5)
+
+            for obj in ready:
+                if obj in conns:
+                    try:
+                        msg = obj.recv()
+                    except (EOFError, OSError):
+                        continue
+                    if isinstance(msg, tuple) and msg[0] == "metrics":
+                        self.metrics[conns[obj]] = msg[1]
+                    else:
+                        self.latest[conns[obj]] = msg
+                elif obj in sentinels:
+                    worker_id = sentinels[obj]
+                    proc = self.procs[worker_id]
+                    proc.join()
+                    self.conns.pop(worker_id).close()
+                    self.latest.pop(worker_id, None)
+                    self.metrics.pop(worker_id, None)
+                    if self.stopping:
+                        continue
+                    delay = self._restart_delay(worker_id)
+                    print(f"[{self.name}] worker {worker_id} (pid {proc.pid}) exited with code "
+                          f"{proc.exitcode}, restarting in {delay:.1f}s", flush=True)
+                    pending[worker_id] = time.monotonic() + delay
+
+            if self.args.stats_interval and time.monotonic() >= next_report:
+                next_report = time.monotonic() + self.args.stats_interval
+                print(f"[{self.name}] stats", json.dumps(self.stats(), ensure_ascii=False), flush=True)
+
+        print(f"[{self.name}] stopping {len(self.procs)} workers", flush=True)
+        for proc in self.procs.values():
+            if proc.is_alive():
+                proc.terminate()
+        for proc in self.procs.values():
+            proc.join(timeout=5)
+            if proc.is_alive():
+                os.kill(proc.pid, signal.SIGKILL)
+
+
+def run_workers(serve, args, name):
+    Supervisor(serve, args, name).run()
@@ -1,9 +1,57 @@
+import sys
+import json
+import time
+import random
 import asyncio
 import argparse
-import subprocess
-import sys
+import collections
+from typing import Optional
+
 import websockets
 
+from protocol import untag_frame, with_query, SILENCE_MESSAGE
+from vad import Vad
+from codec import OPUS, OPUS_AVAILABLE, OpusEncoder, OpusDecoder, unpack_packets
+from playback import PlaybackEngine, parse_wav
+from audio_io import add_audio_args, open_capture, open_playback
+
+
+def add_client_args(p):
+    """Opciones de audio y de sesión comunes a ws_audio_client.py y ws_multi_client.py."""
+    p.add_argument("--rate", type=int, default=16000)
+    p.add_argument("--channels", type=int, default=1)
+    p.add_argument("--chunk-ms", type=int, default=20)
+    p.add_argument("--bytes-per-sample", type=int, default=2)
+    p.add_argument("--codec", choices=["opus", "pcm"], default="pcm",
+                   help="opus: audio comprimido si el servidor (y opuslib) lo permiten (opt-in)")
+    p.add_argument("--opus-bitrate", type=int, default=24000)
+
+    # VAD: sólo se manda la voz; el silencio se sustituye por {"type": "silence"}
+    p.add_argument("--vad", action=argparse.BooleanOptionalAction, default=True)
+    p.add_argument("--vad-energy-db", type=float, default=-45.0, help="Energía mínima de voz (dBFS RMS)")
+    p.add_argument("--vad-hangover-ms", type=int, default=300, help="Silencio que cierra un turno")
+    p.add_argument("--vad-preroll-ms", type=int, default=200, help="Audio previo que se manda al detectar voz")
+    p.add_argument("--silence-keepalive-ms", type=int, default=10_000,
+                   help="Repetir el aviso de silencio cada N ms mientras no se hable")
+
+    # reproducción: una sola salida con jitter buffer (ver playback.py)
+    p.add_argument("--prebuffer-ms", type=int, default=60, help="Audio mínimo en cola antes de empezar una frase")
+    p.add_argument("--max-prebuffer-ms", type=int, default=400, help="Tope del jitter buffer adaptativo")
+    p.add_argument("--device-buffer-ms", type=int, default=80, help="Audio escrito por delante de lo que suena")
+    p.add_argument("--barge-in", action="store_true", help="Cortar la reproducción en cuanto se habla (VAD)")
+
+    # reconexión: backoff exponencial y buffer de lo capturado mientras tanto
+    p.add_argument("--reconnect", action=argparse.BooleanOptionalAction, default=True,
+                   help="Reconectar (y retomar la sesión del servidor) si se cae el WebSocket")
+    p.add_argument("--reconnect-min-ms", type=int, default=500, help="Primer reintento")
+    p.add_argument("--reconnect-max-ms", type=int, default=10_000, help="Tope del backoff")
+    p.add_argument("--uplink-buffer-ms", type=int, default=45_000,
+                   help="Audio que se guarda para reenviar tras un corte (pendiente y ya enviado); "
+                        "una caída puede tardar ~40 s en detectarse por ping")
+
+    # dispositivo de audio: ALSA en proceso, arecord/aplay o fichero (ver audio_io.py)
+    add_audio_args(p)
+
 
 def parse_args():
     p = argparse.ArgumentParser("WS Audio Client (enterprise)")
@@ -11,103 +59,261 @@ def parse_args():
     p.add_argument("--capture", required=True)
     p.add_argument("--playback", required=True)
     p.add_argument("--name", default="CHANNEL")
-
-    p.add_argument("--rate", type=int, default=16000)
-    p.add_argument("--channels", type=int, default=1)
-    p.add_argument("--chunk-ms", type=int, default=20)
-    p.add_argument("--bytes-per-sample", type=int, default=2)
+    p.add_argument("--lang", help="Idioma a reproducir si el servidor traduce a varios (por defecto el primero)")
+    add_client_args(p)
     return p.parse_args()
 
 
-async def main():
-    args = parse_args()
+def chunk_bytes_for(args) -> int:
+    return int(args.rate * args.chunk_ms / 1000) * args.channels * args.bytes_per_sample
 
-    chunk_bytes = int(args.rate * args.chunk_ms / 1000) * args.channels * args.bytes_per_sample
-
-    arecord_cmd = [
-        "arecord",
-        "-D", args.capture,
-        "-f", "S16_LE",
-        "-r", str(args.rate),
-        "-c", str(args.channels),
-        "-t", "raw",
-        "--buffer-size=64000",
-        "--period-size=16000",
-    ]
 
-    play_q: asyncio.Queue[bytes] = asyncio.Queue(maxsize=30)  # backpressure playback
+def new_player(args, output) -> PlaybackEngine:
+    return PlaybackEngine(
+        output, args.rate, args.channels,
+        frame_ms=args.chunk_ms,
+        prebuffer_ms=args.prebuffer_ms,
+        max_prebuffer_ms=args.max_prebuffer_ms,
+        device_ms=args.device_buffer_ms,
+    )
+
+
+def new_counters() -> dict:
+    return {"captured": 0, "sent": 0, "received": 0, "connected": 0,
+            "reconnects": 0, "resumed": 0, "dropped": 0}
+
+
+# ==========================
+# UPLINK CON BUFFER (sobrevive a las reconexiones)
+# ==========================
+#
+# La captura y el VAD no dependen del WebSocket: lo que hay que mandar
+# (voz y avisos de silencio) se guarda en una cola acotada a
+# --uplink-buffer-ms de audio. Cada sesión la vacía; si la conexión se cae
+# lo dicho mientras tanto espera en la cola y se envía al reconectar. Si la
+# caída dura más, se pierde lo más antiguo (contado en "dropped").
+#
+# Lo que ws.send() ya aceptó antes del corte puede no haber llegado: se
+# guarda también (hasta --uplink-buffer-ms) y, al retomar la sesión, el
+# servidor dice cuántos mensajes recibió ("received" en "ready"); lo que
+# falta vuelve a la cola y se reenvía.
+
+class Uplink:
+    def __init__(self, args, capture, player: PlaybackEngine, counters: dict):
+        self.args = args
+        self.capture = capture
+        self.player = player
+        self.counters = counters
+        self.chunk_bytes = chunk_bytes_for(args)
+        self.max_bytes = int(args.uplink_buffer_ms / args.chunk_ms) * self.chunk_bytes
+        self.pending = collections.deque()   # bytes de voz o SILENCE_MESSAGE
+        self.pending_bytes = 0
+        self.unacked = collections.deque()   # (mensaje, mensajes WS) ya enviados
+        self.unacked_bytes = 0
+        self.unacked_start = 0               # índice en la sesión del primero de unacked
+        self.sent_messages = 0               # mensajes WS enviados en la sesión del servidor
+        self.event = asyncio.Event()
+        self.ended = False
+
+    def _push(self, item) -> None:
+        self.pending.append(item)
+        if isinstance(item, bytes):
+            self.pending_bytes += len(item)
+        while self.pending_bytes > self.max_bytes:
+            old = self.pending.popleft()
+            if isinstance(old, bytes):
+                self.pending_bytes -= len(old)
+                self.counters["dropped"] += len(old)
+        self.event.set()
+
+    async def peek(self):
+        """Siguiente mensaje pendiente (sin quitarlo). EOFError si la captura terminó."""
+        while not self.pending:
+            if self.ended:
+                raise EOFError("capture ended")
+            self.event.clear()
+            await self.event.wait()
+        return self.pending[0]
+
+    def pop(self, messages: int = 1) -> None:
+        """Quita el mensaje ya enviado (en `messages` mensajes WS) y lo guarda por si no llegó."""
+        item = self.pending.popleft()
+        size = len(item) if isinstance(item, bytes) else 0
+        self.pending_bytes -= size
+        self.sent_messages += messages
+        self.unacked.append((item, messages))
+        self.unacked_bytes += size
+        while self.unacked_bytes > self.max_bytes:
+            old, n = self.unacked.popleft()
+            self.unacked_start += n
+            if isinstance(old, bytes):
+                self.unacked_bytes -= len(old)
+
+    def resumed(self, received: int) -> None:
+        """Sesión retomada: lo enviado que el servidor no recibió vuelve a la cola."""
+        index = self.unacked_start
+        replay = []
+        for item, n in self.unacked:
+            if index + n > received:
+                replay.append(item)
+            index += n
+        for item in reversed(replay):
+            self.pending.appendleft(item)
+            if isinstance(item, bytes):
+                self.pending_bytes += len(item)
+        self.restart(received)
+        if replay:
+            print(f"[{self.args.name}] resending {len(replay)} messages lost in the drop", flush=True)
+
+    def restart(self, received: int = 0) -> None:
+        """Sesión nueva (o retomada en `received`): se olvida lo ya enviado."""
+        self.unacked.clear()
+        self.unacked_bytes = 0
+        self.unacked_start = self.sent_messages = received
 
-    print(f"[{args.name}] Connecting to: {args.ws}")
+    async def run(self) -> None:
+        args = self.args
+        vad = None
+        if args.vad:
+            vad = Vad(
+                args.rate, args.channels,
+                frame_ms=args.chunk_ms,
+                energy_db=args.vad_energy_db,
+                hangover_ms=args.vad_hangover_ms,
+                preroll_ms=args.vad_preroll_ms,
+            )
+        keepalive_bytes = int(args.silence_keepalive_ms / args.chunk_ms) * self.chunk_bytes
+        idle_bytes = 0
+
+        reader = self.capture.reader()
+        try:
+            while True:
+                try:
+                    data = await reader.read()  # memoryview del anillo
+                except EOFError:
+                    return
+                self.counters["captured"] += len(data)
+
+                if vad is None:
+                    self._push(bytes(data))
+                    continue
+
+                was_active = vad.active
+                for voice, eos, dropped in vad.segments(data):
+                    if args.barge_in and vad.active and not was_active:
+                        self.player.flush()  # se habla encima: cortar lo que suena
+                    was_active = vad.active
+                    if voice:
+                        self._push(voice)
+                    idle_bytes += dropped
+                    if eos or idle_bytes >= keepalive_bytes:
+                        idle_bytes = 0
+                        self._push(SILENCE_MESSAGE)
+        finally:
+            reader.close()
+            self.ended = True
+            self.event.set()
+
+
+async def run_session(args, uplink: Uplink, player: PlaybackEngine, counters: dict,
+                      resume: Optional[str] = None) -> Optional[str]:
+    """
+    Una conexión WebSocket de un canal: vacía `uplink` hacia el servidor y
+    manda las frases traducidas a `player`. Ambos pueden compartirse con
+    otros canales (ws_multi_client.py). Con `resume` pide retomar la sesión
+    anterior del servidor. Vuelve al cerrarse la conexión o terminar la
+    captura, con el token para reanudar.
+    """
+    url = args.ws
+    if args.codec == OPUS and OPUS_AVAILABLE:
+        url = with_query(url, "codec", OPUS)
+    if resume:
+        url = with_query(url, "resume", resume)
+
+    print(f"[{args.name}] Connecting to: {url}")
 
     async with websockets.connect(
-        args.ws,
+        url,
         max_size=None,
         ping_interval=20,
         ping_timeout=20
     ) as ws:
-        print(f"[{args.name}] WS connected")
-
-        arec = subprocess.Popen(arecord_cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
-        loop = asyncio.get_running_loop()
+        print(f"[{args.name}] WS connected (audio: {args.audio_backend})")
+        counters["connected"] = 1
         stopped = asyncio.Event()
 
-        async def uplink():
+        ready = asyncio.Event()
+        session = {"encoder": None, "decoder": None, "resume": resume}  # según "ready"
+
+        async def uplink_sender():
             try:
+                await ready.wait()
                 while True:
-                    data = await loop.run_in_executor(None, arec.stdout.read, chunk_bytes)
-                    if not data:
-                        await asyncio.sleep(0.01)
-                        continue
-                    await ws.send(data)
+                    item = await uplink.peek()
+                    messages = 1
+                    if isinstance(item, str):
+                        await ws.send(item)
+                    elif session["encoder"] is None:
+                        await ws.send(item)
+                        counters["sent"] += len(item)
+                    else:
+                        packets = session["encoder"].encode(item)
+                        for packet in packets:
+                            await ws.send(packet)
+                            counters["sent"] += len(packet)
+                        messages = len(packets)
+                    uplink.pop(messages)  # sólo tras enviarlo: si se cae, se reenvía al reconectar
             except Exception:
                 stopped.set()
 
+        langs = []  # destinos anunciados en "ready"
+
         async def downlink():
+            nonlocal langs
             try:
                 async for msg in ws:
                     if isinstance(msg, str):
                         print(f"[{args.name}] SERVER:", msg)
+                        evt = json.loads(msg)
+                        if evt.get("type") == "ready":
+                            langs = [t["lang"] for t in evt.get("targets", [])]
+                            if evt.get("codec") == OPUS:
+                                session["encoder"] = OpusEncoder(args.rate, args.channels, args.opus_bitrate)
+                                session["decoder"] = OpusDecoder(args.rate, args.channels)
+                            session["resume"] = evt.get("resume")
+                            if evt.get("resumed"):
+                                counters["resumed"] += 1
+                                uplink.resumed(evt.get("received", 0))
+                            else:
+                                uplink.restart()
+                            ready.set()
                         continue
-                    # wav bytes
-                    await play_q.put(msg)
+
+                    # varios destinos: 1 byte de índice delante del audio
+                    if len(langs) > 1:
+                        index, msg = untag_frame(msg)
+                        if langs[index] != (args.lang or langs[0]):
+                            continue
+                    # una frase entera: WAV (o paquetes Opus) -> PCM al motor de reproducción
+                    if session["decoder"] is not None:
+                        for packet in unpack_packets(msg):
+                            player.feed(session["decoder"].decode(packet))
+                    else:
+                        rate, channels, bits, pcm = parse_wav(msg)
+                        if (rate, channels, bits) != (args.rate, args.channels, 16):
+                            print(f"[{args.name}] skipping WAV {rate} Hz/{channels} ch/{bits} bit "
+                                  f"(playback is {args.rate} Hz/{args.channels} ch/16 bit)")
+                            continue
+                        player.feed(pcm)
+                    player.end_utterance()
+                    counters["received"] += 1
+                stopped.set()  # el servidor cerró la conexión
             except Exception:
                 stopped.set()
 
-        async def playback_worker():
-            """Reproduce WAV secuencialmente sin bloquear el event loop."""
-            try:
-                while not stopped.is_set():
-                    try:
-                        wav_bytes = await asyncio.wait_for(play_q.get(), timeout=1.0)
-                    except asyncio.TimeoutError:
-                        continue
-
-                    # aplay leyendo WAV desde stdin
-                    def _play():
-                        p = subprocess.Popen(
-                            ["aplay", "-D", args.playback, "-t", "wav", "-"],
-                            stdin=subprocess.PIPE,
-                            stdout=subprocess.DEVNULL,
-                            stderr=subprocess.DEVNULL
-                        )
-                        try:
-                            p.stdin.write(wav_bytes)
-                            p.stdin.close()
-                            p.wait(timeout=20)
-                        except Exception:
-                            try:
-                                p.kill()
-                            except Exception:
-                                pass
-
-                    await loop.run_in_executor(None, _play)
-            except asyncio.CancelledError:
-                pass
-
         tasks = [
-            asyncio.create_task(uplink()),
+            asyncio.create_task(uplink_sender()),
             asyncio.create_task(downlink()),
-            asyncio.create_task(playback_worker()),
         ]
 
         try:
@@ -115,14 +321,71 @@ async def main():
         finally:
             for t in tasks:
                 t.cancel()
+            counters["connected"] = 0
+            if counters["captured"]:
+                sent = 100 * counters["sent"] / counters["captured"]
+                print(f"[{args.name}] uplink sent {sent:.0f}% of captured audio")
+        return session["resume"]
+
+
+async def run_channel(args, capture, player: PlaybackEngine, counters: dict) -> None:
+    """
+    Sesiones una tras otra hasta que termine la captura: si la conexión se
+    cae (o no se puede abrir) se reintenta con backoff exponencial y se pide
+    retomar la sesión del servidor con el último token.
+    """
+    uplink = Uplink(args, capture, player, counters)
+    capturing = asyncio.create_task(uplink.run())
+    backoff = args.reconnect_min_ms / 1000
+    token = None
+    try:
+        while not uplink.ended:
+            started = time.monotonic()
             try:
-                arec.terminate()
-            except Exception:
-                pass
-            try:
-                arec.wait(timeout=2)
-            except Exception:
-                pass
+                token = await run_session(args, uplink, player, counters, token)
+            except (OSError, asyncio.TimeoutError, websockets.exceptions.WebSocketException) as e:
+                print(f"[{args.name}] connection failed: {e}")
+            if uplink.ended or not args.reconnect:
+                break
+            if time.monotonic() - started > args.reconnect_max_ms / 1000:
+                backoff = args.reconnect_min_ms / 1000  # la sesión duró: empezar de nuevo
+            delay = backoff * random.uniform(0.5, 1.0)
+            print(f"[{args.name}] reconnecting in {delay:.1f}s "
+                  f"({len(uplink.pending)} messages, {uplink.pending_bytes} bytes buffered)")
+            counters["reconnects"] += 1
+            await asyncio.sleep(delay)
+            backoff = min(backoff * 2, args.reconnect_max_ms / 1000)
+    finally:
+        capturing.cancel()
+
+
+async def main():
+    args = parse_args()
+
+    # captura y reproducción en el propio loop, sin hilos (ver audio_io.py)
+    capture = open_capture(args, args.capture, chunk_bytes_for(args))
+    await capture.open()
+    output = open_playback(args, args.playback)
+    await output.open()
+    player = new_player(args, output)
+    counters = new_counters()
+
+    tasks = [
+        asyncio.create_task(run_channel(args, capture, player, counters)),
+        asyncio.create_task(player.run()),
+    ]
+    try:
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for t in done:
+            t.result()  # errores del dispositivo
+    finally:
+        for t in tasks:
+            t.cancel()
+        print(f"[{args.name}] session", json.dumps({k: v for k, v in counters.items() if k != "connected"}))
+        print(f"[{args.name}] playback", json.dumps(player.stats()))
+        print(f"[{args.name}] capture", json.dumps(capture.stats()))
+        await output.close()
+        await capture.close()
 
 
 if __name__ == "__main__":
@@ -130,4 +393,4 @@ if __name__ == "__main__":
         asyncio.run(main())
     except KeyboardInterrupt:
         print("\nExiting...")
-        sys.exit(0)
\ No newline at end of file
+        sys.exit(0)
@@ -0,0 +1,190 @@
+import os
+import sys
+import json
+import asyncio
+import argparse
+from dataclasses import dataclass
+from typing import Dict, List
+
+import metrics
+from audio_io import open_capture, open_playback
+from playback import PlaybackEngine
+from ws_audio_client import add_client_args, chunk_bytes_for, new_counters, new_player, run_channel
+
+
+# ==========================
+# CLIENTE MULTI-DIADEMA (varios canales en un proceso)
+# ==========================
+#
+# clients.json:
+#
+#   {"channels": [
+#     {"name": "SPA-ENG", "ws": "ws://127.0.0.1:9000/spa-eng",
+#      "capture": "plughw:2,0", "playback": "plughw:3,0"},
+#     {"name": "ENG-SPA", "ws": "ws://127.0.0.1:9000/eng-spa",
+#      "capture": "plughw:3,0", "playback": "plughw:2,0", "barge_in": true}
+#   ]}
+#
+# Cada canal puede cambiar opciones de sesión del cliente ("lang", "codec",
+# "barge_in", "vad_energy_db"...); el formato de audio y los dispositivos
+# (SHARED_OPTIONS) son comunes a todos.
+#
+# Un solo event loop para todos: cada dispositivo se abre una vez. Los
+# canales que comparten micrófono leen el mismo anillo de captura (un lector
+# cada uno) y los que comparten salida encolan sus frases en el mismo motor
+# de reproducción, que las reproduce una detrás de otra. Si un canal se cae
+# reconecta por su cuenta (ver run_channel) y los demás siguen. Si falla una
+# salida de audio se avisa y se paran los canales que reproducen en ella. Con
+# --metrics-port todos salen en el mismo /metrics.
+
+SHARED_OPTIONS = {
+    "rate", "channels", "chunk_ms", "bytes_per_sample", "audio_backend", "period_ms",
+    "capture_buffer_ms", "device_buffer_ms", "prebuffer_ms", "max_prebuffer_ms",
+}
+
+
+@dataclass
+class ClientChannel:
+    name: str
+    args: argparse.Namespace
+    counters: dict
+
+
+def parse_args():
+    p = argparse.ArgumentParser("WS Multi Audio Client")
+    p.add_argument("--config", default=os.getenv("CLIENTS_FILE", "clients.json"),
+                   help="JSON con los canales (name, ws, capture, playback y opciones por canal)")
+    p.add_argument("--host", default="0.0.0.0", help="Interfaz de /metrics")
+    metrics.add_metrics_args(p)
+    add_client_args(p)
+    return p.parse_args()
+
+
+def channel_from_dict(raw: dict, defaults: argparse.Namespace) -> ClientChannel:
+    missing = [k for k in ("name", "ws", "capture", "playback") if not raw.get(k)]
+    if missing:
+        raise ValueError(f"channel needs {', '.join(missing)}: {raw}")
+
+    options = dict(vars(defaults))
+    options["lang"] = None
+    for key, value in raw.items():
+        key = key.replace("-", "_")
+        if key in SHARED_OPTIONS:
+            raise ValueError(f"{raw['name']}: '{key}' is shared by all channels, set it on the command line")
+        if key not in options and key not in ("name", "ws", "capture", "playback"):
+            raise ValueError(f"{raw['name']}: unknown option '{key}'")
+        options[key] = value
+    return ClientChannel(raw["name"], argparse.Namespace(**options), new_counters())
+
+
+def load_channels(path: str, defaults: argparse.Namespace) -> List[ClientChannel]:
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    channels = [channel_from_dict(raw, defaults) for raw in data["channels"]]
+    if len({c.name for c in channels}) != len(channels):
+        raise ValueError("channel names must be unique")
+    return channels
+
+
+async def run_client_channel(channel: ClientChannel, capture, player: PlaybackEngine) -> None:
+    try:
+        await run_channel(channel.args, capture, player, channel.counters)
+    except Exception as e:
+        print(f"[{channel.name}] channel failed: {e}", flush=True)
+
+
+def register_metrics(channels: List[ClientChannel], captures: dict, players: Dict[str, PlaybackEngine]) -> None:
+    def per_channel(key):
+        return lambda: {c.name: c.counters[key] for c in channels}
+
+    metrics.callback("translator_client_connected", "1 si el canal tiene el WebSocket abierto",
+                     per_channel("connected"), label="channel")
+    metrics.callback("translator_client_captured_bytes_total", "PCM capturado", per_channel("captured"),
+                     kind="counter", label="channel")
+    metrics.callback("translator_client_sent_bytes_total", "Audio enviado al servidor (tras VAD/Opus)",
+                     per_channel("sent"), kind="counter", label="channel")
+    metrics.callback("translator_client_utterances_received_total", "Frases traducidas recibidas",
+                     per_channel("received"), kind="counter", label="channel")
+    metrics.callback("translator_client_reconnects_total", "Reintentos de conexión del WebSocket",
+                     per_channel("reconnects"), kind="counter", label="channel")
+    metrics.callback("translator_client_uplink_dropped_bytes_total", "Voz descartada del buffer sin conexión",
+                     per_channel("dropped"), kind="counter", label="channel")
+    metrics.callback("translator_client_capture_overruns_total", "Chunks de captura perdidos por consumidor lento",
+                     lambda: {d: c.overruns for d, c in captures.items()}, kind="counter", label="device")
+    metrics.callback("translator_client_playback_underruns_total", "Frases cortadas por falta de audio",
+                     lambda: {d: p.underruns for d, p in players.items()}, kind="counter", label="device")
+
+
+async def watch(sessions: Dict[asyncio.Task, ClientChannel], playing: Dict[asyncio.Task, str]) -> None:
+    """Espera a los canales; si cae una salida de audio se paran los canales que la usan."""
+    pending = set(sessions) | set(playing)
+    while any(t in pending for t in sessions):
+        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            device = playing.get(task)
+            if device is None or task.cancelled():
+                continue
+            error = task.exception() or "playback stopped"
+            print(f"[playback {device}] failed: {error}", flush=True)
+            for t, c in sessions.items():
+                if c.args.playback == device and not t.done():
+                    print(f"[{c.name}] stopping: nobody can hear it", flush=True)
+                    t.cancel()
+
+
+async def main():
+    args = parse_args()
+    channels = load_channels(args.config, args)
+    chunk_bytes = chunk_bytes_for(args)
+
+    # un dispositivo, una captura / una salida, aunque lo usen varios canales
+    captures = {}
+    outputs = {}
+    players: Dict[str, PlaybackEngine] = {}
+    for channel in channels:
+        device = channel.args.capture
+        if device not in captures:
+            captures[device] = open_capture(args, device, chunk_bytes)
+            await captures[device].open()
+        device = channel.args.playback
+        if device not in outputs:
+            outputs[device] = open_playback(args, device)
+            await outputs[device].open()
+            players[device] = new_player(args, outputs[device])
+
+    print(f"[multi] {len(channels)} channels, {len(captures)} capture and {len(outputs)} playback devices "
+          f"(audio: {args.audio_backend})", flush=True)
+
+    register_metrics(channels, captures, players)
+    stop_metrics = metrics.serve_metrics(args, "multi")
+
+    playing = {asyncio.create_task(p.run()): device for device, p in players.items()}
+    sessions = {
+        asyncio.create_task(run_client_channel(c, captures[c.args.capture], players[c.args.playback])): c
+        for c in channels
+    }
+    try:
+        await watch(sessions, playing)
+    finally:
+        for t in [*sessions, *playing]:
+            t.cancel()
+        if stop_metrics:
+            stop_metrics()
+        for c in channels:
+            print(f"[{c.name}]", json.dumps({k: v for k, v in c.counters.items() if k != "connected"}))
+        for device, p in players.items():
+            print(f"[playback {device}]", json.dumps(p.stats()))
+        for device, c in captures.items():
+            print(f"[capture {device}]", json.dumps(c.stats()))
+        for o in outputs.values():
+            await o.close()
+        for c in captures.values():
+            await c.close()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        print("\nExiting...")
+        sys.exit(0)
@@ -1,10 +1,28 @@
 import os
 import json
+import time
 import asyncio
 import argparse
+import contextlib
 import websockets
-import aiohttp
-import azure.cognitiveservices.speech as speechsdk
+
+from dataclasses import asdict
+
+from backends import add_backend_args, check_backend_args, build_backends, report_stats
+from workers import add_worker_args, run_workers
+from channels import Channel, ChannelRegistry, load_channels
+from protocol import (default_targets, targets_from_path, codec_from_path, resume_from_path, tag_frame,
+                      source_lang, is_silence)
+from codec import OPUS, OpusDecoder, negotiate
+from pipeline import Pipeline, Utterance, drain, pipeline_stats
+from overload import SessionOverload, add_overload_args, overload_stats
+import metrics
+import tracing
+import profiling
+from watchdog import Watchdog, add_watchdog_args, reject_saturated
+from tracing import Trace, tracing_stats
+from resume import Link, ResumeRegistry, add_resume_args, closed_cleanly
+from websockets.exceptions import ConnectionClosed
 
 
 # ==========================
@@ -14,116 +32,161 @@ import azure.cognitiveservices.speech as speechsdk
 def parse_args():
     p = argparse.ArgumentParser("WS Translator Server (enterprise)")
     p.add_argument("--host", default="0.0.0.0")
-    p.add_argument("--port", type=int, required=True)
+    p.add_argument("--port", type=int, help="Puerto común: canal por ruta /<canal> o mensaje hello")
+    p.add_argument("--config", help="JSON con varios canales (ver channels.py)")
 
-    p.add_argument("--speech-key", required=True)
-    p.add_argument("--speech-region", required=True)
+    p.add_argument("--speech-key")
+    p.add_argument("--speech-region")
 
-    p.add_argument("--translator-key", required=True)
-    p.add_argument("--translator-region", required=True)
+    p.add_argument("--translator-key")
+    p.add_argument("--translator-region")
 
-    p.add_argument("--src-locale", required=True)
-    p.add_argument("--tgt-lang", required=True)
-    p.add_argument("--tts-voice", required=True)
+    # canal único (sin --config)
+    p.add_argument("--src-locale")
+    p.add_argument("--tgt-lang", help="Uno o varios idiomas separados por comas (en,fr)")
+    p.add_argument("--tts-voice", help="Una voz por idioma, en el mismo orden")
 
     p.add_argument("--name", default="CHANNEL")
     p.add_argument("--sample-rate", type=int, default=16000)
     p.add_argument("--channels", type=int, default=1)
-    return p.parse_args()
-
-
-# ==========================
-# TRANSLATE
-# ==========================
-
-async def translate_text(session, key, region, tgt_lang, text):
-    url = f"https://api.cognitive.microsofttranslator.com/translate?api-version=3.0&to={tgt_lang}"
-    headers = {
-        "Ocp-Apim-Subscription-Key": key,
-        "Ocp-Apim-Subscription-Region": region,
-        "Content-Type": "application/json",
-    }
-
-    async with session.post(
-        url,
-        headers=headers,
-        json=[{"Text": text}],
-        timeout=aiohttp.ClientTimeout(total=10)
-    ) as resp:
-        data = await resp.json()
-        return data[0]["translations"][0]["text"]
-
-
-# ==========================
-# TTS BUILDER
-# ==========================
-
-def build_synthesizer(speech_key, speech_region, tts_voice):
-    config = speechsdk.SpeechConfig(subscription=speech_key, region=speech_region)
-    config.speech_synthesis_voice_name = tts_voice
-    config.set_speech_synthesis_output_format(
-        speechsdk.SpeechSynthesisOutputFormat.Riff16Khz16BitMonoPcm
-    )
-    return speechsdk.SpeechSynthesizer(speech_config=config, audio_config=None)
+    p.add_argument("--pipeline-depth", type=int, default=2,
+                   help="Frases que pueden traducirse/sintetizarse por delante de la que se envía")
+    p.add_argument("--echo-guard", action="store_true",
+                   help="Descartar frases reconocidas mientras se envía audio (altavoz abierto)")
+
+    add_backend_args(p)
+    add_worker_args(p)
+    metrics.add_metrics_args(p)
+    tracing.add_tracing_args(p)
+    profiling.add_profile_args(p)
+    add_watchdog_args(p)
+    add_overload_args(p, audio_queue=200)
+    add_resume_args(p)
+
+    args = p.parse_args()
+    check_backend_args(p, args)
+    if args.workers > 1 and args.resume_grace_s > 0:
+        # los tokens viven en un proceso y SO_REUSEPORT no lleva la reconexión al mismo worker
+        print(f"[{args.name}] --resume-grace-s ignored with --workers {args.workers}: sessions are not resumable",
+              flush=True)
+        args.resume_grace_s = 0
+    try:
+        if args.config:
+            channels = load_channels(args.config)
+        else:
+            if not args.src_locale or not args.port:
+                p.error("--src-locale, --tgt-lang, --tts-voice and --port are required without --config")
+            targets = default_targets(args.tgt_lang, args.tts_voice)
+            channels = [Channel(args.name, args.src_locale, targets, port=args.port)]
+        args.registry = ChannelRegistry(channels)
+    except (OSError, KeyError, ValueError) as e:
+        p.error(str(e))
+    if not args.port and not args.registry.ports():
+        p.error("no port to listen on: use --port or give channels a port")
+    return args
 
 
 # ==========================
 # CLIENT HANDLER
 # ==========================
 
-async def handle_client(ws, args):
+async def handle_client(ws, args, backends, resumable, default_channel=None, degraded=False):
     loop = asyncio.get_running_loop()
 
-    await ws.send(json.dumps({"type": "ready", "channel": args.name}, ensure_ascii=False))
-
-    audio_q = asyncio.Queue(maxsize=200)
-    text_q = asyncio.Queue(maxsize=50)
+    try:
+        channel = await args.registry.select(ws, default_channel)
+        targets = targets_from_path(ws.path, channel.targets)
+    except (ValueError, asyncio.TimeoutError) as e:
+        await ws.send(json.dumps({"type": "error", "error": str(e) or "channel selection timed out"}, ensure_ascii=False))
+        return
+
+    # con varios destinos el audio va etiquetado con el índice del destino
+    tagged = len(targets) > 1
+
+    # Opus en los dos sentidos si el cliente lo pide y tenemos opuslib
+    # degradada (proceso saturado): PCM sin Opus, sin frases por delante
+    codec = "pcm" if degraded else negotiate(codec_from_path(ws.path))
+    decoder = OpusDecoder(args.sample_rate, args.channels) if codec == OPUS else None
+    tts_codec = OPUS if codec == OPUS else "wav"
+
+    langs = [t.lang for t in targets]
+    src_lang = source_lang(channel.src_locale)
+
+    ready = {
+        "type": "ready",
+        "channel": channel.name,
+        "targets": [asdict(t) for t in targets],
+        "codec": codec,
+        "degraded": degraded,
+    }
+    # el resto de la sesión envía por link: sobrevive a una reconexión (ver resume.py)
+    link = Link(ws, ready)
+    token = resumable.register(link)
+    await ws.send(json.dumps({**ready, "resume": token, "resumed": False}, ensure_ascii=False))
 
-    speaking = False
     closed = asyncio.Event()
 
-    # ===== Azure Recognizer =====
-
-    speech_config = speechsdk.SpeechConfig(
-        subscription=args.speech_key,
-        region=args.speech_region
-    )
-    speech_config.speech_recognition_language = args.src_locale
-
-    stream_format = speechsdk.audio.AudioStreamFormat(
-        samples_per_second=args.sample_rate,
-        bits_per_sample=16,
-        channels=args.channels
+    # colas con política de sobrecarga y presupuesto de memoria (ver overload.py)
+    overload = SessionOverload(args, lambda reason: closed.set())
+    audio_q = overload.audio_queue()
+
+    # ===== Pipeline traducir -> sintetizar -> enviar (ver pipeline.py) =====
+
+    async def translate(utt: Utterance):
+        utt.trace.attributes.update(channel=channel.name, langs=",".join(langs))
+        await link.send(json.dumps({"type": "stt", "text": utt.text, **utt.trace.fields()}, ensure_ascii=False))
+        with metrics.TRANSLATION.time():
+            utt.translations = await backends.translator.translate_multi(utt.text, langs, src_lang)
+
+    async def synthesize(utt: Utterance, index: int, on_audio):
+        target = targets[index]
+        on_audio(await backends.tts.synthesize(utt.translations[target.lang], target.voice, codec=tts_codec))
+
+    async def send(utt: Utterance):
+        if utt.error is not None:
+            await link.send(json.dumps({"type": "error", "error": utt.error, **utt.trace.fields()}, ensure_ascii=False))
+            return
+        for t in targets:
+            await link.send(json.dumps(
+                {"type": "translate", "lang": t.lang, "text": utt.translations[t.lang], **utt.trace.fields()},
+                ensure_ascii=False
+            ))
+
+        # ===== TTS seguro (un audio por idioma, en el orden en que termine) =====
+
+        async def send_audio(index):
+            async for audio in drain(utt.outputs[index]):
+                await link.send(tag_frame(index, audio) if tagged else audio)
+            if index in utt.tts_errors:
+                await link.send(json.dumps({"type": "error", "error": utt.tts_errors[index]}, ensure_ascii=False))
+
+        await asyncio.gather(*(send_audio(i) for i in range(len(targets))))
+
+    pipeline = Pipeline(
+        len(targets), translate, synthesize, send, depth=1 if degraded else args.pipeline_depth,
+        text_q=overload.text_queue(coalesce=Utterance.merge), new_output=overload.output_queue,
     )
 
-    push_stream = speechsdk.audio.PushAudioInputStream(stream_format)
-    audio_config = speechsdk.audio.AudioConfig(stream=push_stream)
-
-    recognizer = speechsdk.SpeechRecognizer(
-        speech_config=speech_config,
-        audio_config=audio_config
-    )
+    # ===== Recognizer (Azure o fake) =====
 
-    def on_recognized(evt):
-        nonlocal speaking
+    def on_recognized(text):
         try:
-            if speaking:
-                return
-
-            if evt.result.reason != speechsdk.ResultReason.RecognizedSpeech:
-                return
-
-            text = (evt.result.text or "").strip()
-            if not text:
+            # con --echo-guard no se aceptan frases nuevas mientras hay audio en curso
+            if args.echo_guard and pipeline.busy:
                 return
 
-            loop.call_soon_threadsafe(text_q.put_nowait, text)
+            # fin de voz del VAD del servidor, si lo hay
+            trace = Trace(time.monotonic(), getattr(stt, "last_turn_end", None))
+            loop.call_soon_threadsafe(pipeline.put_nowait, text, True, trace)
 
         except Exception:
             pass
 
-    recognizer.recognized.connect(on_recognized)
-    recognizer.start_continuous_recognition()
+    try:
+        stt = backends.stt.open(loop, channel.src_locale, args.sample_rate, args.channels, on_recognized)
+    except BaseException:
+        resumable.forget(link)
+        raise
 
     # ==========================
     # WS READER
@@ -131,9 +194,31 @@ async def handle_client(ws, args):
 
     async def ws_reader():
         try:
-            async for msg in ws:
-                if isinstance(msg, bytes):
-                    await audio_q.put(msg)
+            while True:
+                current = link.ws
+                try:
+                    async for msg in current:
+                        if isinstance(msg, bytes):
+                            link.received += 1
+                            await audio_q.put(decoder.decode(msg) if decoder else msg)
+                        elif is_silence(msg):
+                            link.received += 1
+                            await audio_q.put(None)  # fin de turno (VAD del cliente)
+                except ConnectionClosed:
+                    pass
+
+                if current is not link.ws:
+                    continue  # el cliente ya volvió por otro WebSocket (se cortó el viejo)
+
+                # cierre limpio (1000/1001): el cliente colgó, no hay nada que retomar
+                if closed_cleanly(current) or not resumable.enabled or overload.shed or closed.is_set():
+                    break
+                # conexión perdida: la sesión espera a que el cliente vuelva
+                link.detach(current)
+                if not await link.wait_attached(resumable.grace_s):
+                    resumable.expired += 1
+                    print(f"[{channel.name}] session expired: client did not resume in {resumable.grace_s:g}s")
+                    break
         finally:
             closed.set()
 
@@ -149,109 +234,132 @@ async def handle_client(ws, args):
                 except asyncio.TimeoutError:
                     continue
 
-                push_stream.write(chunk)
+                if chunk is None:
+                    stt.end_turn()
+                else:
+                    stt.write(chunk)
         finally:
-            try:
-                push_stream.close()
-            except Exception:
-                pass
-
-    # ==========================
-    # TTS WORKER
-    # ==========================
-
-    async def tts_worker():
-        nonlocal speaking
-
-        async with aiohttp.ClientSession() as session:
-
-            while not closed.is_set():
-
-                try:
-                    text = await asyncio.wait_for(text_q.get(), timeout=1)
-                except asyncio.TimeoutError:
-                    continue
-
-                try:
-                    speaking = True
-
-                    await ws.send(json.dumps({"type": "stt", "text": text}, ensure_ascii=False))
-
-                    translated = await translate_text(
-                        session,
-                        args.translator_key,
-                        args.translator_region,
-                        args.tgt_lang,
-                        text
-                    )
-
-                    await ws.send(json.dumps({"type": "translate", "text": translated}, ensure_ascii=False))
-
-                    # ===== TTS seguro =====
-
-                    synth = build_synthesizer(
-                        args.speech_key,
-                        args.speech_region,
-                        args.tts_voice
-                    )
-
-                    result = await loop.run_in_executor(
-                        None,
-                        lambda: synth.speak_text_async(translated).get()
-                    )
-
-                    if result.reason != speechsdk.ResultReason.SynthesizingAudioCompleted:
-                        raise RuntimeError("TTS failed")
-
-                    wav_bytes = result.audio_data
-
-                    del synth  # compatible ARM
-
-                    await ws.send(wav_bytes)
-
-                except Exception as e:
-                    await ws.send(json.dumps({"type": "error", "error": str(e)}, ensure_ascii=False))
-
-                finally:
-                    speaking = False
+            stt.close()
 
     tasks = [
         asyncio.create_task(ws_reader()),
         asyncio.create_task(audio_writer()),
-        asyncio.create_task(tts_worker()),
+        *pipeline.start(),
     ]
 
     try:
         await closed.wait()
     finally:
+        pipeline.cancel()
         for t in tasks:
             t.cancel()
+        resumable.forget(link)
+        if overload.shed:
+            print(f"[{channel.name}] connection shed: session over budget")
+            await link.ws.close(code=1013, reason="server overloaded")
 
-        try:
-            recognizer.stop_continuous_recognition()
-        except Exception:
-            pass
+        stt.close()
 
 
 # ==========================
 # MAIN
 # ==========================
 
-async def main():
-    args = parse_args()
+async def serve(args, stats_sink=None):
+    watchdog = Watchdog.from_args(args, args.name)
+    watchdog.start()
 
-    print(f"[{args.name}] running on ws://{args.host}:{args.port}")
+    backends = build_backends(args)
+    tracing.configure(args.trace_file, args.name)
+    registry = args.registry
 
-    async with websockets.serve(
-        lambda ws: handle_client(ws, args),
-        args.host,
-        args.port,
-        max_size=10_000_000,
-        ping_interval=20,
-        ping_timeout=20
-    ):
-        await asyncio.Future()
+    # conexiones TTS listas antes del primer cliente (compartidas entre canales)
+    for voice in registry.voices():
+        await backends.tts.warmup(voice, streaming=False, count=args.tts_warmup)
+
+    sessions = {"active": 0, "total": 0}
+    resumable = ResumeRegistry(args.resume_grace_s)
+
+    metrics.callback("translator_sessions_active", "Conexiones WebSocket abiertas", lambda: sessions["active"])
+    metrics.callback("translator_queue_depth", "Frases en cada cola del pipeline (suma de conexiones)",
+                     lambda: {k: v for k, v in pipeline_stats().items() if k.endswith("_q") or k == "in_flight"},
+                     label="queue")
+    metrics.callback("translator_overload_events_total", "Descartes, fusiones y cierres por sobrecarga",
+                     overload_stats, kind="counter", label="event")
+
+    async def serve_client(ws, channel):
+        # reconexión: la sesión sigue viva (y ya admitida), sólo cambia el WebSocket
+        link = resumable.take(resume_from_path(ws.path))
+        if link is not None:
+            try:
+                await link.attach(ws)
+            except ConnectionClosed:
+                return
+            print(f"[{link.ready['channel']}] session resumed")
+            await ws.wait_closed()
+            return
+
+        admission = watchdog.admit()
+        if admission == "reject":
+            await reject_saturated(ws)
+            return
+        sessions["active"] += 1
+        sessions["total"] += 1
+        try:
+            await handle_client(ws, args, backends, resumable, channel, degraded=admission == "degrade")
+        finally:
+            sessions["active"] -= 1
+
+    # puerto común + un puerto por canal que lo pida
+    listeners = dict(registry.ports())
+    if args.port and args.port not in listeners:
+        listeners[args.port] = registry.channels[0] if len(registry.channels) == 1 else None
+
+    async with contextlib.AsyncExitStack() as stack:
+        for port, channel in listeners.items():
+            await stack.enter_async_context(websockets.serve(
+                lambda ws, channel=channel: serve_client(ws, channel),
+                args.host,
+                port,
+                max_size=10_000_000,
+                ping_interval=20,
+                ping_timeout=20,
+                reuse_port=args.workers > 1,
+            ))
+            label = channel.name if channel else ", ".join(c.path for c in registry.channels)
+            print(f"[{label}] running on ws://{args.host}:{port} (backend: {args.backend}, pid {os.getpid()})")
+
+        stats_task = None
+        if args.stats_interval > 0:
+            stats_task = asyncio.create_task(report_stats(
+                args.name, backends, args.stats_interval,
+                extra=lambda: {"sessions": dict(sessions), "pipeline": pipeline_stats(),
+                               "overload": overload_stats(), "tracing": tracing_stats(),
+                               "profile": profiling.profile_stats(), "watchdog": watchdog.stats(),
+                               "resume": resumable.stats()}, sink=stats_sink
+            ))
+        stop_metrics = metrics.serve_metrics(args, args.name, stats_sink)
+        stop_profile = profiling.install(args, args.name)
+        try:
+            await asyncio.Future()
+        finally:
+            if stats_task:
+                stats_task.cancel()
+            if stop_metrics:
+                stop_metrics()
+            if stop_profile:
+                stop_profile()
+            watchdog.stop()
+            await backends.close()
+
+
+def main():
+    args = parse_args()
+    if args.workers > 1:
+        run_workers(serve, args, args.name)
+    else:
+        asyncio.run(serve(args))
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    main()